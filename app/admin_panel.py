@@ -11,10 +11,15 @@ from wtforms.fields import SelectField, StringField
 from wtforms.validators import DataRequired
 from dotenv import load_dotenv
 from markupsafe import Markup
-from sqlalchemy import func, case
+from sqlalchemy import func, inspect, and_
+from sqlalchemy.orm import aliased
 
 from app.config import SYNC_DATABASE_URL
-from app.database.models import Base, User, Debt, ScheduledMessage, Reminder, Referral
+from app.database.models import Base, User, Debt, ScheduledMessage, Reminder, UserBalance, ExchangeRate
+from app.database.crud import forget_user_lang
+from app.utils.kpi import get_kpi_snapshot_sync, snapshot_local_time
+from app.utils.conversion import RatesSnapshot
+from app.utils.due_queue import due_queue, REMINDER, MESSAGE
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -24,6 +29,9 @@ ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 db = SQLAlchemy()
 login_manager = LoginManager()
 
+# Пользователей на странице главной панели
+INDEX_PAGE_SIZE = 50
+
 # Словарь для перевода направлений
 DIRECTION_TRANSLATIONS = {
     'ru': {
@@ -53,6 +61,36 @@ def load_user(user_id):
     return None
 
 
+def latest_exchange_rates():
+    """Последний снимок курсов из exchange_rates: (fetched_at, {валюта: курс}) или None"""
+    latest = db.session.query(func.max(ExchangeRate.fetched_at)).scalar()
+    if latest is None:
+        return None
+    rows = db.session.query(ExchangeRate.currency, ExchangeRate.rate).filter(
+        ExchangeRate.fetched_at == latest
+    ).all()
+    return latest, {currency: rate for currency, rate in rows}
+
+
+def rebuild_user_balance(user_id: int):
+    """Пересчитать user_balances пользователя после правки долгов из админки"""
+    UserBalance.query.filter_by(user_id=user_id).delete()
+    rows = db.session.query(
+        func.coalesce(Debt.currency, 'UZS'),
+        Debt.direction,
+        func.sum(Debt.amount),
+        func.count(Debt.id)
+    ).filter(
+        Debt.user_id == user_id,
+        Debt.is_active == True,
+        Debt.closed == False
+    ).group_by(func.coalesce(Debt.currency, 'UZS'), Debt.direction).all()
+    for currency, direction, total, count in rows:
+        db.session.add(UserBalance(user_id=user_id, currency=currency, direction=direction,
+                                   total=total or 0, debts_count=count))
+    db.session.commit()
+
+
 # Кастомная главная страница со статистикой
 class SecureAdminIndexView(AdminIndexView):
     def is_accessible(self):
@@ -63,16 +101,33 @@ class SecureAdminIndexView(AdminIndexView):
 
     @expose('/')
     def index(self):
-        # читаем параметр из строки запроса
+        # читаем параметры из строки запроса
         search_user_id = request.args.get("user_id", type=int)
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
 
-        query = User.query
+        # Страница пользователей по ключу (user_id), без OFFSET
+        page_query = User.query
         if search_user_id:
-            query = query.filter(User.user_id == search_user_id)
-
-        users = query.all()
+            page_query = page_query.filter(User.user_id == search_user_id)
+        elif before is not None:
+            page_query = page_query.filter(User.user_id < before).order_by(User.user_id.desc())
+        else:
+            page_query = page_query.filter(User.user_id > (after or 0)).order_by(User.user_id)
+        page = page_query.limit(INDEX_PAGE_SIZE + 1).subquery()
+        page_user = aliased(User, page)
+
+        # Один запрос: страница пользователей + их балансы
+        rows = db.session.query(
+            page_user, UserBalance.currency, UserBalance.direction,
+            UserBalance.total, UserBalance.debts_count
+        ).outerjoin(
+            UserBalance,
+            and_(UserBalance.user_id == page_user.user_id, UserBalance.debts_count > 0)
+        ).order_by(page_user.user_id).all()
 
         users_stats = []
+        by_user = {}
         direction_map = {
             'owe': 'owe',
             'owed': 'owed',
@@ -80,40 +135,46 @@ class SecureAdminIndexView(AdminIndexView):
             'took': 'owed'
         }
 
-        for user in users:
-            stats_by_currency = db.session.query(
-                Debt.currency,
-                Debt.direction,
-                func.sum(Debt.amount).label('total')
-            ).filter(
-                Debt.user_id == user.user_id,
-                Debt.is_active == True,
-                Debt.closed == False
-            ).group_by(Debt.currency, Debt.direction).all()
-
-            currency_stats = {}
-            for currency, direction, total in stats_by_currency:
-                norm_dir = direction_map.get(direction, direction)
-                if currency not in currency_stats:
-                    currency_stats[currency] = {'owe': 0, 'owed': 0}
-                currency_stats[currency][norm_dir] = float(total or 0)
-
-            balance_by_currency = {
-                currency: amounts['owed'] - amounts['owe']
-                for currency, amounts in currency_stats.items()
-            }
-
-            users_stats.append({
-                'user': user,
-                'currency_stats': currency_stats,
-                'balance': balance_by_currency,
-                'total_debts': len([d for d in user.debts if d.is_active and not d.closed])
-            })
-
-        total_users = User.query.count()
-        total_debts = Debt.query.filter_by(is_active=True, closed=False).count()
-        total_scheduled = ScheduledMessage.query.filter_by(is_active=True, sent=False).count()
-        total_reminders = Reminder.query.filter_by(is_active=True).count()
+        for user, currency, direction, total, debts_count in rows:
+            user_stat = by_user.get(user.user_id)
+            if user_stat is None:
+                user_stat = by_user[user.user_id] = {
+                    'user': user,
+                    'currency_stats': {},
+                    'balance': {},
+                    'total_debts': 0
+                }
+                users_stats.append(user_stat)
+            if currency is None:
+                continue
+
+            norm_dir = direction_map.get(direction, direction)
+            amounts = user_stat['currency_stats'].setdefault(currency, {'owe': 0, 'owed': 0})
+            amounts[norm_dir] += float(total or 0)
+            user_stat['balance'][currency] = amounts['owed'] - amounts['owe']
+            user_stat['total_debts'] += debts_count
+
+        # Лишний (+1) пользователь только показывает, что есть следующая страница
+        has_more = len(users_stats) > INDEX_PAGE_SIZE
+        if has_more:
+            users_stats = users_stats[1:] if before is not None else users_stats[:-1]
+
+        next_after = None
+        prev_before = None
+        if users_stats and not search_user_id:
+            if before is not None:
+                next_after = users_stats[-1]['user'].user_id
+                prev_before = users_stats[0]['user'].user_id if has_more else None
+            else:
+                next_after = users_stats[-1]['user'].user_id if has_more else None
+                prev_before = users_stats[0]['user'].user_id if after else None
+
+        # Счётчики — из снимка KPI, ?refresh=1 пересчитывает
+        kpi = get_kpi_snapshot_sync(db.session, force=request.args.get('refresh') == '1')
+        total_users = kpi.get('total_users', 0)
+        total_debts = kpi.get('open_debts', 0)
+        total_scheduled = kpi.get('pending_messages', 0)
+        total_reminders = kpi.get('active_reminders', 0)
 
         return self.render(
             'admin/custom_index.html',
@@ -122,7 +183,11 @@ class SecureAdminIndexView(AdminIndexView):
             total_debts=total_debts,
             total_scheduled=total_scheduled,
             total_reminders=total_reminders,
-            search_user_id=search_user_id
+            search_user_id=search_user_id,
+            next_after=next_after,
+            prev_before=prev_before,
+            kpi=kpi,
+            kpi_updated=snapshot_local_time(kpi)
         )
 
 
@@ -206,6 +271,10 @@ class UserAdmin(SecureModelView):
             return redirect(url_for('.index_view'))
         return redirect(url_for('user_stats.details', user_id=user_id))
 
+    def after_model_change(self, form, model, is_created):
+        # Язык мог измениться — сбрасываем кэш бота
+        forget_user_lang(model.user_id)
+
     def delete_model(self, model):
         user_id = model.user_id
         # Удаляем связанные записи
@@ -215,8 +284,10 @@ class UserAdmin(SecureModelView):
             db.session.delete(msg)
         # Удаляем напоминания если есть
         Reminder.query.filter_by(user_id=user_id).delete()
+        UserBalance.query.filter_by(user_id=user_id).delete()
         db.session.delete(model)
         db.session.commit()
+        forget_user_lang(user_id)
         flash(f"✅ Пользователь {user_id} и все связанные записи удалены", "success")
         return True
 
@@ -247,6 +318,8 @@ class DebtAdmin(UserIdSelectMixin, SecureModelView):
 
     # Автоматический перевод направления при создании
     def on_model_change(self, form, model, is_created):
+        # Если долг перенесли на другого пользователя — пересчитать и старого
+        self._balance_user_ids = {model.user_id, *inspect(model).attrs.user_id.history.deleted}
         if is_created:
             # Получаем пользователя
             user = User.query.filter_by(user_id=model.user_id).first()
@@ -259,6 +332,15 @@ class DebtAdmin(UserIdSelectMixin, SecureModelView):
                         if translated:
                             flash(f"ℹ️ Направление автоматически переведено на {lang}: {translated}", "info")
 
+    # Долги правятся мимо crud бота — балансы пересчитываем здесь
+    def after_model_change(self, form, model, is_created):
+        for user_id in getattr(self, '_balance_user_ids', None) or {model.user_id}:
+            if user_id:
+                rebuild_user_balance(user_id)
+
+    def after_model_delete(self, model):
+        rebuild_user_balance(model.user_id)
+
     # Форматтер для отображения пользователя как ссылки
     def _user_link_formatter(view, context, model, name):
         if model.user_id:
@@ -290,6 +372,14 @@ class ScheduledMessageAdmin(UserIdSelectMixin, SecureModelView):
     form_columns = ('user_id', 'text', 'photo_id', 'schedule_time',
                     'sent', 'is_active')
 
+    # Бот работает в другом потоке — сообщаем его очереди сроков о правках
+    def after_model_change(self, form, model, is_created):
+        due = model.schedule_time if model.is_active and not model.sent else None
+        due_queue.push_threadsafe(MESSAGE, model.id, due)
+
+    def after_model_delete(self, model):
+        due_queue.remove_threadsafe(MESSAGE, model.id)
+
     # Форматтер для отображения пользователя как ссылки
     def _user_link_formatter(view, context, model, name):
         if model.user_id:
@@ -329,6 +419,12 @@ class ReminderAdmin(UserIdSelectMixin, SecureModelView):
 
     form_columns = ('user_id', 'text', 'due', 'repeat', 'system', 'is_active')
 
+    def after_model_change(self, form, model, is_created):
+        due_queue.push_threadsafe(REMINDER, model.id, model.due if model.is_active else None)
+
+    def after_model_delete(self, model):
+        due_queue.remove_threadsafe(REMINDER, model.id)
+
     # Форматтер для отображения пользователя как ссылки
     def _user_link_formatter(view, context, model, name):
         if model.user_id:
@@ -389,6 +485,15 @@ class UserStatsView(BaseView):
             for cur, amounts in currency_stats.items()
         }
 
+        # Общий баланс в сумах по последнему сохранённому курсу
+        total_uzs, rates_time = None, None
+        snapshot = latest_exchange_rates() if balance_by_currency else None
+        if snapshot:
+            rates_time, rates = snapshot
+            total_uzs = RatesSnapshot(rates).total(
+                ((balance, cur) for cur, balance in balance_by_currency.items()), 'UZS'
+            )
+
         # HTML прямо в методе
         template = """
                 <!doctype html>
@@ -481,6 +586,10 @@ class UserStatsView(BaseView):
             <!-- Итог -->
             <div class="mt-4">
                 <p><strong>Всего долгов:</strong> {{ total_debts }}</p>
+                {% if total_uzs is not none %}
+                    <p><strong>Баланс в UZS:</strong> {{ "%.2f"|format(total_uzs) }}
+                        <small class="text-muted">по курсу на {{ rates_time.strftime('%d.%m.%Y %H:%M') }} UTC</small></p>
+                {% endif %}
                 <a href="{{ url_for('admin.index') }}" class="btn btn-secondary">⬅ Назад</a>
             </div>
         </div>
@@ -494,6 +603,8 @@ class UserStatsView(BaseView):
             user=user,
             currency_stats=currency_stats,
             balance_by_currency=balance_by_currency,
+            total_uzs=total_uzs,
+            rates_time=rates_time,
             total_debts=len([d for d in user.debts if d.is_active and not d.closed])
         )
 
@@ -504,20 +615,10 @@ class UserStatsView(BaseView):
 class TrafficStatsView(BaseView):
     @expose('/')
     def index(self):
-        stats = (
-            db.session.query(
-                Referral.id,
-                Referral.code,
-                Referral.description,
-                Referral.is_active,
-                func.count(User.user_id).label("total"),
-                func.sum(case((User.lang == "ru", 1), else_=0)).label("ru"),
-                func.sum(case((User.lang == "uz", 1), else_=0)).label("uz"),
-            )
-            .outerjoin(User, User.referral_id == Referral.id)
-            .group_by(Referral.id, Referral.code, Referral.description, Referral.is_active)
-            .all()
-        )
+        # Из снимка KPI (пересчитывается фоновой задачей бота или ?refresh=1)
+        kpi = get_kpi_snapshot_sync(db.session, force=request.args.get('refresh') == '1')
+        stats = kpi.get('referrals', [])
+        kpi_updated = snapshot_local_time(kpi)
 
         template = """
             <!doctype html>
@@ -530,6 +631,10 @@ class TrafficStatsView(BaseView):
             <body>
             <div class="container mt-4">
                 <h1>🎯 Реферальные ссылки</h1>
+                <p class="text-muted">
+                    {% if kpi_updated %}Данные на {{ kpi_updated.strftime('%d.%m.%Y %H:%M') }} ·{% endif %}
+                    <a href="?refresh=1">🔄 Обновить</a>
+                </p>
                 <table class="table table-bordered table-striped mt-4">
                     <thead class="thead-dark">
                         <tr>
@@ -567,7 +672,7 @@ class TrafficStatsView(BaseView):
             </body>
             </html>
             """
-        return render_template_string(template, stats=stats)
+        return render_template_string(template, stats=stats, kpi_updated=kpi_updated)
 
 
 def create_admin_app():
@@ -601,6 +706,11 @@ def create_admin_app():
     {% block body %}
     <div class="container-fluid">
         <h1 class="mt-4">📊 Панель управления DebtBot</h1>
+        <p class="text-muted">
+            {% if kpi_updated %}Данные на {{ kpi_updated.strftime('%d.%m.%Y %H:%M') }} ·{% endif %}
+            🆕 новых сегодня: {{ kpi.new_users_today or 0 }} · ➕ долгов за сегодня: {{ kpi.debts_today or 0 }}
+            · <a href="{{ url_for('admin.index', refresh=1) }}">🔄 Обновить</a>
+        </p>
 
         <div class="row mt-4">
             <div class="col-md-4">
@@ -710,6 +820,19 @@ def create_admin_app():
             ℹ️ Не найдено.
         </div>
         {% endif %}
+
+        {% if prev_before or next_after %}
+        <nav class="mt-4 mb-4">
+            <ul class="pagination justify-content-center">
+                <li class="page-item {{ 'disabled' if not prev_before }}">
+                    <a class="page-link" href="{{ url_for('admin.index', before=prev_before) if prev_before else '#' }}">← Назад</a>
+                </li>
+                <li class="page-item {{ 'disabled' if not next_after }}">
+                    <a class="page-link" href="{{ url_for('admin.index', after=next_after) if next_after else '#' }}">Вперёд →</a>
+                </li>
+            </ul>
+        </nav>
+        {% endif %}
     </div>
     {% endblock %}
     '''
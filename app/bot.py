@@ -3,6 +3,7 @@ import os
 import sys
 import threading
 import logging
+from datetime import datetime
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
@@ -10,10 +11,19 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.handlers import register_all_handlers
+from app.middlewares import UserSettingsMiddleware
+from app.keyboards import validate_catalogs
 from app.database import init_db
 from app.utils.scheduler import scheduler, schedule_all_reminders
-from app.utils.broadcast import process_scheduled_messages
-from app.config import BOT_TOKEN, DEBUG
+from app.utils.broadcast import process_broadcast_jobs, start_broadcast_job
+from app.utils.delivery import delivery
+from app.utils.due_queue import due_queue
+from app.utils.currency_api import CurrencyService, close_http_session, RATES_JOB_ID, RATES_REFRESH_MINUTES
+from app.utils.fsm_storage import SQLAlchemyStorage
+from app.utils.export_utils import shutdown_export_pool
+from app.utils.webhook import run_webhook
+from app.utils.sharding import ShardRouter, run_shard_worker
+from app.config import BOT_TOKEN, DEBUG, FSM_STORAGE, BOT_MODE, BOT_WORKERS
 from app.admin_panel import create_admin_app  # <-- импорт админки
 
 logging.basicConfig(
@@ -28,8 +38,11 @@ if not BOT_TOKEN:
     sys.exit(1)
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Состояния сценариев — в БД, чтобы переживали рестарт (FSM_STORAGE=memory — по-старому)
+dp = Dispatcher(storage=MemoryStorage() if FSM_STORAGE == 'memory' else SQLAlchemyStorage())
+dp.update.outer_middleware(UserSettingsMiddleware())
 scheduler.set_bot(bot)
+delivery.set_bot(bot)
 
 @dp.errors()
 async def error_handler(update, exception):
@@ -42,6 +55,12 @@ async def error_handler(update, exception):
 
 async def on_startup():
     print("🚀 Запуск бота...")
+    problems = validate_catalogs()
+    for problem in problems:
+        print(f"⚠️ Переводы: {problem}")
+    if not problems:
+        print("✅ Переводы проверены")
+
     try:
         await init_db()
         print("✅ База данных инициализирована")
@@ -63,26 +82,38 @@ async def on_startup():
         print(f"❌ Ошибка планирования напоминаний: {e}")
 
     try:
+        # Напоминания и отложенные сообщения: спим до ближайшего срока вместо опроса БД
+        await due_queue.start()
+    except Exception as e:
+        print(f"❌ Ошибка запуска очереди сроков: {e}")
+
+    try:
+        # Продолжаем рассылки, прерванные перезапуском, и запускаем наступившие
+        await process_broadcast_jobs()
         scheduler.add_job(
-            process_scheduled_messages,
+            process_broadcast_jobs,
             'interval',
             minutes=1,
-            id='check_scheduled_messages'
+            id='broadcast_jobs',
+            replace_existing=True
         )
-        print("✅ Задача проверки сообщений добавлена")
+        print("✅ Задача обработки рассылок добавлена")
     except Exception as e:
-        print(f"❌ Ошибка добавления задачи: {e}")
+        print(f"❌ Ошибка добавления задачи рассылок: {e}")
     try:
+        # Последние курсы из БД — конвертации после рестарта не ждут сети
+        await CurrencyService.load_saved_rates()
         scheduler.add_job(
-            scheduler.send_general_reminders,
-            "interval",
-            minutes=1,
-            id="general_reminders",
-            replace_existing=True
+            CurrencyService.refresh,
+            'interval',
+            minutes=RATES_REFRESH_MINUTES,
+            id=RATES_JOB_ID,
+            replace_existing=True,
+            next_run_time=datetime.now()
         )
-        print("✅ Задача проверки пользовательских напоминаний добавлена")
+        print("✅ Задача обновления курсов добавлена")
     except Exception as e:
-        print(f"❌ Ошибка добавления задачи: {e}")
+        print(f"❌ Ошибка добавления задачи курсов: {e}")
 
     print("🎉 Бот успешно запущен!")
 
@@ -98,6 +129,18 @@ async def on_shutdown():
     except Exception as e:
         print(f"❌ Ошибка остановки планировщика: {e}")
 
+    try:
+        await due_queue.stop()
+    except Exception as e:
+        print(f"❌ Ошибка остановки очереди сроков: {e}")
+
+    try:
+        await close_http_session()
+    except Exception as e:
+        print(f"❌ Ошибка закрытия HTTP-клиента: {e}")
+
+    shutdown_export_pool()
+
     try:
         await bot.session.close()
         print("✅ Сессия бота закрыта")
@@ -106,6 +149,22 @@ async def on_shutdown():
 
     print("👋 Бот остановлен!")
 
+async def on_worker_startup():
+    # Курсы обновляет главный процесс, воркеру достаточно последних из БД
+    await CurrencyService.load_saved_rates()
+
+async def on_worker_shutdown():
+    shutdown_export_pool()
+    await close_http_session()
+    await bot.session.close()
+
+def run_update_worker(index, inbox, control):
+    """Процесс-воркер (BOT_WORKERS > 0): хендлеры для своей доли пользователей"""
+    register_all_handlers(dp)
+    dp.startup.register(on_worker_startup)
+    dp.shutdown.register(on_worker_shutdown)
+    run_shard_worker(index, dp, bot, inbox, control)
+
 # --- добавлено ---
 def run_admin():
     """Запуск Flask-Admin в отдельном потоке"""
@@ -119,10 +178,33 @@ async def main():
     # -----------------
 
     register_all_handlers(dp)
-    dp.startup.register(on_startup)
-    dp.shutdown.register(on_shutdown)
-
-    await dp.start_polling(bot)
+    allowed_updates = dp.resolve_used_update_types()
+
+    if BOT_WORKERS > 0:
+        # Главный процесс только принимает апдейты и раздаёт их воркерам по user_id
+        receiver = Dispatcher()
+        router = ShardRouter(BOT_WORKERS, run_update_worker, ops={
+            'due_push': due_queue.push,
+            'due_remove': due_queue.remove,
+            'broadcast': start_broadcast_job,
+        })
+        receiver.update.outer_middleware(router)
+        receiver.startup.register(on_startup)
+        receiver.startup.register(router.start)
+        receiver.shutdown.register(router.stop)
+        receiver.shutdown.register(on_shutdown)
+    else:
+        receiver = dp
+        receiver.startup.register(on_startup)
+        receiver.shutdown.register(on_shutdown)
+
+    if BOT_MODE == 'webhook':
+        await run_webhook(receiver, bot, allowed_updates=allowed_updates)
+    else:
+        # Если раньше работали через webhook, Telegram не отдаст апдейты в getUpdates
+        await bot.delete_webhook()
+        # Раздача воркерам мгновенная — без тасков, чтобы не нарушить порядок
+        await receiver.start_polling(bot, allowed_updates=allowed_updates, handle_as_tasks=BOT_WORKERS == 0)
 
 if __name__ == '__main__':
     try:
@@ -26,6 +26,29 @@ SYNC_DATABASE_URL = os.getenv("SYNC_DATABASE_URL") or (
 )
 
 DB_PATH = 'app/debts.db'
+# Где хранить состояния FSM: "sql" — таблица fsm_state (переживают рестарт), "memory" — в памяти процесса
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sql").lower()
+
+# Как получать апдейты: "polling" — long polling, "webhook" — Telegram сам присылает их на WEBHOOK_URL
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько апдейтов обрабатывать одновременно
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+# Процессов-обработчиков апдейтов (шардирование по user_id); 0 — всё в одном процессе
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "0"))
+
+# Сборка Excel-выгрузок: "process" — пул процессов, "thread" — пул потоков.
+# При BOT_WORKERS > 0 воркеры — daemon-процессы и не могут заводить дочерние,
+# поэтому в них всегда используется пул потоков
+EXPORT_EXECUTOR = os.getenv("EXPORT_EXECUTOR", "process").lower()
+# Сколько файлов собирается одновременно и сколько выгрузок разрешено одному пользователю
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "2"))
+EXPORT_PER_USER = int(os.getenv("EXPORT_PER_USER", "1"))
+
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 DEESEEK_API_KEY = os.getenv("DEESEEK_API_KEY")
 DEESEEK_API_URL = os.getenv("DEESEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
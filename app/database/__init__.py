@@ -1,7 +1,8 @@
-from .models import User, Debt, ScheduledMessage, Base
+from .models import User, Debt, ScheduledMessage, UserBalance, Base
 from .connection import init_db, get_db
 from .crud import (
     get_user_data,
+    get_user_settings,
     get_or_create_user,
     save_user_lang,
     save_user_notify_time,
@@ -18,11 +19,20 @@ from .crud import (
     get_debt_by_id,
     get_open_debts,
     get_due_debts,
+    count_closed_debts,
+    # Balances
+    get_user_balances,
+    rebuild_user_balances,
     # User statistics
     get_all_users_with_notifications,
     get_all_users,
+    iter_users,
+    iter_user_batches,
     get_user_count,
     get_active_debts_count,
+    # Exchange rates
+    save_exchange_rates,
+    get_exchange_rates_at,
     # Scheduled messages
     save_scheduled_message,
     get_scheduled_messages,
@@ -33,11 +43,12 @@ from .crud import (
 
 __all__ = [
     # Models
-    'User', 'Debt', 'ScheduledMessage', 'Base',
+    'User', 'Debt', 'ScheduledMessage', 'UserBalance', 'Base',
     # Connection
     'init_db', 'get_db',
     # User operations
     'get_user_data',
+    'get_user_settings',
     'get_or_create_user',
     'save_user_lang',
     'save_user_notify_time',
@@ -52,12 +63,21 @@ __all__ = [
     'get_debt_by_id',
     'get_open_debts',
     'get_due_debts',
+    'count_closed_debts',
     'soft_delete_debt',
+    # Balances
+    'get_user_balances',
+    'rebuild_user_balances',
     # User statistics
     'get_all_users_with_notifications',
     'get_all_users',
+    'iter_users',
+    'iter_user_batches',
     'get_user_count',
     'get_active_debts_count',
+    # Exchange rates
+    'save_exchange_rates',
+    'get_exchange_rates_at',
     # Scheduled messages
     'save_scheduled_message',
     'get_scheduled_messages',
@@ -1,13 +1,154 @@
 import asyncio
+import calendar
+import json
+import threading
+from time import monotonic
+from collections import OrderedDict
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update, and_, func, delete
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from sqlalchemy import update, and_, or_, func, delete
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from datetime import datetime, timedelta, date
 from .models import *
 from .connection import get_db
 
+# Кэш языков пользователей: user_id -> (lang, expires_at).
+# Ограничен по размеру (LRU) и по времени жизни, чтобы правки из веб-админки
+# подхватывались без перезапуска.
+_lang_cache: "OrderedDict[int, tuple]" = OrderedDict()
+# Кэш меняют и event loop бота, и поток веб-админки (forget_user_lang)
+_lang_cache_lock = threading.Lock()
+LANG_CACHE_SIZE = 10000
+LANG_CACHE_TTL = 600  # 10 минут
+DEFAULT_LANG = 'ru'
+
+# Размер пачки при потоковом обходе пользователей (iter_users)
+USERS_BATCH_SIZE = 1000
+
+# Форматы дат на границе crud: хендлеры и шаблоны работают со строками,
+# в БД — нативные Date/DateTime
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def _to_date(value) -> Optional[date]:
+    """'YYYY-MM-DD' / date / datetime -> date"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip()[:10], DATE_FORMAT).date()
+
+
+def _to_datetime(value) -> Optional[datetime]:
+    """'YYYY-MM-DD HH:MM[:SS]' / datetime -> datetime"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value).strip()[:16], DATETIME_FORMAT)
+
+
+def _date_str(value) -> Optional[str]:
+    """date -> 'YYYY-MM-DD' для словарей, которые отдаёт crud"""
+    if isinstance(value, (date, datetime)):
+        return value.strftime(DATE_FORMAT)
+    return value
+
+
+def _debt_values(values: dict) -> dict:
+    """Привести строковые даты долга к типам колонок"""
+    values = dict(values)
+    for key in ('date', 'due'):
+        if key in values:
+            values[key] = _to_date(values[key])
+    return values
+
+
+def remember_user_lang(user_id: int, lang: Optional[str]) -> None:
+    """Положить язык пользователя в кэш"""
+    with _lang_cache_lock:
+        _lang_cache[user_id] = (lang or DEFAULT_LANG, monotonic() + LANG_CACHE_TTL)
+        _lang_cache.move_to_end(user_id)
+        while len(_lang_cache) > LANG_CACHE_SIZE:
+            _lang_cache.popitem(last=False)
+
+
+def forget_user_lang(user_id: int) -> None:
+    """
+    Удалить язык пользователя из кэша.
+
+    Действует только на кэш текущего процесса: при BOT_WORKERS > 0 воркеры
+    подхватят язык, изменённый в веб-админке, после LANG_CACHE_TTL.
+    """
+    with _lang_cache_lock:
+        _lang_cache.pop(user_id, None)
+
+
+def get_cached_user_lang(user_id: int) -> Optional[str]:
+    """Язык из кэша без обращения к БД (None если нет или устарел)"""
+    with _lang_cache_lock:
+        entry = _lang_cache.get(user_id)
+        if entry is None:
+            return None
+        lang, expires_at = entry
+        if monotonic() >= expires_at:
+            del _lang_cache[user_id]
+            return None
+        _lang_cache.move_to_end(user_id)
+        return lang
+
+
+async def get_user_lang(user_id: int) -> str:
+    """Получить язык пользователя (сначала из кэша, затем одним запросом из БД)"""
+    lang = get_cached_user_lang(user_id)
+    if lang is not None:
+        return lang
+
+    async with get_db() as session:
+        result = await session.execute(
+            select(User.lang).where(and_(User.user_id == user_id, User.is_active == True))
+        )
+        lang = result.scalar_one_or_none()
+
+    remember_user_lang(user_id, lang)
+    return lang or DEFAULT_LANG
+
+
+async def get_user_settings(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Получить настройки пользователя одним запросом (без долгов и без создания)
+
+    Returns:
+        Словарь с lang, notify_time, currency_notify_time, referral_id
+        или None, если пользователя нет
+    """
+    async with get_db() as session:
+        result = await session.execute(
+            select(
+                User.lang,
+                User.notify_time,
+                User.currency_notify_time,
+                User.referral_id
+            ).where(and_(User.user_id == user_id, User.is_active == True))
+        )
+        row = result.first()
+
+    if row is None:
+        return None
+
+    remember_user_lang(user_id, row.lang)
+    return {
+        'user_id': user_id,
+        'lang': row.lang or DEFAULT_LANG,
+        'notify_time': row.notify_time,
+        'currency_notify_time': row.currency_notify_time,
+        'referral_id': row.referral_id
+    }
+
 
 async def get_user_data(user_id: int) -> Dict[str, Any]:
     """Получить данные пользователя с его долгами"""
@@ -32,8 +173,8 @@ async def get_user_data(user_id: int) -> Dict[str, Any]:
                 'amount': debt.amount,
                 'currency': debt.currency,
                 'direction': debt.direction,
-                'date': debt.date,
-                'due': debt.due,
+                'date': _date_str(debt.date),
+                'due': _date_str(debt.due),
                 'comment': debt.comment,
                 'closed': debt.closed
             })
@@ -88,7 +229,7 @@ async def get_due_debts_for_reminders(today_date: str):
                 .where(and_(
                     Debt.closed == False,
                     Debt.is_active == True,
-                    Debt.due <= today_date
+                    Debt.due <= _to_date(today_date)
                 ))
                 .order_by(Debt.due.asc(), Debt.user_id)
             )
@@ -103,7 +244,7 @@ async def get_due_debts_for_reminders(today_date: str):
                     'person': debt.person,
                     'amount': debt.amount,
                     'currency': debt.currency if debt.currency else 'UZS',
-                    'due': debt.due,
+                    'due': _date_str(debt.due),
                     'direction': debt.direction if debt.direction else 'owed',
                     'comment': debt.comment if debt.comment else ''
                 })
@@ -121,6 +262,7 @@ async def save_user_lang(user_id: int, lang: str) -> None:
         user = await get_or_create_user(user_id, session)
         user.lang = lang
         await session.commit()  # ДОБАВЛЕН КОММИТ
+    remember_user_lang(user_id, lang)
 
 
 async def save_user_notify_time(user_id: int, notify_time: str) -> None:
@@ -159,12 +301,20 @@ async def soft_delete_debt(debt_id: int, user_id: int = None) -> bool:
     """Мягкое удаление долга (установка is_active = False)"""
     async with get_db() as session:
         query = update(Debt).where(Debt.id == debt_id)
+        current = select(Debt).where(and_(Debt.id == debt_id, Debt.is_active == True))
 
         # Если указан user_id, добавляем проверку владельца
         if user_id is not None:
             query = query.where(Debt.user_id == user_id)
+            current = current.where(Debt.user_id == user_id)
+
+        debt = (await session.execute(current.with_for_update())).scalar_one_or_none()
+        # Ключ считаем до UPDATE: ORM синхронизирует is_active у загруженного объекта
+        key = debt and _balance_key(debt.user_id, debt.currency, debt.direction, debt.closed, debt.is_active)
+        amount = debt.amount if debt else 0
 
         result = await session.execute(query.values(is_active=False))
+        await _apply_balance_delta(session, key, -amount, -1)
         await session.commit()  # ДОБАВЛЕН КОММИТ
         return result.rowcount > 0
 
@@ -178,7 +328,111 @@ async def soft_delete_user(user_id: int) -> bool:
             .values(is_active=False)
         )
         await session.commit()  # ДОБАВЛЕН КОММИТ
-        return result.rowcount > 0
+    forget_user_lang(user_id)
+    return result.rowcount > 0
+
+
+def _upsert_insert(session: AsyncSession):
+    """insert() с on_conflict_do_update для диалекта сессии"""
+    if session.bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    return upsert
+
+
+# === USER BALANCES ===
+# user_balances — суммы открытых долгов по (user_id, валюта, направление).
+# Каждая операция с долгом применяет дельту в той же транзакции;
+# rebuild_user_balances пересчитывает таблицу с нуля (сверка по расписанию).
+
+def _balance_key(user_id, currency, direction, closed, is_active) -> Optional[Tuple[int, str, str]]:
+    """Ключ баланса, в который входит долг (None — долг не учитывается)"""
+    if not is_active or closed:
+        return None
+    return user_id, currency or 'UZS', direction
+
+
+async def _apply_balance_delta(session: AsyncSession, key: Optional[Tuple[int, str, str]],
+                               amount: int, count: int) -> None:
+    """Атомарно прибавить сумму и количество к строке баланса (upsert)"""
+    if key is None or (not amount and not count):
+        return
+
+    user_id, currency, direction = key
+    upsert = _upsert_insert(session)
+    stmt = upsert(UserBalance).values(
+        user_id=user_id, currency=currency, direction=direction,
+        total=amount, debts_count=count, updated_at=datetime.utcnow()
+    )
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[UserBalance.user_id, UserBalance.currency, UserBalance.direction],
+        set_={
+            'total': UserBalance.total + stmt.excluded.total,
+            'debts_count': UserBalance.debts_count + stmt.excluded.debts_count,
+            'updated_at': stmt.excluded.updated_at
+        }
+    ))
+
+
+async def _move_balance(session: AsyncSession, old_key, old_amount: int, new_key, new_amount: int) -> None:
+    """Перенести вклад долга из old_key в new_key"""
+    if old_key == new_key:
+        await _apply_balance_delta(session, new_key, (new_amount or 0) - (old_amount or 0), 0)
+        return
+    await _apply_balance_delta(session, old_key, -(old_amount or 0), -1)
+    await _apply_balance_delta(session, new_key, new_amount or 0, 1)
+
+
+async def get_user_balances(user_id: int) -> List[Dict[str, Any]]:
+    """Суммы открытых долгов пользователя: [{'currency', 'direction', 'total', 'count'}, ...]"""
+    async with get_db() as session:
+        result = await session.execute(
+            select(UserBalance)
+            .where(and_(UserBalance.user_id == user_id, UserBalance.debts_count > 0))
+            .order_by(UserBalance.currency, UserBalance.direction)
+        )
+        return [balance.to_dict() for balance in result.scalars().all()]
+
+
+async def rebuild_user_balances(user_id: int = None) -> int:
+    """
+    Пересчитать user_balances из debts (для всех или одного пользователя).
+
+    Returns:
+        количество строк баланса после пересчёта
+    """
+    async with get_db() as session:
+        try:
+            clear = delete(UserBalance)
+            source = (
+                select(
+                    Debt.user_id,
+                    func.coalesce(Debt.currency, 'UZS'),
+                    Debt.direction,
+                    func.sum(Debt.amount),
+                    func.count(Debt.id),
+                    func.now()
+                )
+                .where(and_(Debt.is_active == True, Debt.closed == False))
+                .group_by(Debt.user_id, func.coalesce(Debt.currency, 'UZS'), Debt.direction)
+            )
+            if user_id is not None:
+                clear = clear.where(UserBalance.user_id == user_id)
+                source = source.where(Debt.user_id == user_id)
+
+            await session.execute(clear)
+            result = await session.execute(
+                UserBalance.__table__.insert().from_select(
+                    ['user_id', 'currency', 'direction', 'total', 'debts_count', 'updated_at'], source
+                )
+            )
+            await session.commit()
+            return result.rowcount or 0
+        except Exception as e:
+            print(f"❌ Ошибка пересчёта балансов: {e}")
+            await session.rollback()
+            raise
 
 
 # === DEBT OPERATIONS ===
@@ -196,13 +450,18 @@ async def add_debt(user_id: int, debt: dict) -> int:
                 amount=debt['amount'],
                 currency=debt.get('currency', 'UZS'),
                 direction=debt['direction'],
-                date=debt['date'],
-                due=debt['due'],
+                date=_to_date(debt['date']),
+                due=_to_date(debt['due']),
                 comment=debt.get('comment', ''),
                 closed=debt.get('closed', False)
             )
             session.add(new_debt)
             await session.flush()  # Чтобы получить ID
+            await _apply_balance_delta(
+                session,
+                _balance_key(user_id, new_debt.currency, new_debt.direction, new_debt.closed, True),
+                new_debt.amount, 1
+            )
             await session.commit()  # ДОБАВЛЕН КОММИТ
 
             print(f"✅ Долг успешно сохранен с ID: {new_debt.id}")
@@ -217,11 +476,35 @@ async def update_debt(debt_id: int, updates: dict) -> bool:
     """Обновить долг"""
     async with get_db() as session:
         try:
+            values = _debt_values(updates)
+            debt = (await session.execute(
+                select(Debt)
+                .where(and_(Debt.id == debt_id, Debt.is_active == True))
+                .with_for_update()
+            )).scalar_one_or_none()
+            if debt is None:
+                return False
+
+            # Снимок до UPDATE: ORM синхронизирует поля у загруженного объекта
+            merged = {
+                'user_id': debt.user_id, 'currency': debt.currency, 'direction': debt.direction,
+                'closed': debt.closed, 'is_active': debt.is_active, 'amount': debt.amount
+            }
+            old_key = _balance_key(merged['user_id'], merged['currency'], merged['direction'],
+                                   merged['closed'], merged['is_active'])
+            old_amount = merged['amount']
+
             result = await session.execute(
                 update(Debt)
                 .where(and_(Debt.id == debt_id, Debt.is_active == True))
-                .values(**updates)
+                .values(**values)
             )
+
+            merged.update({k: v for k, v in values.items() if k in merged})
+            new_key = _balance_key(merged['user_id'], merged['currency'], merged['direction'],
+                                   merged['closed'], merged['is_active'])
+            await _move_balance(session, old_key, old_amount, new_key, merged['amount'])
+
             await session.commit()  # ДОБАВЛЕН КОММИТ
             return result.rowcount > 0
         except Exception as e:
@@ -244,6 +527,8 @@ async def clear_user_debts(user_id: int) -> bool:
                 .where(and_(Debt.user_id == user_id, Debt.is_active == True))
                 .values(is_active=False)
             )
+            # Активных долгов не осталось — балансы пользователя обнуляются
+            await session.execute(delete(UserBalance).where(UserBalance.user_id == user_id))
             await session.commit()  # ДОБАВЛЕН КОММИТ
             return result.rowcount > 0
         except Exception as e:
@@ -268,8 +553,8 @@ async def get_debt_by_id(debt_id: int) -> Optional[Dict[str, Any]]:
                 'amount': debt.amount,
                 'currency': debt.currency,
                 'direction': debt.direction,
-                'date': debt.date,
-                'due': debt.due,
+                'date': _date_str(debt.date),
+                'due': _date_str(debt.due),
                 'comment': debt.comment,
                 'closed': debt.closed
             }
@@ -298,8 +583,8 @@ async def get_open_debts(user_id: int) -> List[Dict[str, Any]]:
                 'amount': debt.amount,
                 'currency': debt.currency,
                 'direction': debt.direction,
-                'date': debt.date,
-                'due': debt.due,
+                'date': _date_str(debt.date),
+                'due': _date_str(debt.due),
                 'comment': debt.comment,
                 'closed': debt.closed
             })
@@ -308,7 +593,7 @@ async def get_open_debts(user_id: int) -> List[Dict[str, Any]]:
 
 async def get_due_debts(user_id: int, days_until_due: int) -> List[Dict[str, Any]]:
     """Получить долги, которые истекают через указанное количество дней"""
-    target_date = (datetime.now() + timedelta(days=days_until_due)).strftime('%Y-%m-%d')
+    target_date = (datetime.now() + timedelta(days=days_until_due)).date()
 
     async with get_db() as session:
         result = await session.execute(
@@ -331,14 +616,29 @@ async def get_due_debts(user_id: int, days_until_due: int) -> List[Dict[str, Any
                 'amount': debt.amount,
                 'currency': debt.currency,
                 'direction': debt.direction,
-                'date': debt.date,
-                'due': debt.due,
+                'date': _date_str(debt.date),
+                'due': _date_str(debt.due),
                 'comment': debt.comment,
                 'closed': debt.closed
             })
         return debts
 
 
+async def count_closed_debts(user_id: int, date_from: date, date_to: date) -> int:
+    """Количество закрытых долгов пользователя с Debt.date в [date_from, date_to)"""
+    async with get_db() as session:
+        result = await session.execute(
+            select(func.count(Debt.id)).where(and_(
+                Debt.user_id == user_id,
+                Debt.is_active == True,
+                Debt.closed == True,
+                Debt.date >= date_from,
+                Debt.date < date_to
+            ))
+        )
+        return result.scalar() or 0
+
+
 # === USER STATISTICS ===
 
 async def get_all_users_with_notifications() -> List[Dict[str, Any]]:
@@ -362,31 +662,142 @@ async def get_all_users_with_notifications() -> List[Dict[str, Any]]:
         return users
 
 
+async def iter_user_batches(batch_size: int = USERS_BATCH_SIZE,
+                            after: int = 0) -> AsyncIterator[List[Tuple[int, str, Optional[str], Optional[str]]]]:
+    """
+    Потоково отдать активных пользователей пачками (keyset-пагинация по user_id).
+
+    Каждая пачка — список кортежей (user_id, lang, notify_time, currency_notify_time).
+    Соединение берётся только на время запроса пачки, поэтому медленный
+    потребитель (рассылка) не держит его открытым. Память — O(batch_size).
+
+    Args:
+        batch_size: размер пачки
+        after: начать с user_id > after (для продолжения с чекпоинта)
+    """
+    last_user_id = after
+    while True:
+        async with get_db() as session:
+            result = await session.execute(
+                select(User.user_id, User.lang, User.notify_time, User.currency_notify_time)
+                .where(and_(User.is_active == True, User.user_id > last_user_id))
+                .order_by(User.user_id)
+                .limit(batch_size)
+            )
+            rows = [tuple(row) for row in result.all()]
+
+        if not rows:
+            return
+
+        yield rows
+
+        if len(rows) < batch_size:
+            return
+        last_user_id = rows[-1][0]
+
+
+async def iter_users(batch_size: int = USERS_BATCH_SIZE,
+                     after: int = 0) -> AsyncIterator[Tuple[int, str, Optional[str], Optional[str]]]:
+    """Потоково отдать активных пользователей по одному: (user_id, lang, notify_time, currency_notify_time)"""
+    async for batch in iter_user_batches(batch_size, after):
+        for row in batch:
+            yield row
+
+
 async def get_all_users() -> List[Dict[str, Any]]:
-    """Получить всех активных пользователей"""
+    """
+    Получить всех активных пользователей списком.
+    Для массовых операций лучше iter_users() — он не держит всех в памяти.
+    """
+    try:
+        return [
+            {
+                'user_id': user_id,
+                'lang': lang,
+                'notify_time': notify_time,
+                'currency_notify_time': currency_notify_time
+            }
+            async for user_id, lang, notify_time, currency_notify_time in iter_users()
+        ]
+    except Exception as e:
+        print(f"❌ Ошибка получения списка пользователей: {e}")
+        return []
+
+
+async def get_debt_digest(slot: str, due_until: date) -> Dict[int, Dict[str, Any]]:
+    """
+    Долги для ежедневной сводки всего минутного бакета одним запросом
+
+    Args:
+        slot: время уведомления 'HH:MM' (User.notify_time)
+        due_until: крайняя дата срока (date или 'YYYY-MM-DD') включительно, просроченные тоже попадают
+
+    Returns:
+        {user_id: {'lang': ..., 'debts': [...]}} — только пользователи, у которых есть такие долги;
+        due в долгах — date
+    """
+    digest: Dict[int, Dict[str, Any]] = {}
+    async with get_db() as session:
+        result = await session.execute(
+            select(
+                Debt.user_id, User.lang, Debt.id, Debt.person, Debt.amount,
+                Debt.currency, Debt.direction, Debt.due
+            )
+            .join(User, User.user_id == Debt.user_id)
+            .where(and_(
+                User.is_active == True,
+                User.notify_time == slot,
+                Debt.is_active == True,
+                Debt.closed == False,
+                Debt.due <= _to_date(due_until)
+            ))
+            .order_by(Debt.user_id, Debt.id)
+        )
+        for row in result:
+            entry = digest.get(row.user_id)
+            if entry is None:
+                entry = digest[row.user_id] = {'lang': row.lang, 'debts': []}
+            entry['debts'].append({
+                'id': row.id,
+                'person': row.person,
+                'amount': row.amount,
+                'currency': row.currency,
+                'direction': row.direction,
+                'due': row.due
+            })
+    return digest
+
+
+async def get_users_by_currency_time(slot: str) -> List[Dict[str, Any]]:
+    """Пользователи минутного бакета валютных уведомлений (currency_notify_time == 'HH:MM')"""
     try:
         async with get_db() as session:
             result = await session.execute(
-                select(User)
-                .where(User.is_active == True)
+                select(User.user_id, User.lang)
+                .where(and_(User.is_active == True, User.currency_notify_time == slot))
                 .order_by(User.user_id)
             )
-            users_rows = result.scalars().all()
-
-            users = []
-            for user in users_rows:
-                users.append({
-                    'user_id': user.user_id,
-                    'lang': user.lang,
-                    'notify_time': user.notify_time,
-                    'currency_notify_time': user.currency_notify_time  # ✅ ДОБАВЬ ЭТУ СТРОКУ
-                })
-            return users
+            return [{'user_id': row.user_id, 'lang': row.lang} for row in result]
     except Exception as e:
-        print(f"❌ Ошибка получения списка пользователей: {e}")
+        print(f"❌ Ошибка получения бакета валютных уведомлений {slot}: {e}")
         return []
 
 
+async def get_notify_buckets() -> Dict[str, Dict[str, int]]:
+    """Размеры минутных бакетов: {'debt': {'09:00': N, ...}, 'currency': {...}}"""
+    buckets = {'debt': {}, 'currency': {}}
+    async with get_db() as session:
+        for kind, column in (('debt', User.notify_time), ('currency', User.currency_notify_time)):
+            result = await session.execute(
+                select(column, func.count(User.user_id))
+                .where(and_(User.is_active == True, column.isnot(None)))
+                .group_by(column)
+                .order_by(column)
+            )
+            buckets[kind] = {slot: count for slot, count in result}
+    return buckets
+
+
 async def get_user_count() -> int:
     """Получить количество активных пользователей"""
     try:
@@ -420,6 +831,96 @@ async def get_active_debts_count() -> int:
         return 0
 
 
+# === EXCHANGE RATES ===
+
+async def save_exchange_rates(rates: Dict[str, float], fetched_at: datetime = None) -> datetime:
+    """Сохранить снимок курсов (по строке на валюту с общим fetched_at)"""
+    fetched_at = fetched_at or datetime.utcnow()
+    async with get_db() as session:
+        try:
+            session.add_all([
+                ExchangeRate(fetched_at=fetched_at, currency=currency, rate=rate)
+                for currency, rate in rates.items()
+            ])
+            await session.commit()
+            return fetched_at
+        except Exception as e:
+            print(f"❌ Ошибка сохранения курсов: {e}")
+            await session.rollback()
+            raise
+
+
+async def get_exchange_rates_at(moment: datetime = None) -> Optional[Tuple[datetime, Dict[str, float]]]:
+    """
+    Последний снимок курсов на момент moment (по умолчанию — самый свежий).
+
+    Returns:
+        (fetched_at, {валюта: курс}) или None, если снимков нет
+    """
+    async with get_db() as session:
+        latest = select(func.max(ExchangeRate.fetched_at))
+        if moment is not None:
+            latest = latest.where(ExchangeRate.fetched_at <= moment)
+
+        result = await session.execute(
+            select(ExchangeRate.fetched_at, ExchangeRate.currency, ExchangeRate.rate)
+            .where(ExchangeRate.fetched_at == latest.scalar_subquery())
+        )
+        rows = result.all()
+        if not rows:
+            return None
+        return rows[0].fetched_at, {row.currency: row.rate for row in rows}
+
+
+# === FSM STATE ===
+# Хранилище состояний aiogram: app/utils/fsm_storage.py держит их в памяти
+# и пачками сбрасывает сюда.
+
+async def get_fsm_state(key: str) -> Optional[FsmState]:
+    """Строка состояния по ключу"""
+    async with get_db() as session:
+        return await session.get(FsmState, key)
+
+
+async def save_fsm_states(rows: List[Dict[str, Any]], delete_keys: List[str] = ()) -> None:
+    """
+    Записать пачку состояний одной транзакцией.
+    rows — [{'key', 'state', 'data'}] (upsert), delete_keys — очищенные состояния.
+    """
+    if not rows and not delete_keys:
+        return
+
+    async with get_db() as session:
+        try:
+            if rows:
+                now = datetime.utcnow()
+                upsert = _upsert_insert(session)
+                stmt = upsert(FsmState).values([{**row, 'updated_at': now} for row in rows])
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[FsmState.key],
+                    set_={
+                        'state': stmt.excluded.state,
+                        'data': stmt.excluded.data,
+                        'updated_at': stmt.excluded.updated_at,
+                    }
+                ))
+            if delete_keys:
+                await session.execute(delete(FsmState).where(FsmState.key.in_(list(delete_keys))))
+            await session.commit()
+        except Exception as e:
+            print(f"❌ Ошибка сохранения состояний FSM: {e}")
+            await session.rollback()
+            raise
+
+
+async def purge_fsm_states(older_than: datetime) -> int:
+    """Удалить брошенные состояния (не менялись с older_than)"""
+    async with get_db() as session:
+        result = await session.execute(delete(FsmState).where(FsmState.updated_at < older_than))
+        await session.commit()
+        return result.rowcount
+
+
 # === SCHEDULED MESSAGES ===
 
 async def save_scheduled_message(user_id: int, text: str, photo_id: str = None, schedule_time: str = None) -> int:
@@ -430,7 +931,7 @@ async def save_scheduled_message(user_id: int, text: str, photo_id: str = None,
                 user_id=user_id,
                 text=text,
                 photo_id=photo_id,
-                schedule_time=schedule_time
+                schedule_time=_to_datetime(schedule_time)
             )
             session.add(new_message)
             await session.flush()
@@ -476,7 +977,7 @@ async def mark_message_as_sent(message_id: int) -> bool:
 
 async def get_pending_scheduled_messages() -> List[Dict[str, Any]]:
     """Получить все ожидающие отправки запланированные сообщения"""
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current_time = datetime.now()
 
     async with get_db() as session:
         result = await session.execute(
@@ -497,11 +998,47 @@ async def get_pending_scheduled_messages() -> List[Dict[str, Any]]:
                 'user_id': message.user_id,
                 'text': message.text,
                 'photo_id': message.photo_id,
-                'schedule_time': message.schedule_time
+                'schedule_time': message.schedule_time.strftime(DATETIME_FORMAT)
             })
         return messages
 
 
+async def get_pending_message_times() -> List[Tuple[int, datetime]]:
+    """Сроки неотправленных сообщений для очереди сроков"""
+    async with get_db() as session:
+        result = await session.execute(
+            select(ScheduledMessage.id, ScheduledMessage.schedule_time).where(and_(
+                ScheduledMessage.sent == False,
+                ScheduledMessage.is_active == True
+            ))
+        )
+        return [(row.id, row.schedule_time) for row in result]
+
+
+async def get_scheduled_messages_by_ids(message_ids: List[int]) -> List[Dict[str, Any]]:
+    """Неотправленные сообщения по списку id, срок которых наступил"""
+    if not message_ids:
+        return []
+    async with get_db() as session:
+        result = await session.execute(
+            select(ScheduledMessage)
+            .where(and_(
+                ScheduledMessage.id.in_(message_ids),
+                ScheduledMessage.sent == False,
+                ScheduledMessage.is_active == True,
+                ScheduledMessage.schedule_time <= datetime.now()
+            ))
+            .order_by(ScheduledMessage.schedule_time)
+        )
+        return [{
+            'id': message.id,
+            'user_id': message.user_id,
+            'text': message.text,
+            'photo_id': message.photo_id,
+            'schedule_time': message.schedule_time.strftime(DATETIME_FORMAT)
+        } for message in result.scalars().all()]
+
+
 async def delete_scheduled_message(message_id: int) -> bool:
     """Мягкое удаление запланированного сообщения"""
     async with get_db() as session:
@@ -519,6 +1056,77 @@ async def delete_scheduled_message(message_id: int) -> bool:
             raise
 
 
+# ==================== РАССЫЛКИ (ЗАДАЧИ С ЧЕКПОИНТОМ) ====================
+
+async def create_broadcast_job(text: str, photo_id: str = None, buttons: list = None,
+                               admin_id: int = None, run_at: datetime = None) -> int:
+    """Создать задачу рассылки, вернуть её ID"""
+    async with get_db() as session:
+        job = BroadcastJob(
+            admin_id=admin_id,
+            text=text,
+            photo_id=photo_id,
+            buttons=json.dumps(buttons, ensure_ascii=False) if buttons else None,
+            status='pending',
+            run_at=run_at
+        )
+        session.add(job)
+        await session.commit()
+        return job.id
+
+
+async def get_broadcast_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """Получить задачу рассылки"""
+    async with get_db() as session:
+        job = await session.get(BroadcastJob, job_id)
+        return job.to_dict() if job else None
+
+
+async def get_runnable_broadcast_jobs(now: datetime) -> List[Dict[str, Any]]:
+    """
+    Задачи, которые нужно (про)должать: прерванные running
+    и pending, у которых наступило время отправки
+    """
+    async with get_db() as session:
+        result = await session.execute(
+            select(BroadcastJob)
+            .where(
+                (BroadcastJob.status == 'running') |
+                (and_(
+                    BroadcastJob.status == 'pending',
+                    (BroadcastJob.run_at.is_(None)) | (BroadcastJob.run_at <= now)
+                ))
+            )
+            .order_by(BroadcastJob.id)
+        )
+        return [job.to_dict() for job in result.scalars().all()]
+
+
+async def update_broadcast_job(job_id: int, **values) -> None:
+    """Обновить поля задачи рассылки"""
+    async with get_db() as session:
+        await session.execute(
+            update(BroadcastJob).where(BroadcastJob.id == job_id).values(**values)
+        )
+        await session.commit()
+
+
+async def checkpoint_broadcast_job(job_id: int, cursor: int, sent: int, errors: int, blocked: int) -> None:
+    """Зафиксировать обработанный чанк: сдвинуть cursor и прибавить счётчики"""
+    async with get_db() as session:
+        await session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(
+                cursor=cursor,
+                sent_count=BroadcastJob.sent_count + sent,
+                error_count=BroadcastJob.error_count + errors,
+                blocked_count=BroadcastJob.blocked_count + blocked
+            )
+        )
+        await session.commit()
+
+
 async def execute_query_safely(query_func, *args, **kwargs):
     """
     Безопасное выполнение запроса с обработкой ошибок сессии
@@ -718,56 +1326,113 @@ async def get_user_currency_time(session, user_id: int) -> str | None:
         return None
     return user.currency_notify_time
 
-async def get_due_reminders(now):
-    start = now.replace(second=0, microsecond=0)
-    end = start + timedelta(minutes=1)
 
+async def get_reminder_due_times(since: datetime) -> List[Tuple[int, datetime]]:
+    """
+    Сроки активных напоминаний для очереди сроков.
+    Повторяющиеся — все, разовые — только со сроком не раньше since.
+    """
     async with get_db() as session:
         result = await session.execute(
-            select(Reminder).where(
-                Reminder.due >= start,
-                Reminder.due < end,
-                Reminder.repeat == "none",
-                Reminder.is_active.is_(True)
-            )
+            select(Reminder.id, Reminder.due).where(and_(
+                Reminder.is_active == True,
+                or_(Reminder.repeat != "none", Reminder.due >= since)
+            ))
         )
-        reminders = result.scalars().all()
-        print(f"📋 Найдено {len(reminders)} одноразовых активных напоминаний")
-        return [{
-            'id': r.id,
-            'user_id': r.user_id,
-            'text': r.text,
-            'due': r.due,
-            'repeat': r.repeat,
-            'is_active': r.is_active
-        } for r in reminders]
+        return [(row.id, row.due) for row in result if row.due is not None]
 
-async def get_due_repeating_reminders(now):
+
+def next_reminder_due(due: datetime, repeat: str, now: datetime) -> Optional[datetime]:
+    """
+    Следующий срок повторяющегося напоминания, строго позже now.
+    Пропущенные за время простоя повторы не досылаются. None — неизвестный repeat.
+    """
+    while due <= now:
+        if repeat == "daily":
+            due = due + timedelta(days=1)
+        elif repeat == "monthly":
+            next_month = due.month + 1
+            next_year = due.year
+            if next_month > 12:
+                next_month = 1
+                next_year += 1
+            max_day = calendar.monthrange(next_year, next_month)[1]
+            due = due.replace(year=next_year, month=next_month, day=min(due.day, max_day))
+        else:
+            return None
+    return due
+
+
+async def claim_due_reminders(reminder_ids: List[int], now: datetime) -> List[Dict[str, Any]]:
+    """
+    Забрать наступившие напоминания одной транзакцией.
+
+    Разовые выключаются одним UPDATE ... RETURNING, повторяющимся новый срок
+    считается в памяти и записывается одним пакетным UPDATE. Строки, которые
+    уже забрал другой процесс, пропускаются. У каждого напоминания в ответе
+    есть lang владельца и next_due (None для разовых).
+    """
+    if not reminder_ids:
+        return []
+
+    claimed: List[Dict[str, Any]] = []
     async with get_db() as session:
-        result = await session.execute(
-            select(Reminder).where(
-                Reminder.due <= now,
-                Reminder.repeat != "none",
-                Reminder.is_active == True  # ← Добавьте эту проверку
+        try:
+            result = await session.execute(
+                update(Reminder)
+                .where(and_(
+                    Reminder.id.in_(reminder_ids),
+                    Reminder.is_active == True,
+                    Reminder.repeat == "none",
+                    Reminder.due <= now
+                ))
+                .values(is_active=False)
+                .returning(Reminder.id, Reminder.user_id, Reminder.text, Reminder.due, Reminder.repeat)
+                .execution_options(synchronize_session=False)
             )
-        )
-        reminders = result.scalars().all()
-        return [{
-            'id': r.id,
-            'user_id': r.user_id,
-            'text': r.text,
-            'due': r.due,
-            'repeat': r.repeat,
-            'is_active': r.is_active
-        } for r in reminders]
-# обновить дату напоминания
-async def update_reminder_due(reminder_id, new_due):
-    async with get_db() as session:
-        reminder = await session.get(Reminder, reminder_id)
-        if reminder:
-            reminder.due = new_due
+            for row in result:
+                claimed.append({'id': row.id, 'user_id': row.user_id, 'text': row.text,
+                                'due': row.due, 'repeat': row.repeat, 'next_due': None})
+
+            result = await session.execute(
+                select(Reminder.id, Reminder.user_id, Reminder.text, Reminder.due, Reminder.repeat)
+                .where(and_(
+                    Reminder.id.in_(reminder_ids),
+                    Reminder.is_active == True,
+                    Reminder.repeat != "none",
+                    Reminder.due <= now
+                ))
+                .with_for_update(skip_locked=True)
+            )
+            moves = []
+            for row in result:
+                next_due = next_reminder_due(row.due, row.repeat, now)
+                claimed.append({'id': row.id, 'user_id': row.user_id, 'text': row.text,
+                                'due': row.due, 'repeat': row.repeat, 'next_due': next_due})
+                if next_due is not None:
+                    moves.append({'id': row.id, 'due': next_due})
+
+            if moves:
+                # ORM bulk UPDATE по первичному ключу — один executemany
+                await session.execute(update(Reminder), moves)
+
             await session.commit()
+        except Exception as e:
+            print(f"❌ Ошибка при захвате напоминаний: {e}")
+            await session.rollback()
+            raise
+
+        if claimed:
+            langs = await session.execute(
+                select(User.user_id, User.lang).where(
+                    User.user_id.in_({item['user_id'] for item in claimed})
+                )
+            )
+            lang_by_user = {row.user_id: row.lang for row in langs}
+            for item in claimed:
+                item['lang'] = lang_by_user.get(item['user_id'])
 
+    return claimed
 
 
 # получить валютные настройки пользователя
@@ -805,13 +1470,21 @@ async def create_debts_from_ai(debts_data: List[Dict[str, Any]]) -> List[Dict[st
                     amount=debt_data["amount"],
                     currency=debt_data["currency"],
                     direction=debt_data["direction"],
-                    date=debt_data.get("date", datetime.utcnow().date().isoformat()),
-                    due=debt_data["due"],
+                    date=_to_date(debt_data.get("date")) or datetime.utcnow().date(),
+                    due=_to_date(debt_data["due"]),
                     comment=debt_data.get("comment", "")
                 )
                 debts_to_add.append(new_debt)
                 session.add(new_debt)
 
+            await session.flush()
+            for debt in debts_to_add:
+                await _apply_balance_delta(
+                    session,
+                    _balance_key(debt.user_id, debt.currency, debt.direction, debt.closed, True),
+                    debt.amount, 1
+                )
+
             # 🔧 Один commit для всех долгов
             await session.commit()
 
@@ -824,8 +1497,8 @@ async def create_debts_from_ai(debts_data: List[Dict[str, Any]]) -> List[Dict[st
                     'amount': debt.amount,
                     'currency': debt.currency,
                     'direction': debt.direction,
-                    'date': debt.date,
-                    'due': debt.due,
+                    'date': _date_str(debt.date),
+                    'due': _date_str(debt.due),
                     'comment': debt.comment,
                     'closed': debt.closed
                 })
@@ -841,7 +1514,7 @@ async def create_debts_from_ai(debts_data: List[Dict[str, Any]]) -> List[Dict[st
 async def count_user_debts_today(user_id: int) -> int:
     """Подсчитывает количество долгов, созданных пользователем сегодня"""
     async with get_db() as session:
-        today = datetime.now().date().isoformat()
+        today = datetime.now().date()
         result = await session.execute(
             select(func.count(Debt.id)).where(
                 Debt.user_id == user_id,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, Date, DateTime, Float, ForeignKey, Index, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -30,8 +30,8 @@ class Debt(Base):
     amount = Column(Integer, nullable=False)
     currency = Column(String, default='UZS')
     direction = Column(String, nullable=False)  # 'owe' или 'owed'
-    date = Column(String, nullable=False)
-    due = Column(String, nullable=False)
+    date = Column(Date, nullable=False)
+    due = Column(Date, nullable=False)
     comment = Column(Text, default='')
     closed = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)  # Для soft delete
@@ -48,7 +48,7 @@ class ScheduledMessage(Base):
     user_id = Column(BigInteger, ForeignKey('users.user_id'), nullable=False)  # Изменено на BigInteger
     text = Column(Text, nullable=False)
     photo_id = Column(String, nullable=True)
-    schedule_time = Column(String, nullable=False)
+    schedule_time = Column(DateTime, nullable=False)
     sent = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -80,6 +80,91 @@ class Reminder(Base):
             'created_at': self.created_at
         }
 
+class BroadcastJob(Base):
+    """Рассылка как задача с чекпоинтом: после перезапуска продолжается с cursor"""
+    __tablename__ = 'broadcast_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    admin_id = Column(BigInteger, nullable=True)            # кто запустил (ему идёт прогресс)
+    text = Column(Text, nullable=False)
+    photo_id = Column(String, nullable=True)
+    buttons = Column(Text, nullable=True)                   # JSON: [{"text": ..., "url": ...}]
+    status = Column(String, default='pending')              # pending, running, done, cancelled
+    run_at = Column(DateTime, nullable=True)                # None — отправить сразу
+    cursor = Column(BigInteger, default=0)                  # последний обработанный user_id
+    total = Column(Integer, default=0)
+    sent_count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    blocked_count = Column(Integer, default=0)
+    progress_message_id = Column(Integer, nullable=True)    # сообщение админу, которое редактируем
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'admin_id': self.admin_id,
+            'text': self.text,
+            'photo_id': self.photo_id,
+            'buttons': self.buttons,
+            'status': self.status,
+            'run_at': self.run_at,
+            'cursor': self.cursor or 0,
+            'total': self.total or 0,
+            'sent_count': self.sent_count or 0,
+            'error_count': self.error_count or 0,
+            'blocked_count': self.blocked_count or 0,
+            'progress_message_id': self.progress_message_id,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class UserBalance(Base):
+    """Суммы открытых долгов пользователя по (валюта, направление), обновляются в crud вместе с долгами"""
+    __tablename__ = 'user_balances'
+
+    user_id = Column(BigInteger, ForeignKey('users.user_id'), primary_key=True)
+    currency = Column(String, primary_key=True)
+    direction = Column(String, primary_key=True)            # 'owe' или 'owed'
+    total = Column(BigInteger, nullable=False, default=0)   # сумма amount открытых долгов
+    debts_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'currency': self.currency,
+            'direction': self.direction,
+            'total': self.total or 0,
+            'count': self.debts_count or 0
+        }
+
+class KpiSnapshot(Base):
+    """Снимок KPI админки (app/utils/kpi.py), data — JSON"""
+    __tablename__ = 'kpi_snapshots'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    data = Column(Text, nullable=False)
+
+class ExchangeRate(Base):
+    """Снимок курса валюты: сколько UZS за 1 единицу на момент fetched_at"""
+    __tablename__ = 'exchange_rates'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    fetched_at = Column(DateTime, nullable=False, index=True)
+    currency = Column(String, nullable=False)
+    rate = Column(Float, nullable=False)
+
+class FsmState(Base):
+    """Состояние FSM aiogram (app/utils/fsm_storage.py), data — JSON"""
+    __tablename__ = 'fsm_state'
+
+    key = Column(String(255), primary_key=True)             # ключ DefaultKeyBuilder
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
 class Referral(Base):
     __tablename__ = 'referrals'
 
@@ -93,6 +178,45 @@ class Referral(Base):
 
 
 
+# ==================== ИНДЕКСЫ ====================
+# Под горячие запросы crud.py. Условия частичных индексов записаны так же,
+# как их рендерит SQLAlchemy в запросах (is_active == True -> "is_active = 1"
+# в SQLite), иначе планировщик SQLite их не применит.
+
+# Все выборки долгов пользователя: user_id + is_active (+ closed)
+Index('ix_debts_user_active_closed', Debt.user_id, Debt.is_active, Debt.closed)
+# Открытые долги по сроку: ежедневная сводка и напоминания о просрочке
+Index(
+    'ix_debts_open_due', Debt.due, Debt.user_id,
+    postgresql_where=and_(Debt.is_active == True, Debt.closed == False),
+    sqlite_where=and_(Debt.is_active == True, Debt.closed == False)
+)
+
+# Планировщик: активные напоминания по типу повтора и времени
+Index('ix_reminders_active_repeat_due', Reminder.is_active, Reminder.repeat, Reminder.due)
+# Список напоминаний пользователя
+Index('ix_reminders_user_active', Reminder.user_id, Reminder.is_active)
+
+# Неотправленные запланированные сообщения по времени
+Index(
+    'ix_scheduled_messages_pending', ScheduledMessage.schedule_time,
+    postgresql_where=and_(ScheduledMessage.sent == False, ScheduledMessage.is_active == True),
+    sqlite_where=and_(ScheduledMessage.sent == False, ScheduledMessage.is_active == True)
+)
+
+# Минутные бакеты уведомлений (minute_wheel)
+Index(
+    'ix_users_notify_time', User.notify_time,
+    postgresql_where=User.is_active == True,
+    sqlite_where=User.is_active == True
+)
+Index(
+    'ix_users_currency_notify_time', User.currency_notify_time,
+    postgresql_where=User.is_active == True,
+    sqlite_where=User.is_active == True
+)
+
+
 def safe_str(value):
     """Безопасное преобразование в строку"""
     if value is None:
@@ -6,24 +6,23 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from datetime import datetime
-import asyncio
 import os
 import traceback
 
 from sqlalchemy import select
 
 from app.database import (
-    get_all_users,
+    iter_user_batches,
     get_user_count,
-    get_active_debts_count,
-    save_scheduled_message, get_db,
+    get_db,
 )
 from app.database.crud import get_referrals, create_referral, deactivate_referral, get_referral_stats, \
     get_referral_by_id, activate_referral
 from app.database.models import Referral
 from app.keyboards import CallbackData
 from app.states import AdminBroadcast, AdminReferral
-from app.utils.broadcast import send_broadcast_to_all_users, send_scheduled_broadcast_with_stats
+from app.utils.broadcast import enqueue_broadcast, build_buttons_markup
+from app.utils.kpi import get_kpi_snapshot, snapshot_local_time
 
 # Пытаемся импортировать планировщик (если есть)
 try:
@@ -61,6 +60,7 @@ def kb_admin_main() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
         [InlineKeyboardButton(text="🎯 Реферальные ссылки", callback_data="admin_referrals")],
+        [InlineKeyboardButton(text="🔄 Обновить статистику", callback_data="admin_refresh_stats")],
         [InlineKeyboardButton(text="🌐 Веб‑админка", url="http://79.133.183.213:5000/admin")],
         [InlineKeyboardButton(text="🏠Главное меню", callback_data=CallbackData.BACK_MAIN)],
     ])
@@ -77,24 +77,28 @@ def is_admin(user_id: int) -> bool:
     return res
 
 
-async def get_admin_stats_safely():
-    print("[get_admin_stats_safely] Получаем статистику")
-    user_count, active_debts = 0, 0
-    for _ in range(3):
-        try:
-            user_count = await get_user_count()
-            break
-        except Exception as e:
-            print(f"[get_admin_stats_safely] Ошибка user_count: {e}")
-            await asyncio.sleep(0.1)
-    for _ in range(3):
-        try:
-            active_debts = await get_active_debts_count()
-            break
-        except Exception as e:
-            print(f"[get_admin_stats_safely] Ошибка active_debts: {e}")
-            await asyncio.sleep(0.1)
-    return user_count, active_debts
+async def get_admin_stats_safely(force: bool = False) -> dict:
+    """Снимок KPI (из памяти / БД; force=True — пересчитать)"""
+    print(f"[get_admin_stats_safely] Получаем статистику (force={force})")
+    try:
+        return await get_kpi_snapshot(force=force)
+    except Exception as e:
+        print(f"[get_admin_stats_safely] Ошибка: {e}")
+        return {}
+
+
+def format_admin_stats(kpi: dict) -> str:
+    """Текст главного экрана админки"""
+    text = (
+        f"📊 Пользователей: {kpi.get('active_users', 0)}\n"
+        f"📄 Активных долгов: {kpi.get('open_debts', 0)}\n"
+        f"🆕 Новых сегодня: {kpi.get('new_users_today', 0)}\n"
+        f"➕ Долгов за сегодня: {kpi.get('debts_today', 0)}"
+    )
+    updated = snapshot_local_time(kpi)
+    if updated:
+        text += f"\n\n🕒 Обновлено: {updated.strftime('%H:%M')}"
+    return text
 
 
 def build_broadcast_menu(data: dict) -> InlineKeyboardMarkup:
@@ -139,15 +143,7 @@ def build_buttons_preview_kb(buttons: list[dict]) -> InlineKeyboardMarkup:
 
 def build_final_keyboard(buttons: list[dict]) -> InlineKeyboardMarkup | None:
     print(f"[build_final_keyboard] buttons={buttons}")
-    if not buttons:
-        return None
-    rows = []
-    for btn in buttons:
-        text = (btn.get("text") or "").strip()
-        url = (btn.get("url") or "").strip()
-        if text and url:
-            rows.append([InlineKeyboardButton(text=text, url=url)])
-    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+    return build_buttons_markup(buttons)
 
 
 async def safe_edit_or_send(call: CallbackQuery, text: str):
@@ -192,9 +188,9 @@ async def admin_panel(message: Message, state: FSMContext):
     await state.clear()
     if not is_admin(message.from_user.id):
         return await message.answer("Нет доступа")
-    user_count, active_debts = await get_admin_stats_safely()
+    kpi = await get_admin_stats_safely()
 
-    await message.answer(f"📊 Пользователей: {user_count}\n📄 Активных долгов: {active_debts}", reply_markup=kb_admin_main())
+    await message.answer(format_admin_stats(kpi), reply_markup=kb_admin_main())
 
 
 @router.callback_query(F.data == "admin_back")
@@ -206,10 +202,9 @@ async def admin_back(call: CallbackQuery, state: FSMContext):
         return
 
     await state.clear()
-    user_count, active_debts = await get_admin_stats_safely()
+    kpi = await get_admin_stats_safely()
 
-
-    text = f"📊 Пользователей: {user_count}\n📄 Активных долгов: {active_debts}"
+    text = format_admin_stats(kpi)
 
     # Безопасно: если текущее сообщение текстовое — редактируем, иначе шлём новое
     try:
@@ -232,14 +227,18 @@ async def admin_users_list(call: CallbackQuery):
     if not is_admin(call.from_user.id):
         return
     try:
-        users = await get_all_users()
-        cnt = len(users) if users else 0
+        cnt = await get_user_count()
         print(f"[admin_users_list] users={cnt}")
-        if not users:
+        if not cnt:
             return await safe_edit_or_send(call, "Пользователей нет")
-        text = "\n\n".join([f"{i+1}. ID: {u['user_id']}" for i, u in enumerate(users[:10])])
-        if len(users) > 10:
-            text += f"\n... и ещё {len(users)-10}"
+        # Показываем только первые 10 — одна маленькая пачка вместо всех пользователей
+        first = []
+        async for batch in iter_user_batches(batch_size=10):
+            first = batch
+            break
+        text = "\n\n".join([f"{i+1}. ID: {row[0]}" for i, row in enumerate(first)])
+        if cnt > 10:
+            text += f"\n... и ещё {cnt-10}"
         await safe_edit_or_send(call, text)
     except Exception as e:
         log_exc("[admin_users_list] error", e)
@@ -650,7 +649,6 @@ async def send_now(call: CallbackQuery, state: FSMContext):
 
     photo_id = data.get("broadcast_photo")
     buttons = data.get("buttons", [])
-    markup = build_final_keyboard(buttons)
 
     # 2️⃣ Удаляем предпросмотр и меню, если они были
     if preview_id := data.get("preview_msg_id"):
@@ -665,44 +663,32 @@ async def send_now(call: CallbackQuery, state: FSMContext):
     # 3️⃣ Сбрасываем состояние
     await state.clear()
 
-    # 4️⃣ Показываем статус (временное сообщение)
-
-
-    # 5️⃣ Отправляем рассылку
+    # 4️⃣ Ставим рассылку в очередь: прогресс придёт одним сообщением,
+    # которое воркер редактирует, а после перезапуска рассылка продолжится
     try:
-        res = await send_broadcast_to_all_users(text, photo_id, call.from_user.id)
+        job_id = await enqueue_broadcast(text, photo_id, buttons, admin_id=call.from_user.id)
+        print(f"[send_now] создана рассылка #{job_id}")
     except Exception as e:
-        log_exc("[send_now] ошибка отправки", e)
-        res = None
-
-    # 6️⃣ Разбираем результат
-    if isinstance(res, tuple) and len(res) >= 2:
-        success, errors = res[0], res[1]
-    elif isinstance(res, int):
-        success, errors = res, 0
-    else:
-        success, errors = 0, 0
-
-    delivered = (success or 0) + (errors or 0)
-    pct = round((success / delivered) * 100, 1) if delivered > 0 else 0.0
-
-    result_text = (
-        "✅ Рассылка завершена!\n"
-        f"✅ Успешно: {success}\n"
-        f"❌ Ошибок: {errors}\n"
-        f"📊 Доставка: {pct}%\n"
-        f"🔘 Кнопок: {len(buttons)}\n"
-        f"🖼 Фото: {'да' if photo_id else 'нет'}"
-    )
+        log_exc("[send_now] ошибка создания рассылки", e)
+        menu_kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_back")]
+        ])
+        await call.message.answer("❌ Не удалось запустить рассылку", reply_markup=menu_kb)
 
-    # 7️⃣ Удаляем статусное сообщение
 
-    # 8️⃣ Отправляем результат отдельным сообщением
-    menu_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📢 Новая рассылка", callback_data="admin_broadcast")],
-        [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_back")]
-    ])
-    await call.message.answer(result_text, reply_markup=menu_kb)
+@router.callback_query(F.data == "admin_refresh_stats")
+async def admin_refresh_stats(call: CallbackQuery):
+    print(f"[admin_refresh_stats] от {call.from_user.id}")
+    if not is_admin(call.from_user.id):
+        return await call.answer()
+
+    kpi = await get_admin_stats_safely(force=True)
+    await call.answer("Статистика обновлена")
+    try:
+        await call.message.edit_text(format_admin_stats(kpi), reply_markup=kb_admin_main())
+    except Exception as e:
+        # "message is not modified" — цифры не изменились
+        print(f"[admin_refresh_stats] edit_text: {e}")
 
 
 # ============================ Создание рассылки: текст ============================
@@ -714,16 +700,13 @@ async def admin_stats(call: CallbackQuery):
     if not is_admin(call.from_user.id):
         return
 
-    user_count, active_debts = await get_admin_stats_safely()
+    kpi = await get_admin_stats_safely()
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_back")]
     ])
 
-    await safe_edit_or_send(
-        call,
-        f"📊 Пользователей: {user_count}\n📄 Активных долгов: {active_debts}"
-    )
+    await safe_edit_or_send(call, format_admin_stats(kpi))
     await call.message.answer("Выбериfте действие:", reply_markup=kb_back_to_referrals())
 
 
@@ -789,60 +772,24 @@ async def set_schedule_time(message: Message, state: FSMContext):
 
     photo_id = data.get("broadcast_photo")
     buttons = data.get("buttons", [])
-    final_kb = build_final_keyboard(buttons)
 
     try:
-        users = await get_all_users()
-        if not users:
+        recipients = await get_user_count()
+        if not recipients:
             await message.answer("❌ Нет пользователей для рассылки.")
             await state.clear()
             return
 
-        # Сохраняем задачи в БД (персонально)
-        saved_count = 0
-        for u in users:
-            try:
-                await save_scheduled_message(
-                    u["user_id"],
-                    text,
-                    photo_id,
-                    schedule_time.strftime("%Y-%m-%d %H:%M")
-                )
-                saved_count += 1
-            except Exception as e:
-                log_exc(f"[set_schedule_time] save_scheduled_message user_id={u.get('user_id')}", e)
-
-        print(f"[set_schedule_time] сохранено задач: {saved_count}, run_date={schedule_time}")
-
-        # Регистрируем job в планировщике, если доступен
-        job_id = f"broadcast_{int(datetime.now().timestamp())}"
-        if scheduler and getattr(scheduler, "scheduler", None):
-            try:
-                print("[set_schedule_time] добавляем job с клавиатурой (если поддерживается)")
-                scheduler.scheduler.add_job(
-                    send_scheduled_broadcast_with_stats,
-                    "date",
-                    run_date=schedule_time,
-                    id=job_id,
-                    args=[text, photo_id, message.from_user.id]
-                )
-            except TypeError as e:
-                log_exc("[set_schedule_time] add_job TypeError (без клавиатуры)", e)
-                scheduler.scheduler.add_job(
-                    send_scheduled_broadcast_with_stats,
-                    "date",
-                    run_date=schedule_time,
-                    id=job_id,
-                    args=[text, photo_id, message.from_user.id]
-                )
-            except Exception as e:
-                log_exc("[set_schedule_time] add_job error", e)
-        else:
-            print("[set_schedule_time] ⚠️ Планировщик недоступен — используйте внешний обработчик отложенных сообщений.")
+        # Одна задача рассылки вместо сообщения на каждого пользователя;
+        # её запустит планировщик (process_broadcast_jobs), когда наступит run_at
+        job_id = await enqueue_broadcast(
+            text, photo_id, buttons, admin_id=message.from_user.id, run_at=schedule_time
+        )
+        print(f"[set_schedule_time] создана рассылка #{job_id}, run_at={schedule_time}")
 
         confirm = (
             f"✅ Рассылка запланирована на {schedule_time.strftime('%d.%m.%Y %H:%M')}\n"
-            f"👥 Получателей: {saved_count}\n"
+            f"👥 Получателей сейчас: {recipients}\n"
             f"🖼 Фото: {'да' if photo_id else 'нет'}\n"
             f"🔘 Кнопок: {len(buttons)}"
         )
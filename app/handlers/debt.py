@@ -5,6 +5,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from datetime import datetime, timedelta
+from typing import Optional
 import re
 
 from ..keyboards.keyboards import add_debts_menu
@@ -12,7 +13,7 @@ from ..keyboards.keyboards import add_debts_menu
 try:
     from ..database import (
         add_debt, get_open_debts, get_debt_by_id, update_debt,
-        soft_delete_debt, clear_user_debts, get_user_data, delete_debt, crud
+        soft_delete_debt, clear_user_debts, get_user_settings, delete_debt, crud
 )
     from ..keyboards import (
         tr, main_menu, currency_keyboard, direction_keyboard,
@@ -166,7 +167,7 @@ async def debts_page_navigation(call: CallbackQuery, state: FSMContext):
 # === КАРТОЧКА ДОЛГА ===
 
 @router.callback_query(lambda c: c.data.startswith('debtcard_'))
-async def debt_card(call: CallbackQuery, state: FSMContext):
+async def debt_card(call: CallbackQuery, state: FSMContext, user_settings: Optional[dict] = None):
     """Показать карточку долга"""
     try:
         parts = call.data.split('_')
@@ -191,8 +192,9 @@ async def debt_card(call: CallbackQuery, state: FSMContext):
             return
 
         # Получаем notify_time пользователя
-        user_data = await get_user_data(user_id)
-        notify_time = user_data.get('notify_time', '09:00')
+        if user_settings is None:
+            user_settings = await get_user_settings(user_id) or {}
+        notify_time = user_settings.get('notify_time', '09:00')
 
         # Определяем тип долга
         direction = debt.get('direction', 'owed')
@@ -1051,7 +1053,7 @@ async def edit_debt_field(call: CallbackQuery, state: FSMContext):
 
 
 @router.message(EditDebt.edit_value)
-async def edit_debt_value(message: Message, state: FSMContext):
+async def edit_debt_value(message: Message, state: FSMContext, user_settings: Optional[dict] = None):
     """Обработка нового значения поля"""
     user_id = message.from_user.id
 
@@ -1123,7 +1125,7 @@ async def edit_debt_value(message: Message, state: FSMContext):
             await message.answer(success_text)
 
             # Получаем обновленные данные долга и показываем карточку
-            await show_updated_debt_card(message, user_id, debt_id, page)
+            await show_updated_debt_card(message, user_id, debt_id, page, user_settings)
             await state.clear()
 
         except Exception as process_e:
@@ -1147,11 +1149,13 @@ async def edit_debt_value(message: Message, state: FSMContext):
             pass
 
 
-async def show_updated_debt_card(message: Message, user_id: int, debt_id: int, page: int):
+async def show_updated_debt_card(message: Message, user_id: int, debt_id: int, page: int,
+                                 user_settings: Optional[dict] = None):
     """Показать обновленную карточку долга"""
     try:
-        user_data = await get_user_data(user_id)
-        notify_time = user_data.get('notify_time', '09:00')
+        if user_settings is None:
+            user_settings = await get_user_settings(user_id) or {}
+        notify_time = user_settings.get('notify_time', '09:00')
         updated_debt = await get_debt_by_id(debt_id)
 
         if not updated_debt:
@@ -1208,7 +1212,7 @@ async def show_updated_debt_card(message: Message, user_id: int, debt_id: int, p
 # === РЕДАКТИРОВАНИЕ ВАЛЮТЫ ===
 
 @router.callback_query(lambda c: c.data.startswith('editcur_'))
-async def edit_currency_callback(call: CallbackQuery, state: FSMContext):
+async def edit_currency_callback(call: CallbackQuery, state: FSMContext, user_settings: Optional[dict] = None):
     """Обработка выбора валюты при редактировании"""
     try:
         _, currency, debt_id, page = call.data.split('_')
@@ -1230,7 +1234,7 @@ async def edit_currency_callback(call: CallbackQuery, state: FSMContext):
         await call.answer(await tr(user_id, 'changed'))
 
         # Показываем обновленную карточку долга
-        await show_updated_debt_card_from_callback(call, user_id, debt_id, page)
+        await show_updated_debt_card_from_callback(call, user_id, debt_id, page, user_settings)
 
     except Exception as e:
         print(f"❌ Ошибка в edit_currency_callback: {e}")
@@ -1240,11 +1244,13 @@ async def edit_currency_callback(call: CallbackQuery, state: FSMContext):
             pass
 
 
-async def show_updated_debt_card_from_callback(call: CallbackQuery, user_id: int, debt_id: int, page: int):
+async def show_updated_debt_card_from_callback(call: CallbackQuery, user_id: int, debt_id: int, page: int,
+                                               user_settings: Optional[dict] = None):
     """Показать обновленную карточку долга из callback"""
     try:
-        user_data = await get_user_data(user_id)
-        notify_time = user_data.get('notify_time', '09:00')
+        if user_settings is None:
+            user_settings = await get_user_settings(user_id) or {}
+        notify_time = user_settings.get('notify_time', '09:00')
         updated_debt = await get_debt_by_id(debt_id)
 
         if not updated_debt:
@@ -5,7 +5,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.connection import get_db
 from app.keyboards import main_menu
 from app.utils import safe_edit_message
-from app.utils.export_utils import export_user_debts_to_excel, get_export_filename
+from app.utils.export_utils import (
+    export_user_debts_to_excel, export_user_debts_stream, get_export_filename, user_export_slot, ExportBusy
+)
 from app.keyboards.callbacks import CallbackData
 from app.keyboards.texts import tr
 import logging
@@ -90,6 +92,20 @@ async def export_debts_callback(callback_query: types.CallbackQuery):
 
         logger.info(f"Excel export successful for user {user_id}")
 
+    except ExportBusy:
+        # Повторное нажатие, пока готовится предыдущий файл
+        busy_text = await tr(user_id, 'export_busy')
+        back_main_text = await tr(user_id, 'back_main_btn')
+        back_main_kb = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=back_main_text, callback_data=CallbackData.BACK_MAIN_EXPORT)]
+            ]
+        )
+        try:
+            await callback_query.message.edit_text(busy_text, reply_markup=back_main_kb)
+        except Exception as e:
+            logger.warning(f"Не удалось показать сообщение о занятом экспорте: {e}")
+
     except Exception as e:
         logger.error(f"Export error for user {user_id}: {e}", exc_info=True)
         try:
@@ -111,4 +127,60 @@ async def export_debts_callback(callback_query: types.CallbackQuery):
         try:
             await callback_query.message.edit_text(error_text, reply_markup=back_main_kb)
         except Exception as e2:
-            logger.error(f"Не удалось отправить сообщение об ошибке: {e2}")
\ No newline at end of file
+            logger.error(f"Не удалось отправить сообщение об ошибке: {e2}")
+
+
+@router.callback_query(F.data.in_({CallbackData.EXPORT_CSV, CallbackData.EXPORT_JSONL}))
+async def export_debts_stream_callback(callback_query: types.CallbackQuery):
+    """Экспорт долгов в CSV / JSON Lines: файл пишется прямо в загрузку"""
+    user_id = callback_query.from_user.id
+    fmt = 'csv' if callback_query.data == CallbackData.EXPORT_CSV else 'jsonl'
+
+    try:
+        await callback_query.answer()
+    except Exception as e:
+        logger.warning(f"call.answer() error for user {user_id}: {e}")
+
+    back_main_kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=await tr(user_id, 'back_main_btn'), callback_data=CallbackData.BACK_MAIN_EXPORT)]
+        ]
+    )
+
+    try:
+        await callback_query.message.edit_text(await tr(user_id, 'export_loading'), reply_markup=None)
+    except Exception as e:
+        logger.warning(f"Не удалось показать индикатор загрузки: {e}")
+
+    try:
+        # Слот держим до конца загрузки: строки читаются из БД именно тогда
+        async with user_export_slot(user_id):
+            async with get_db() as session:
+                file = await export_user_debts_stream(session, user_id, fmt)
+
+            if callback_query.message.chat.type == "private":
+                try:
+                    await callback_query.message.delete()
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить сообщение с индикатором: {e}")
+
+            await callback_query.message.answer_document(
+                document=file,
+                caption=await tr(user_id, 'export_stream_caption'),
+                reply_markup=back_main_kb
+            )
+
+        logger.info(f"{fmt} export successful for user {user_id}")
+
+    except ExportBusy:
+        try:
+            await callback_query.message.edit_text(await tr(user_id, 'export_busy'), reply_markup=back_main_kb)
+        except Exception as e:
+            logger.warning(f"Не удалось показать сообщение о занятом экспорте: {e}")
+
+    except Exception as e:
+        logger.error(f"{fmt} export error for user {user_id}: {e}", exc_info=True)
+        try:
+            await callback_query.message.answer(await tr(user_id, 'export_error'), reply_markup=back_main_kb)
+        except Exception as e2:
+            logger.error(f"Не удалось отправить сообщение об ошибке: {e2}")
@@ -4,6 +4,7 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from typing import Optional
 
 try:
     from app.keyboards import tr
@@ -15,7 +16,7 @@ router = Router()
 
 
 @router.callback_query(F.data == 'how_to_use')
-async def show_instructions(call: CallbackQuery, state: FSMContext):
+async def show_instructions(call: CallbackQuery, state: FSMContext, user_settings: Optional[dict] = None):
     """Показать инструкции по использованию"""
     user_id = call.from_user.id
 
@@ -23,13 +24,7 @@ async def show_instructions(call: CallbackQuery, state: FSMContext):
         await state.clear()
 
         # Получаем язык пользователя для выбора ссылки
-        try:
-            from app.database import get_user_data
-            user_data = await get_user_data(user_id)
-            lang = user_data.get('lang', 'uz')  # По умолчанию узбекский
-        except Exception as db_e:
-            print(f"❌ Ошибка получения данных пользователя: {db_e}")
-            lang = 'uz'
+        lang = user_settings.get('lang', 'uz') if user_settings else 'uz'  # По умолчанию узбекский
 
         instruction_text_ru = """
 Главное меню
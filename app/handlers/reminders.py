@@ -3,25 +3,27 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from datetime import datetime, timedelta
+from typing import Optional
 from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy import select
 
 from app.database.connection import get_db
 from app.database.crud import (
     add_reminder, get_user_reminders,
-    get_user_data, enable_debt_reminders, disable_debt_reminders,
+    get_user_settings, enable_debt_reminders, disable_debt_reminders,
     set_debt_reminder_time, update_reminder_text, create_currency_reminder,
-    delete_currency_reminders, get_reminder_by_id, set_user_currency_time, get_user_currency_time
+    delete_currency_reminders, get_reminder_by_id, set_user_currency_time
 )
 from app.database.models import Reminder
 from app.keyboards import menu_button, main_menu
-from app.keyboards.texts import tr
+from app.keyboards.texts import tr, user_catalog
 from app.keyboards.callbacks import CallbackData, DynamicCallbacks
 from aiogram.filters import Command
 import pytz
 from app.config import ADMIN_IDS  # Импортируй свой список админов
 from app.states import AddReminder, SetNotifyTime, EditReminder
 from app.utils import safe_edit_message
+from app.utils.due_queue import due_queue, REMINDER
 
 router = Router()
 
@@ -45,9 +47,10 @@ def is_admin(user_id: int) -> bool:
 
 # --- Кнопка отмены ---
 async def cancel_kb(user_id: int) -> InlineKeyboardMarkup:
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text=await tr(user_id, "cancel_btn"),
+            [InlineKeyboardButton(text=t.get("cancel_btn"),
                                   callback_data=CallbackData.BACK_MAIN_REMINDER)]
         ]
     )
@@ -56,17 +59,18 @@ async def cancel_kb(user_id: int) -> InlineKeyboardMarkup:
 
 # --- Главное меню напоминаний ---
 async def reminders_main_kb(user_id: int) -> InlineKeyboardMarkup:
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="📥 " + await tr(user_id, "debts_btn"),
+            [InlineKeyboardButton(text="📥 " + t.get("debts_btn"),
                                   callback_data=CallbackData.DEBT_REMINDERS)],
-            [InlineKeyboardButton(text="💱 " + await tr(user_id, "currency_btn"),
+            [InlineKeyboardButton(text="💱 " + t.get("currency_btn"),
                                   callback_data=CallbackData.CURRENCY_REMINDERS)],
-            [InlineKeyboardButton(text="➕ " + await tr(user_id, "add_reminder_btn"),
+            [InlineKeyboardButton(text="➕ " + t.get("add_reminder_btn"),
                                   callback_data=CallbackData.ADD_REMINDER)],
-            [InlineKeyboardButton(text="📋 " + await tr(user_id, "my_reminders_btn"),
+            [InlineKeyboardButton(text="📋 " + t.get("my_reminders_btn"),
                                   callback_data=CallbackData.MY_REMINDERS)],
-            [InlineKeyboardButton(text="⬅️ " + await tr(user_id, "back_btn"),
+            [InlineKeyboardButton(text="⬅️ " + t.get("back_btn"),
                                   callback_data=CallbackData.BACK_MAIN)],
         ]
     )
@@ -89,39 +93,39 @@ async def back_main_reminder(call: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == CallbackData.REMINDERS_MENU)
-async def open_reminders_menu(callback: CallbackQuery):
-    async with get_db() as session:
-        user_id = callback.from_user.id
-        user_data = await get_user_data(user_id)
+async def open_reminders_menu(callback: CallbackQuery, user_settings: Optional[dict] = None):
+    user_id = callback.from_user.id
+    if user_settings is None:
+        user_settings = await get_user_settings(user_id) or {}
 
-        # --- Долги ---
-        debt_time = user_data.get("notify_time")
-        debt_status = "✅" if debt_time else "❌"
+    # --- Долги ---
+    debt_time = user_settings.get("notify_time")
+    debt_status = "✅" if debt_time else "❌"
 
-        if debt_time:
-            debt_text = await tr(user_id, "debt_reminders_status_on", time=debt_time, status=debt_status)
-        else:
-            debt_text = await tr(user_id, "debt_reminders_status_off", status=debt_status)
+    if debt_time:
+        debt_text = await tr(user_id, "debt_reminders_status_on", time=debt_time, status=debt_status)
+    else:
+        debt_text = await tr(user_id, "debt_reminders_status_off", status=debt_status)
 
-        # --- Валюта ---
-        currency_time = await get_user_currency_time(session, user_id)
-        currency_status = "✅" if currency_time else "❌"
-        currency_text = await tr(user_id, "currency_reminders_text", time=currency_time or "—", status=currency_status)
+    # --- Валюта ---
+    currency_time = user_settings.get("currency_notify_time")
+    currency_status = "✅" if currency_time else "❌"
+    currency_text = await tr(user_id, "currency_reminders_text", time=currency_time or "—", status=currency_status)
 
-        # --- Итоговый текст ---
-        text = f"{debt_text}\n\n{currency_text}"
+    # --- Итоговый текст ---
+    text = f"{debt_text}\n\n{currency_text}"
 
-        kb = await reminders_main_kb(user_id)
+    kb = await reminders_main_kb(user_id)
 
-        try:
-            await callback.message.edit_text(text, reply_markup=kb)
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e).lower():
-                pass
-            else:
-                raise
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e).lower():
+            pass
+        else:
+            raise
 
-        await callback.answer()
+    await callback.answer()
 
 
 
@@ -129,12 +133,13 @@ async def open_reminders_menu(callback: CallbackQuery):
 
 # --- Долговые напоминания ---
 @router.callback_query(F.data == CallbackData.DEBT_REMINDERS)
-async def open_debt_reminders(callback: CallbackQuery):
-    user_data = await get_user_data(callback.from_user.id)
-    debt_time = user_data.get("notify_time")
+async def open_debt_reminders(callback: CallbackQuery, user_settings: Optional[dict] = None):
+    if user_settings is None:
+        user_settings = await get_user_settings(callback.from_user.id) or {}
+    debt_time = user_settings.get("notify_time")
     status = "✅" if debt_time else "❌"
 
-    kb = await debt_reminders_kb(callback.from_user.id)
+    kb = await debt_reminders_kb(callback.from_user.id, user_settings)
 
     if debt_time:
         text = await tr(callback.from_user.id, "debt_reminders_status_on", time=debt_time, status=status)
@@ -153,25 +158,30 @@ async def open_debt_reminders(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == CallbackData.TOGGLE_DEBT_REMINDERS)
-async def toggle_debt_reminders(callback: CallbackQuery):
-    user_data = await get_user_data(callback.from_user.id)
-    enabled_now = user_data.get("notify_time") is not None
+async def toggle_debt_reminders(callback: CallbackQuery, user_settings: Optional[dict] = None):
+    if user_settings is None:
+        user_settings = await get_user_settings(callback.from_user.id) or {}
+    enabled_now = user_settings.get("notify_time") is not None
 
     async with get_db() as session:
         if enabled_now:
             await disable_debt_reminders(session, callback.from_user.id)
+            user_settings["notify_time"] = None
             print(f"[LOG] Выключены долговые напоминания для user={callback.from_user.id}")
         else:
             await enable_debt_reminders(session, callback.from_user.id, default_time="09:00")
+            user_settings["notify_time"] = "09:00"
             print(f"[LOG] Включены долговые напоминания для user={callback.from_user.id}, время=09:00")
 
-    await open_debt_reminders(callback)
+    await open_debt_reminders(callback, user_settings)
 
 
 @router.callback_query(F.data == CallbackData.SETUP_REMINDER_TIME)
-async def setup_reminder_time(callback: CallbackQuery, state: FSMContext):
-    user_data = await get_user_data(callback.from_user.id)
-    current_time = user_data.get("notify_time")
+async def setup_reminder_time(callback: CallbackQuery, state: FSMContext,
+                              user_settings: Optional[dict] = None):
+    if user_settings is None:
+        user_settings = await get_user_settings(callback.from_user.id) or {}
+    current_time = user_settings.get("notify_time")
 
     if not current_time:
         current_time = await tr(callback.from_user.id, "time_not_set")
@@ -234,14 +244,15 @@ async def process_debt_time(message: types.Message, state: FSMContext):
 
 # --- Валютные напоминания ---
 @router.callback_query(F.data == CallbackData.CURRENCY_REMINDERS)
-async def open_currency_reminders(callback: CallbackQuery):
-    async with get_db() as session:
-        user_id = callback.from_user.id
-        currency_time = await get_user_currency_time(session, user_id)
+async def open_currency_reminders(callback: CallbackQuery, user_settings: Optional[dict] = None):
+    user_id = callback.from_user.id
+    if user_settings is None:
+        user_settings = await get_user_settings(user_id) or {}
+    currency_time = user_settings.get("currency_notify_time")
 
-        morning_status = "✅" if currency_time == "07:00" else "❌"
-        evening_status = "✅" if currency_time == "17:00" else "❌"
-        disabled_status = "✅" if not currency_time else "❌"
+    morning_status = "✅" if currency_time == "07:00" else "❌"
+    evening_status = "✅" if currency_time == "17:00" else "❌"
+    disabled_status = "✅" if not currency_time else "❌"
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -271,27 +282,33 @@ async def open_currency_reminders(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == CallbackData.ENABLE_MORNING_RATES)
-async def enable_morning_rates(callback: CallbackQuery):
+async def enable_morning_rates(callback: CallbackQuery, user_settings: Optional[dict] = None):
     async with get_db() as session:
         await set_user_currency_time(session, callback.from_user.id, "07:00")
+    if user_settings is not None:
+        user_settings["currency_notify_time"] = "07:00"
     await callback.answer(await tr(callback.from_user.id, "reminder_status_currency_morning"))
-    await open_currency_reminders(callback)
+    await open_currency_reminders(callback, user_settings)
 
 
 @router.callback_query(F.data == CallbackData.ENABLE_EVENING_RATES)
-async def enable_evening_rates(callback: CallbackQuery):
+async def enable_evening_rates(callback: CallbackQuery, user_settings: Optional[dict] = None):
     async with get_db() as session:
         await set_user_currency_time(session, callback.from_user.id, "17:00")
+    if user_settings is not None:
+        user_settings["currency_notify_time"] = "17:00"
     await callback.answer(await tr(callback.from_user.id, "reminder_status_currency_evening"))
-    await open_currency_reminders(callback)
+    await open_currency_reminders(callback, user_settings)
 
 
 @router.callback_query(F.data == CallbackData.DISABLE_CURRENCY_RATES)
-async def disable_currency_rates(callback: CallbackQuery):
+async def disable_currency_rates(callback: CallbackQuery, user_settings: Optional[dict] = None):
     async with get_db() as session:
         await set_user_currency_time(session, callback.from_user.id, None)
+    if user_settings is not None:
+        user_settings["currency_notify_time"] = None
     await callback.answer(await tr(callback.from_user.id, "currency_reminder_status"))
-    await open_currency_reminders(callback)
+    await open_currency_reminders(callback, user_settings)
 
 
 
@@ -463,6 +480,7 @@ async def reminder_card_handler(callback: CallbackQuery, state: FSMContext):
             if r:
                 await session.delete(r)
                 await session.commit()
+                due_queue.remove(REMINDER, rid)
         await callback.answer(await tr(user_id, "reminder_deleted"))
         await open_my_reminders(callback)
 
@@ -541,6 +559,7 @@ async def edit_datetime(message: types.Message, state: FSMContext):
         if r:
             r.due = new_due
             await session.commit()
+            due_queue.push(REMINDER, r.id, new_due)
 
     # Получаем ID предыдущего сообщения бота
     prev_bot_msg_id = data.get("bot_message_id")
@@ -585,6 +604,7 @@ async def set_repeat(callback: CallbackQuery, state: FSMContext):
 
         r.repeat = repeat
         await session.commit()
+        due_queue.push(REMINDER, r.id, r.due)
 
     await callback.answer(await tr(user_id, "reminder_updated"))
 
@@ -769,7 +789,8 @@ async def process_repeat_cb(callback: CallbackQuery, state: FSMContext):
         return
 
     async with get_db() as session:
-        await add_reminder(session, user_id=callback.from_user.id, text=text, due=due, repeat=repeat)
+        reminder = await add_reminder(session, user_id=callback.from_user.id, text=text, due=due, repeat=repeat)
+    due_queue.push(REMINDER, reminder.id, reminder.due)
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -800,26 +821,28 @@ async def process_repeat_cb(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-async def debt_reminders_kb(user_id: int) -> InlineKeyboardMarkup:
+async def debt_reminders_kb(user_id: int, user_settings: Optional[dict] = None) -> InlineKeyboardMarkup:
     """
     Динамическая клавиатура для меню долговых напоминаний.
     Если уведомления включены — показываем кнопку "Отключить",
     если выключены — "Включить".
     """
-    user_data = await get_user_data(user_id)
-    enabled = user_data.get("notify_time") is not None
+    t = await user_catalog(user_id)
+    if user_settings is None:
+        user_settings = await get_user_settings(user_id) or {}
+    enabled = user_settings.get("notify_time") is not None
 
-    enable_text = await tr(user_id, "enable_debt")
-    disable_text = await tr(user_id, "disable_debt")
+    enable_text = t.get("enable_debt")
+    disable_text = t.get("disable_debt")
 
     toggle_text = disable_text if enabled else enable_text
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text=toggle_text, callback_data=CallbackData.TOGGLE_DEBT_REMINDERS)],
-            [InlineKeyboardButton(text="⚙ " + await tr(user_id, "set_time"),
+            [InlineKeyboardButton(text="⚙ " + t.get("set_time"),
                                   callback_data=CallbackData.SETUP_REMINDER_TIME)],
-            [InlineKeyboardButton(text="⬅️ " + await tr(user_id, "back_btn"),
+            [InlineKeyboardButton(text="⬅️ " + t.get("back_btn"),
                                   callback_data=CallbackData.REMINDERS_MENU)],
         ]
     )
@@ -858,43 +881,35 @@ async def test_currency_notification(message: Message):
         await message.answer("⛔ Эта команда доступна только администраторам")
         return
 
-    from app.utils.scheduler import scheduler
+    from app.utils.scheduler import scheduler, MINUTE_WHEEL_JOB_ID, TIMEZONE
     from app.database.crud import set_user_currency_time
     from app.database.connection import get_db
 
-    import pytz
-
     user_id = message.from_user.id
-    job_id = f'user_currency_{user_id}'
 
     # Время по UTC+5 (Ташкент)
-    tashkent_tz = pytz.timezone('Asia/Tashkent')
+    tashkent_tz = pytz.timezone(TIMEZONE)
     now_utc5 = datetime.now(tashkent_tz)
     test_time = now_utc5 + timedelta(minutes=2)
     time_str = test_time.strftime("%H:%M")
 
     try:
-        # Обновляем БД
+        # Достаточно обновить БД — минутное колесо само подхватит бакет
         async with get_db() as session:
             await set_user_currency_time(session, user_id, time_str)
 
-        # Перезапускаем все задачи чтобы применить изменения
-        from app.utils.scheduler import schedule_all_reminders
-        await schedule_all_reminders()
+        job = scheduler.scheduler.get_job(MINUTE_WHEEL_JOB_ID)
 
         await message.answer(
             f"✅ Валютное уведомление установлено на <b>{time_str}</b>\n"
             f"⏳ Ждите ~2 минуты\n\n"
-            f"Задача: {job_id}"
+            f"Бакет: {time_str}, колесо активно: {job is not None}",
+            parse_mode="HTML"
         )
 
-        # Проверяем что задача добавлена
-        job = scheduler.scheduler.get_job(job_id)
         print(f"✅ Тест валютного уведомления: {user_id} -> {time_str}")
-        print(f"📋 Задача в scheduler: {job is not None}")
         if job:
-            print(f"   Next run: {job.next_run_time}")
-            print(f"   Trigger: {job.trigger}")
+            print(f"   Next tick: {job.next_run_time}")
 
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
@@ -904,16 +919,23 @@ async def test_currency_notification(message: Message):
 
 @router.message(Command("check_jobs"))
 async def check_jobs(message: Message):
-    from app.utils.scheduler import scheduler
+    from app.utils.scheduler import scheduler, MINUTE_WHEEL_JOB_ID
+    from app.database.crud import get_notify_buckets
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Эта команда доступна только администраторам")
         return
 
-    currency_jobs = [j for j in scheduler.scheduler.get_jobs() if 'currency' in j.id]
-
-    text = f"💱 Валютных задач: {len(currency_jobs)}\n\n"
-    for job in currency_jobs[:5]:  # Показываем только первые 5
-        text += f"• {job.id}\n  Next: {job.next_run_time}\n\n"
+    job = scheduler.scheduler.get_job(MINUTE_WHEEL_JOB_ID)
+    buckets = await get_notify_buckets()
+    currency_buckets = buckets['currency']
+
+    text = f"🕐 Минутное колесо: {'✅' if job else '❌'}\n"
+    if job:
+        text += f"  Next: {job.next_run_time}\n"
+    text += f"\n📥 Бакетов долговых напоминаний: {len(buckets['debt'])}\n"
+    text += f"💱 Валютных бакетов: {len(currency_buckets)}\n\n"
+    for slot, count in list(currency_buckets.items())[:5]:  # Показываем только первые 5
+        text += f"• {slot}: {count} польз.\n"
 
     await message.answer(text)
 
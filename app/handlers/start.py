@@ -5,9 +5,10 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
+from typing import Optional
 
 
-from ..database import get_user_data, get_user_by_id, save_user_lang, get_or_create_user
+from ..database import save_user_lang, get_or_create_user, get_user_by_id
 from ..keyboards import tr, LANGS, main_menu, CallbackData, settings_menu, my_debts_menu
 from ..utils import safe_edit_message
 from ..states import AddDebt, EditDebt, SetNotifyTime, AdminBroadcast
@@ -37,7 +38,7 @@ async def language_menu_start(user_id: int) -> InlineKeyboardMarkup:
 
 
 @router.message(Command('start'))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, user_settings: Optional[dict] = None):
     """Обработчик команды /start"""
     user_id = message.from_user.id
     print(f"[START] Пользователь {user_id} вызвал /start")
@@ -91,8 +92,10 @@ async def cmd_start(message: Message, state: FSMContext):
         await state.clear()
         print(f"[DEBUG] FSM состояние очищено для {user_id}")
 
-        user = await get_user_by_id(user_id)
-        print(f"[DEBUG] Результат get_user_by_id({user_id}): {user}")
+        # Настройки уже загружены UserSettingsMiddleware; None бывает и при ошибке
+        # загрузки, поэтому проверяем наличие пользователя сами (без создания записи)
+        user = user_settings if user_settings is not None else await get_user_by_id(user_id)
+        print(f"[DEBUG] Настройки пользователя {user_id}: {user}")
 
         # ✅ Проверяем аргументы /start
         args = message.text.split(maxsplit=1)
@@ -137,9 +140,7 @@ async def cmd_start(message: Message, state: FSMContext):
             return
 
         # Старый пользователь
-        print(f"[INFO] Пользователь {user_id} уже существует, загружаем данные")
-        user_data = await get_user_data(user_id)
-        print(f"[DEBUG] user_data для {user_id}: {user_data}")
+        print(f"[INFO] Пользователь {user_id} уже существует")
 
         welcome_text = await tr(user_id, 'welcome')
         kb = await main_menu(user_id)
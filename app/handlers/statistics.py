@@ -3,15 +3,16 @@
 Включает сервис, клавиатуры и обработчики
 """
 from typing import Dict, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 
-from app.database.crud import get_open_debts, get_user_data
+from app.database.crud import get_open_debts, get_user_balances, count_closed_debts
 from app.keyboards import CallbackData
 from app.utils.currency_api import CurrencyService
-from app.keyboards.texts import tr
+from app.utils.conversion import RatesSnapshot
+from app.keyboards.texts import tr, user_catalog
 from app.utils import safe_edit_message
 
 # Создаем роутер для статистики
@@ -47,6 +48,7 @@ async def get_statistics_keyboard(user_id: int, current_currency: str = "USD") -
     """
     Клавиатура для статистики с кнопками выбора валюты и экспорта
     """
+    t = await user_catalog(user_id)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(text="🇺🇸 USD", callback_data="stats_currency_USD"),
@@ -55,13 +57,13 @@ async def get_statistics_keyboard(user_id: int, current_currency: str = "USD") -
         ],
         [
             InlineKeyboardButton(
-                text=f"{await tr(user_id, 'statistics_btn_export')}",
+                text=f"{t.get('statistics_btn_export')}",
                 callback_data=CallbackData.EXPORT_EXCEL
             )
         ],
         [
             InlineKeyboardButton(
-                text=f"{await tr(user_id, 'statistics_btn_back')}",
+                text=f"{t.get('statistics_btn_back')}",
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -88,32 +90,15 @@ class StatisticsService:
             Словарь со статистикой или None в случае ошибки
         """
         try:
-            from app.database.connection import get_db
-            from app.database.models import Debt
-            from sqlalchemy import select, func, and_
-
-            # Получаем ВСЕ активные долги пользователя (и открытые и закрытые)
-            async with get_db() as session:
-                result = await session.execute(
-                    select(Debt).where(
-                        and_(
-                            Debt.user_id == user_id,
-                            Debt.is_active.is_(True)
-                        )
-                    ).order_by(Debt.id)
-                )
-                debt_rows = result.scalars().all()
-
-                debts = []
-                for debt in debt_rows:
-                    debts.append({
-                        'id': debt.id,
-                        'amount': debt.amount,
-                        'currency': debt.currency,
-                        'direction': debt.direction,
-                        'date': debt.date,
-                        'closed': debt.closed
-                    })
+            # Текущий месяц для подсчета закрытых долгов
+            now = datetime.now()
+            month_start = now.date().replace(day=1)
+            next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+
+            # Суммы открытых долгов — готовые строки user_balances по (валюта, направление)
+            balances = await get_user_balances(user_id)
+            # Закрытые долги за месяц (closed=True и date в текущем месяце)
+            closed_this_month = await count_closed_debts(user_id, month_start, next_month_start)
 
             # Получаем курсы валют
             rates = await CurrencyService.get_exchange_rates()
@@ -121,62 +106,34 @@ class StatisticsService:
                 print("❌ Не удалось получить курсы валют для статистики")
                 return None
 
-            # Инициализируем счетчики
-            total_owe = 0.0  # Сколько должен я (direction='owe')
-            total_owed = 0.0  # Сколько должны мне (direction='owed')
-            open_count = 0
-
-            # Текущий месяц для подсчета закрытых долгов
-            now = datetime.now()
+            # Суммы групп пересчитываются одним проходом: сложение по валютам, затем курс
+            converter = RatesSnapshot(rates)
+            skipped = []
+            # Сколько должен я (direction='owe') и сколько должны мне (direction='owed')
+            total_owe = converter.total(
+                ((g['total'], g['currency']) for g in balances if g['direction'] == 'owe'),
+                target_currency, skipped
+            )
+            total_owed = converter.total(
+                ((g['total'], g['currency']) for g in balances if g['direction'] == 'owed'),
+                target_currency, skipped
+            )
+            if skipped:
+                print(f"⚠️ Валюты {sorted(set(skipped))} не найдены в курсах")
 
-            for debt in debts:
-                amount = debt['amount']
-                currency = debt.get('currency', 'UZS')
-                direction = debt['direction']
-                closed = debt.get('closed', False)
-
-                # Конвертируем сумму в целевую валюту
-                converted_amount = await StatisticsService._convert_to_target(
-                    amount, currency, target_currency, rates
-                )
-
-                if converted_amount is None:
-                    continue
-
-                # Считаем только открытые долги (closed=False)
-                if not closed:
-                    if direction == 'owe':
-                        # Я должен
-                        total_owe += converted_amount
-                        open_count += 1
-                    elif direction == 'owed':
-                        # Мне должны
-                        total_owed += converted_amount
-                        open_count += 1
-
-            # Считаем закрытые долги за месяц (closed=True и date в текущем месяце)
-            current_month_str = now.strftime('%Y-%m')
-            async with get_db() as session:
-                result_closed = await session.execute(
-                    select(func.count(Debt.id)).where(
-                        and_(
-                            Debt.user_id == user_id,
-                            Debt.is_active.is_(True),
-                            Debt.closed.is_(True),
-                            Debt.date.like(f"{current_month_str}%")
-                        )
-                    )
-                )
-                closed_this_month = result_closed.scalar() or 0
+            open_count = sum(
+                g['count'] for g in balances
+                if g['direction'] in ('owe', 'owed') and g['currency'] in converter
+            )
 
             # Рассчитываем разницу (положительная = мне должны больше)
             difference = total_owed - total_owe
             sign = "+" if difference >= 0 else ""
 
             return {
-                'total_owe': round(total_owe, 2),
-                'total_owed': round(total_owed, 2),
-                'difference': round(difference, 2),
+                'total_owe': float(total_owe),
+                'total_owed': float(total_owed),
+                'difference': float(difference),
                 'sign': sign,
                 'closed_count': closed_this_month,
                 'remaining_count': open_count,
@@ -188,42 +145,6 @@ class StatisticsService:
             print(f"❌ Ошибка при расчете статистики: {e}")
             return None
 
-    @staticmethod
-    async def _convert_to_target(amount: float, from_currency: str,
-                                 to_currency: str, rates: Dict) -> Optional[float]:
-        """
-        Конвертировать сумму из одной валюты в другую через UZS
-
-        Args:
-            amount: Сумма для конвертации
-            from_currency: Исходная валюта
-            to_currency: Целевая валюта
-            rates: Словарь с курсами валют
-
-        Returns:
-            Сконвертированная сумма или None
-        """
-        try:
-            if from_currency == to_currency:
-                return amount
-
-            if from_currency not in rates or to_currency not in rates:
-                print(f"⚠️ Валюта {from_currency} или {to_currency} не найдена в курсах")
-                return None
-
-            # Конвертируем через UZS как базовую валюту
-            # Сначала переводим в UZS
-            uzs_amount = amount * rates[from_currency]
-
-            # Затем из UZS в целевую валюту
-            result = uzs_amount / rates[to_currency]
-
-            return result
-
-        except Exception as e:
-            print(f"❌ Ошибка конвертации {from_currency} -> {to_currency}: {e}")
-            return None
-
     @staticmethod
     async def format_statistics_message(user_id: int, target_currency: str = "USD") -> str:
         """
@@ -238,14 +159,14 @@ class StatisticsService:
         """
         try:
             # Получаем язык пользователя
-            user_data = await get_user_data(user_id)
-            lang = user_data.get('lang', 'ru')
+            t = await user_catalog(user_id)
+            lang = t.lang
 
             # Получаем статистику
             stats = await StatisticsService.calculate_statistics(user_id, target_currency)
 
             if not stats:
-                return await tr(user_id, 'statistics_error')
+                return t.get('statistics_error')
 
             # Получаем символ валюты
             currency_symbols = {
@@ -269,17 +190,17 @@ class StatisticsService:
                 diff_str = f"{stats['sign']}{symbol}{abs(stats['difference']):,.2f}"
 
             # Формируем сообщение
-            message = f"""📊 {await tr(user_id, 'statistics_title')}
+            message = f"""📊 {t.get('statistics_title')}
 
- {await tr(user_id, 'statistics_debts')}: {owe_str}
- {await tr(user_id, 'statistics_loans')}: {owed_str}
- {await tr(user_id, 'statistics_difference')}: {diff_str}
+ {t.get('statistics_debts')}: {owe_str}
+ {t.get('statistics_loans')}: {owed_str}
+ {t.get('statistics_difference')}: {diff_str}
 
- {await tr(user_id, 'statistics_month', month=month_name)}:
- {await tr(user_id, 'statistics_closed')}: {stats['closed_count']}
- {await tr(user_id, 'statistics_remaining')}: {stats['remaining_count']}
+ {t.get('statistics_month', month=month_name)}:
+ {t.get('statistics_closed')}: {stats['closed_count']}
+ {t.get('statistics_remaining')}: {stats['remaining_count']}
 
- {await tr(user_id, 'statistics_currency')}: {target_currency}"""
+ {t.get('statistics_currency')}: {target_currency}"""
 
             return message
 
@@ -1,4 +1,4 @@
-from .texts import tr, LANGS
+from .texts import tr, LANGS, Catalog, catalog, user_catalog, validate_catalogs
 from .callbacks import CallbackData, DynamicCallbacks, ButtonNames
 from .keyboards import (
     main_menu,
@@ -41,7 +41,7 @@ def safe_str(value):
 
 __all__ = [
     # Texts and translations
-    'tr', 'LANGS',
+    'tr', 'LANGS', 'Catalog', 'catalog', 'user_catalog', 'validate_catalogs',
 
     # Callback constants
     'CallbackData', 'DynamicCallbacks', 'ButtonNames',
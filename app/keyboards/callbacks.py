@@ -24,6 +24,8 @@ class CallbackData:
     # === MY DEBTS SUBMENU ===
     DEBTS_LIST = 'debts_list'
     EXPORT_EXCEL = 'export_excel'
+    EXPORT_CSV = 'export_csv'
+    EXPORT_JSONL = 'export_jsonl'
 
     # === SETTINGS SUBMENU ===
     AI_DEBT_ADD = 'ai_debt_add'
@@ -2,71 +2,73 @@
 Клавиатуры для бота
 """
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from app.keyboards.texts import tr
+from app.keyboards.texts import user_catalog
 from .callbacks import CallbackData, DynamicCallbacks, ButtonNames
 
 
 async def main_menu(user_id: int) -> InlineKeyboardMarkup:
     """Главное меню согласно новым требованиям"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'add_debt'),
+                text=t.get('add_debt'),
                 callback_data=CallbackData.ADD_DEBT_MENU
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'my_debts'),
+                text=t.get('my_debts'),
                 callback_data=CallbackData.MY_DEBTS
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'reminders_menu'),
+                text=t.get('reminders_menu'),
                 callback_data=CallbackData.REMINDERS_MENU
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'statistics'),
+                text=t.get('statistics'),
                 callback_data=CallbackData.STATISTICS
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'currency_rates'),
+                text=t.get('currency_rates'),
                 callback_data=CallbackData.CURRENCY_RATES
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'settings'),
+                text=t.get('settings'),
                 callback_data=CallbackData.SETTINGS
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'help'),
+                text=t.get('help'),
                 callback_data=CallbackData.HOW_TO_USE
             )
         ]
     ])
 
 async def add_debts_menu(user_id: int) -> InlineKeyboardMarkup:
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-            text=await tr(user_id, 'add_debt'),
+            text=t.get('add_debt'),
             callback_data=CallbackData.ADD_DEBT
         ),
         ],
         [
 
             InlineKeyboardButton(
-                text=await tr(user_id, 'ai_debt_add'),
+                text=t.get('ai_debt_add'),
                 callback_data=CallbackData.AI_DEBT_ADD
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -77,23 +79,34 @@ async def add_debts_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def my_debts_menu(user_id: int) -> InlineKeyboardMarkup:
     """Подменю 'Мои долги'"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
 
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'export_excel_btn'),
+                text=t.get('export_excel_btn'),
                 callback_data=CallbackData.EXPORT_EXCEL
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'clear_all'),
+                text=t.get('export_csv_btn'),
+                callback_data=CallbackData.EXPORT_CSV
+            ),
+            InlineKeyboardButton(
+                text=t.get('export_jsonl_btn'),
+                callback_data=CallbackData.EXPORT_JSONL
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=t.get('clear_all'),
                 callback_data=CallbackData.CLEAR_ALL
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -102,23 +115,24 @@ async def my_debts_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def settings_menu(user_id: int) -> InlineKeyboardMarkup:
     """Подменю 'Настройки'"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'change_lang'),
+                text=t.get('change_lang'),
                 callback_data=CallbackData.CHANGE_LANG
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'how_to_use_btn'),
+                text=t.get('how_to_use_btn'),
                 callback_data=CallbackData.HOW_TO_USE
             )
         ],
 
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -127,30 +141,31 @@ async def settings_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def reminders_menu(user_id: int) -> InlineKeyboardMarkup:
     """Главное меню напоминаний"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'debt_reminders'),
+                text=t.get('debt_reminders'),
                 callback_data=CallbackData.DEBT_REMINDERS
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'currency_reminders'),
+                text=t.get('currency_reminders'),
                 callback_data=CallbackData.CURRENCY_REMINDERS
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'add_reminder'),
+                text=t.get('add_reminder'),
                 callback_data=CallbackData.ADD_REMINDER
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'my_reminders'),
+                text=t.get('my_reminders'),
                 callback_data=CallbackData.MY_REMINDERS
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -159,8 +174,9 @@ async def reminders_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def debt_reminders_menu(user_id: int, enabled: bool = False) -> InlineKeyboardMarkup:
     """Меню напоминаний о долгах"""
+    t = await user_catalog(user_id)
     toggle_button = InlineKeyboardButton(
-        text=await tr(user_id, 'disable_reminders' if enabled else 'enable_reminders'),
+        text=t.get('disable_reminders' if enabled else 'enable_reminders'),
         callback_data=CallbackData.TOGGLE_DEBT_REMINDERS
     )
     
@@ -168,13 +184,13 @@ async def debt_reminders_menu(user_id: int, enabled: bool = False) -> InlineKeyb
         [toggle_button],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'setup_time'),
+                text=t.get('setup_time'),
                 callback_data=CallbackData.SETUP_REMINDER_TIME
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.REMINDERS_MENU
             )
         ]
@@ -183,12 +199,13 @@ async def debt_reminders_menu(user_id: int, enabled: bool = False) -> InlineKeyb
 
 async def currency_reminders_menu(user_id: int, morning_enabled: bool = False, evening_enabled: bool = False) -> InlineKeyboardMarkup:
     """Меню напоминаний о курсе валют"""
+    t = await user_catalog(user_id)
     buttons = []
     
     if not morning_enabled:
         buttons.append([
             InlineKeyboardButton(
-                text=await tr(user_id, 'enable_morning_rates'),
+                text=t.get('enable_morning_rates'),
                 callback_data=CallbackData.ENABLE_MORNING_RATES
             )
         ])
@@ -196,7 +213,7 @@ async def currency_reminders_menu(user_id: int, morning_enabled: bool = False, e
     if not evening_enabled:
         buttons.append([
             InlineKeyboardButton(
-                text=await tr(user_id, 'enable_evening_rates'),
+                text=t.get('enable_evening_rates'),
                 callback_data=CallbackData.ENABLE_EVENING_RATES
             )
         ])
@@ -204,14 +221,14 @@ async def currency_reminders_menu(user_id: int, morning_enabled: bool = False, e
     if morning_enabled or evening_enabled:
         buttons.append([
             InlineKeyboardButton(
-                text=await tr(user_id, 'disable_currency_rates'),
+                text=t.get('disable_currency_rates'),
                 callback_data=CallbackData.DISABLE_CURRENCY_RATES
             )
         ])
     
     buttons.append([
         InlineKeyboardButton(
-            text=await tr(user_id, 'back'),
+            text=t.get('back'),
             callback_data=CallbackData.REMINDERS_MENU
         )
     ])
@@ -221,22 +238,23 @@ async def currency_reminders_menu(user_id: int, morning_enabled: bool = False, e
 
 async def reminder_repeat_menu(user_id: int) -> InlineKeyboardMarkup:
     """Меню выбора повторения напоминания"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'no_repeat'),
+                text=t.get('no_repeat'),
                 callback_data=CallbackData.REPEAT_NO
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'daily_repeat'),
+                text=t.get('daily_repeat'),
                 callback_data=CallbackData.REPEAT_DAILY
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'monthly_repeat'),
+                text=t.get('monthly_repeat'),
                 callback_data=CallbackData.REPEAT_MONTHLY
             )
         ]
@@ -245,16 +263,17 @@ async def reminder_repeat_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def my_reminders_menu(user_id: int) -> InlineKeyboardMarkup:
     """Меню списка напоминаний"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'reminders_list'),
+                text=t.get('reminders_list'),
                 callback_data=CallbackData.REMINDERS_LIST
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=CallbackData.REMINDERS_MENU
             )
         ]
@@ -263,14 +282,15 @@ async def my_reminders_menu(user_id: int) -> InlineKeyboardMarkup:
 
 async def reminder_actions_keyboard(reminder_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура действий с напоминанием"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'edit'),
+                text=t.get('edit'),
                 callback_data=DynamicCallbacks.reminder_action('edit', reminder_id)
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'delete'),
+                text=t.get('delete'),
                 callback_data=DynamicCallbacks.reminder_action('delete', reminder_id)
             )
         ]
@@ -279,28 +299,29 @@ async def reminder_actions_keyboard(reminder_id: int, user_id: int) -> InlineKey
 
 async def edit_reminder_menu(reminder_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Меню редактирования напоминания"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'edit_reminder_text'),
+                text=t.get('edit_reminder_text'),
                 callback_data=DynamicCallbacks.edit_reminder_field('text', reminder_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'edit_reminder_datetime'),
+                text=t.get('edit_reminder_datetime'),
                 callback_data=DynamicCallbacks.edit_reminder_field('datetime', reminder_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'edit_reminder_repeat'),
+                text=t.get('edit_reminder_repeat'),
                 callback_data=DynamicCallbacks.edit_reminder_field('repeat', reminder_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=DynamicCallbacks.reminder_action('view', reminder_id)
             )
         ]
@@ -310,22 +331,23 @@ async def edit_reminder_menu(reminder_id: int, user_id: int) -> InlineKeyboardMa
 # Существующие клавиатуры остаются без изменений
 async def language_menu(user_id: int) -> InlineKeyboardMarkup:
     """Меню выбора языка"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'lang_ru'),
+                text=t.get('lang_ru'),
                 callback_data=CallbackData.SETLANG_RU
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'lang_uz'),
+                text=t.get('lang_uz'),
                 callback_data=CallbackData.SETLANG_UZ
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'to_menu'),
+                text=t.get('to_menu'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -343,16 +365,17 @@ async def currency_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 async def direction_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура выбора направления долга"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'dir_gave'),
+                text=t.get('dir_gave'),
                 callback_data=CallbackData.DIR_GAVE
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'dir_took'),
+                text=t.get('dir_took'),
                 callback_data=CallbackData.DIR_TOOK
             )
         ]
@@ -361,10 +384,11 @@ async def direction_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 async def skip_comment_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для пропуска комментария"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'skip_comment'),
+                text=t.get('skip_comment'),
                 callback_data=CallbackData.SKIP_COMMENT
             )
         ]
@@ -372,19 +396,21 @@ async def skip_comment_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 
 async def menu_button(user_id: int) -> InlineKeyboardMarkup:
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'to_menu'),
+                text=t.get('to_menu'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
     ])
 async def back_menu_reminder_button(user_id: int) -> InlineKeyboardMarkup:
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'to_menu'),
+                text=t.get('to_menu'),
                 callback_data=CallbackData.BACK_MAIN_REMINDER
             )
         ]
@@ -392,6 +418,7 @@ async def back_menu_reminder_button(user_id: int) -> InlineKeyboardMarkup:
 
 async def currency_edit_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для редактирования валюты конкретного долга"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
@@ -413,7 +440,7 @@ async def currency_edit_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMa
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'to_menu'),
+                text=t.get('to_menu'),
                 callback_data=CallbackData.BACK_MAIN
             )
         ]
@@ -422,30 +449,31 @@ async def currency_edit_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMa
 
 async def debt_actions_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура действий с долгом"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'edit'),
+                text=t.get('edit'),
                 callback_data=DynamicCallbacks.debt_action('edit', debt_id)
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'close'),
+                text=t.get('close'),
                 callback_data=DynamicCallbacks.debt_action('close', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'extend'),
+                text=t.get('extend'),
                 callback_data=DynamicCallbacks.debt_action('extend', debt_id)
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'delete'),
+                text=t.get('delete'),
                 callback_data=DynamicCallbacks.debt_action('delete', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'to_list'),
+                text=t.get('to_list'),
                 callback_data=CallbackData.MY_DEBTS
             )
         ]
@@ -454,14 +482,15 @@ async def debt_actions_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMar
 
 async def confirm_keyboard(action: str, debt_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения действия"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'yes'),
+                text=t.get('yes'),
                 callback_data=DynamicCallbacks.confirm_action(action, debt_id)
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'no'),
+                text=t.get('no'),
                 callback_data=CallbackData.BACK
             )
         ]
@@ -470,40 +499,41 @@ async def confirm_keyboard(action: str, debt_id: int, user_id: int) -> InlineKey
 
 async def edit_fields_keyboard(debt_id: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для выбора поля редактирования"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'editfield_person_btn'),
+                text=t.get('editfield_person_btn'),
                 callback_data=DynamicCallbacks.edit_field('person', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'editfield_amount_btn'),
+                text=t.get('editfield_amount_btn'),
                 callback_data=DynamicCallbacks.edit_field('amount', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'editfield_currency_btn'),
+                text=t.get('editfield_currency_btn'),
                 callback_data=DynamicCallbacks.edit_field('currency', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'editfield_due_btn'),
+                text=t.get('editfield_due_btn'),
                 callback_data=DynamicCallbacks.edit_field('due', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'editfield_comment_btn'),
+                text=t.get('editfield_comment_btn'),
                 callback_data=DynamicCallbacks.edit_field('comment', debt_id)
             )
         ],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'back'),
+                text=t.get('back'),
                 callback_data=DynamicCallbacks.debt_action('view', debt_id)
             )
         ]
@@ -2,12 +2,13 @@
 Клавиатуры с пагинацией для списков долгов и дополнительные клавиатуры
 """
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from .texts import tr
+from .texts import user_catalog
 from ..database.models import safe_str
 
 
 async def debts_list_keyboard_paginated(debts: list, user_id: int, page: int = 0, per_page: int = 5) -> InlineKeyboardMarkup:
     """Клавиатура со списком долгов с пагинацией"""
+    t = await user_catalog(user_id)
     keyboard = []
     start = page * per_page
     end = start + per_page
@@ -27,14 +28,14 @@ async def debts_list_keyboard_paginated(debts: list, user_id: int, page: int = 0
     if page > 0:
         nav_buttons.append(
             InlineKeyboardButton(
-                text=await tr(user_id, 'backward'),
+                text=t.get('backward'),
                 callback_data=f'debts_page_{page-1}'
             )
         )
     if end < len(debts):
         nav_buttons.append(
             InlineKeyboardButton(
-                text=await tr(user_id, 'forward'),
+                text=t.get('forward'),
                 callback_data=f'debts_page_{page+1}'
             )
         )
@@ -48,6 +49,7 @@ async def debts_list_keyboard_paginated(debts: list, user_id: int, page: int = 0
 
 async def debts_list_keyboard(debts: list, user_id: int) -> InlineKeyboardMarkup:
     """Простая клавиатура со списком долгов без пагинации"""
+    t = await user_catalog(user_id)
     keyboard = []
 
     for debt in debts:
@@ -62,7 +64,7 @@ async def debts_list_keyboard(debts: list, user_id: int) -> InlineKeyboardMarkup
     # Кнопка возврата в меню
     keyboard.append([
         InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )
     ])
@@ -72,31 +74,32 @@ async def debts_list_keyboard(debts: list, user_id: int) -> InlineKeyboardMarkup
 
 async def debt_card_keyboard(debt_id: int, page: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для карточки долга"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'edit'),
+            text=t.get('edit'),
             callback_data=f'edit_{debt_id}_{page}'
         )],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'close'),
+                text=t.get('close'),
                 callback_data=f'close_{debt_id}_{page}'
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'extend'),
+                text=t.get('extend'),
                 callback_data=f'extend_{debt_id}_{page}'
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'delete'),
+                text=t.get('delete'),
                 callback_data=f'del_{debt_id}_{page}'
             )
         ],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_list'),
+            text=t.get('to_list'),
             callback_data=f'debts_page_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )],
     ])
@@ -104,27 +107,28 @@ async def debt_card_keyboard(debt_id: int, page: int, user_id: int) -> InlineKey
 
 async def reminder_debt_actions_keyboard(debt_id: int, page: int, user_id: int) -> InlineKeyboardMarkup:
     """Кнопки для карточки долга в напоминаниях"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'edit'),
+            text=t.get('edit'),
             callback_data=f'edit_{debt_id}_{page}'
         )],
         [
             InlineKeyboardButton(
-                text=await tr(user_id, 'close'),
+                text=t.get('close'),
                 callback_data=f'close_{debt_id}_{page}'
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'extend'),
+                text=t.get('extend'),
                 callback_data=f'extend_{debt_id}_{page}'
             ),
             InlineKeyboardButton(
-                text=await tr(user_id, 'delete'),
+                text=t.get('delete'),
                 callback_data=f'del_{debt_id}_{page}'
             )
         ],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )]
     ])
@@ -132,29 +136,30 @@ async def reminder_debt_actions_keyboard(debt_id: int, page: int, user_id: int)
 
 async def edit_debt_menu_keyboard(debt_id: int, page: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для меню редактирования долга"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'editfield_person_btn'),
+            text=t.get('editfield_person_btn'),
             callback_data=f'editfield_person_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'editfield_amount_btn'),
+            text=t.get('editfield_amount_btn'),
             callback_data=f'editfield_amount_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'editfield_currency_btn'),
+            text=t.get('editfield_currency_btn'),
             callback_data=f'editfield_currency_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'editfield_due_btn'),
+            text=t.get('editfield_due_btn'),
             callback_data=f'editfield_due_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'editfield_comment_btn'),
+            text=t.get('editfield_comment_btn'),
             callback_data=f'editfield_comment_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )],
     ])
@@ -162,6 +167,7 @@ async def edit_debt_menu_keyboard(debt_id: int, page: int, user_id: int) -> Inli
 
 async def edit_currency_debt_keyboard(debt_id: int, page: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для редактирования валюты долга"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
             text='USD',
@@ -176,7 +182,7 @@ async def edit_currency_debt_keyboard(debt_id: int, page: int, user_id: int) ->
             callback_data=f'editcur_EUR_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )],
     ])
@@ -184,13 +190,14 @@ async def edit_currency_debt_keyboard(debt_id: int, page: int, user_id: int) ->
 
 async def confirm_action_keyboard(action: str, debt_id: int, page: int, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения действия"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'yes'),
+            text=t.get('yes'),
             callback_data=f'confirm_{action}_{debt_id}_{page}'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'no'),
+            text=t.get('no'),
             callback_data=f'debtcard_{debt_id}_{page}'
         )],
     ])
@@ -198,13 +205,14 @@ async def confirm_action_keyboard(action: str, debt_id: int, page: int, user_id:
 
 async def clear_all_confirm_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения очистки всех долгов"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'yes'),
+            text=t.get('yes'),
             callback_data='confirm_clear_all'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'no'),
+            text=t.get('no'),
             callback_data='cancel_action'
         )],
     ])
@@ -212,13 +220,14 @@ async def clear_all_confirm_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 async def reminders_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для меню напоминаний"""
+    t = await user_catalog(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
-            text=await tr(user_id, 'reminder_change'),
+            text=t.get('reminder_change'),
             callback_data='reminder_change_time'
         )],
         [InlineKeyboardButton(
-            text=await tr(user_id, 'to_menu'),
+            text=t.get('to_menu'),
             callback_data='back_main'
         )],
     ])
\ No newline at end of file
@@ -1,4 +1,7 @@
-from ..database.crud import get_user_data
+import string
+from typing import Any, Dict, FrozenSet, List, Optional, Union
+
+from ..database.crud import get_user_lang, DEFAULT_LANG
 
 LANGS = {
     'ru': {
@@ -113,6 +116,10 @@ LANGS = {
         'export_loading': '⏳ Подготавливаю экспорт данных...',
         'export_success_caption': '📊 Экспорт завершен успешно!\n\n📝 Файл содержит:\n• Все активные долги\n• Информацию о должниках/кредиторах\n• Суммы и валюты\n• Даты и комментарии\nhttps://telegra.ph/Kak-ispravit-oshibku-pri-otkrytii-fajla-Exel-10-03',
         'export_error': '❌ Ошибка при экспорте данных. Попробуйте позже.',
+        'export_busy': '⏳ Предыдущий экспорт ещё готовится, дождитесь файла.',
+        'export_csv_btn': '📄 CSV',
+        'export_jsonl_btn': '🧾 JSON Lines',
+        'export_stream_caption': '📄 Экспорт завершен успешно!\n\n📝 Файл содержит все ваши активные долги. Большие файлы сжаты в .gz.',
         'back_main_btn': '🏠 Главное меню',
         "export_col_id": "ID",
         "export_col_person": "Имя",
@@ -393,6 +400,10 @@ LANGS = {
         "export_loading": "⏳ Eksport tayyorlanmoqda...",
         "export_success_caption": "📊 Eksport muvaffaqiyatli tugallandi!\n\n📝 Fayl quyidagilarni o'z ichiga oladi:\n• Barcha faol qarzlar\n• Qarzdorlar/kreditorlar haqida ma'lumot\n• Summalar va valyutalar\n• Sanalar va sharhlar\nhttps://telegra.ph/Qanday-qilib-Exel-faylini-eksportidagi-hatolikni-tuzatish-10-03",
         "export_error": "❌ Ma'lumotlarni eksport qilishda xatolik. Keyinroq urinib ko'ring.",
+        "export_busy": "⏳ Oldingi eksport hali tayyorlanmoqda, faylni kuting.",
+        "export_csv_btn": "📄 CSV",
+        "export_jsonl_btn": "🧾 JSON Lines",
+        "export_stream_caption": "📄 Eksport muvaffaqiyatli tugallandi!\n\n📝 Faylda barcha faol qarzlaringiz bor. Katta fayllar .gz ko'rinishida siqilgan.",
         "back_main_btn": "🏠 Asosiy menyu",
         "export_col_id": "ID",
         "export_col_person": "Ism",
@@ -488,14 +499,121 @@ LANGS = {
 }
 
 
-async def tr(user_id: int, key: str, **kwargs) -> str:
-    """Получить переведенный текст для пользователя"""
+class _KeepMissing(dict):
+    """Оставляет неизвестные плейсхолдеры как есть вместо KeyError"""
+
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+_formatter = string.Formatter()
+
+
+def _parse_fields(template: str) -> FrozenSet[str]:
+    """Имена плейсхолдеров шаблона ({name} -> name)"""
+    return frozenset(
+        field.split('.')[0].split('[')[0]
+        for _, field, _, _ in _formatter.parse(template)
+        if field
+    )
+
+
+class Catalog:
+    """
+    Скомпилированный каталог переводов одного языка.
+
+    Шаблоны разбираются один раз при импорте, get() синхронный и не
+    обращается к БД. Если ключа нет — берётся из резервного каталога (ru),
+    а затем возвращается сам ключ, как и раньше в tr().
+    """
+
+    def __init__(self, lang: str, texts: Dict[str, str], fallback: Optional['Catalog'] = None):
+        self.lang = lang
+        self.fallback = fallback
+        self._texts = dict(texts)
+        self._fields = {key: _parse_fields(text) for key, text in self._texts.items()}
+        # Шаблоны без фигурных скобок можно вообще не форматировать
+        self._static = {key for key, text in self._texts.items() if '{' not in text and '}' not in text}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._texts
+
+    def fields(self, key: str) -> FrozenSet[str]:
+        """Плейсхолдеры шаблона"""
+        return self._fields.get(key, frozenset())
+
+    def get(self, key: str, **kwargs) -> str:
+        """Получить текст по ключу и подставить параметры"""
+        text = self._texts.get(key)
+        if text is None:
+            if self.fallback is not None:
+                return self.fallback.get(key, **kwargs)
+            return key
+
+        if not kwargs or key in self._static:
+            return text
+        return text.format_map(_KeepMissing(kwargs))
+
+
+def _build_catalogs() -> Dict[str, Catalog]:
+    base = Catalog(DEFAULT_LANG, LANGS[DEFAULT_LANG])
+    catalogs = {DEFAULT_LANG: base}
+    for lang, texts in LANGS.items():
+        if lang != DEFAULT_LANG:
+            catalogs[lang] = Catalog(lang, texts, fallback=base)
+    return catalogs
+
+
+CATALOGS = _build_catalogs()
+
+
+def catalog(lang: Optional[str]) -> Catalog:
+    """Каталог для языка (неизвестный язык -> русский)"""
+    return CATALOGS.get(lang) or CATALOGS[DEFAULT_LANG]
+
+
+async def user_catalog(user_id: Union[int, Dict[str, Any]]) -> Catalog:
+    """
+    Каталог пользователя — одно обращение к кэшу языка на весь билдер.
+    Вместо user_id можно передать user_settings из UserSettingsMiddleware.
+    """
     try:
-        user_data = await get_user_data(user_id)
-        lang = user_data.get('lang', 'ru')
-        text = LANGS[lang].get(key, key)
-        return text.format(**kwargs) if kwargs else text
+        if isinstance(user_id, dict):
+            return catalog(user_id.get('lang'))
+        return catalog(await get_user_lang(user_id))
     except Exception:
-        # В случае ошибки возвращаем русский текст
-        text = LANGS['ru'].get(key, key)
-        return text.format(**kwargs) if kwargs else text
\ No newline at end of file
+        return catalog(DEFAULT_LANG)
+
+
+def validate_catalogs() -> List[str]:
+    """
+    Проверить, что во всех языках одинаковые ключи и плейсхолдеры.
+    Возвращает список найденных проблем (пустой — всё в порядке).
+    """
+    problems = []
+    base = CATALOGS[DEFAULT_LANG]
+    for lang, cat in CATALOGS.items():
+        if cat is base:
+            continue
+        for key in LANGS[DEFAULT_LANG]:
+            if key not in cat:
+                problems.append(f"[{lang}] нет перевода для '{key}'")
+            elif cat.fields(key) != base.fields(key):
+                problems.append(
+                    f"[{lang}] '{key}': плейсхолдеры {sorted(cat.fields(key))} "
+                    f"не совпадают с {DEFAULT_LANG} {sorted(base.fields(key))}"
+                )
+        for key in LANGS[lang]:
+            if key not in base:
+                problems.append(f"[{lang}] лишний ключ '{key}' (нет в {DEFAULT_LANG})")
+    return problems
+
+
+async def tr(user_id: Union[int, Dict[str, Any]], key: str, **kwargs) -> str:
+    """
+    Получить переведенный текст для пользователя
+
+    Вместо user_id можно передать user_settings из UserSettingsMiddleware.
+    Для билдеров с множеством строк удобнее один раз взять user_catalog().
+    """
+    return (await user_catalog(user_id)).get(key, **kwargs)
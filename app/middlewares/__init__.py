@@ -0,0 +1,3 @@
+from .user_settings import UserSettingsMiddleware
+
+__all__ = ['UserSettingsMiddleware']
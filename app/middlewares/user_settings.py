@@ -0,0 +1,38 @@
+"""
+Middleware, загружающее настройки пользователя один раз на апдейт
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from ..database.crud import get_user_settings
+
+
+class UserSettingsMiddleware(BaseMiddleware):
+    """
+    Загружает строку пользователя (lang, notify_time, currency_notify_time,
+    referral_id) одним запросом и кладёт её в data['user_settings'].
+
+    Заодно прогревает кэш языка, поэтому все вызовы tr() внутри
+    обработчика и билдеров клавиатур обходятся без обращений к БД.
+    Для незарегистрированных пользователей user_settings = None.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        settings = None
+
+        if user is not None:
+            try:
+                settings = await get_user_settings(user.id)
+            except Exception as e:
+                print(f"❌ Ошибка загрузки настроек пользователя {user.id}: {e}")
+
+        data['user_settings'] = settings
+        return await handler(event, data)
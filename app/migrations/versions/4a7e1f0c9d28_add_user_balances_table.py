@@ -0,0 +1,45 @@
+"""add user balances table
+
+Revision ID: 4a7e1f0c9d28
+Revises: e5f8a2c4b671
+Create Date: 2026-10-17 17:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a7e1f0c9d28'
+down_revision: Union[str, Sequence[str], None] = 'e5f8a2c4b671'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_balances',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('currency', sa.String(), nullable=False),
+    sa.Column('direction', sa.String(), nullable=False),
+    sa.Column('total', sa.BigInteger(), nullable=False),
+    sa.Column('debts_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'currency', 'direction')
+    )
+
+    # Начальное заполнение из текущих долгов
+    op.execute(
+        "INSERT INTO user_balances (user_id, currency, direction, total, debts_count, updated_at) "
+        "SELECT user_id, COALESCE(currency, 'UZS'), direction, SUM(amount), COUNT(id), CURRENT_TIMESTAMP "
+        "FROM debts WHERE is_active = true AND closed = false "
+        "GROUP BY user_id, COALESCE(currency, 'UZS'), direction"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_balances')
@@ -0,0 +1,63 @@
+"""add hot path indexes
+
+Revision ID: 9b41c0d7e2a3
+Revises: 3c9d2e7f1a05
+Create Date: 2026-10-17 14:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b41c0d7e2a3'
+down_revision: Union[str, Sequence[str], None] = '3c9d2e7f1a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Условия частичных индексов должны совпадать с тем, как SQLAlchemy рендерит
+# фильтры в запросах: SQLite сравнивает условия текстуально (is_active = 1),
+# PostgreSQL сам нормализует is_active = true.
+def _where(postgresql: str, sqlite: str) -> dict:
+    return {
+        'postgresql_where': sa.text(postgresql),
+        'sqlite_where': sa.text(sqlite),
+    }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_debts_user_active_closed', 'debts',
+                    ['user_id', 'is_active', 'closed'], unique=False)
+    op.create_index('ix_debts_open_due', 'debts', ['due', 'user_id'], unique=False,
+                    **_where('is_active = true AND closed = false',
+                             'is_active = 1 AND closed = 0'))
+
+    op.create_index('ix_reminders_active_repeat_due', 'reminders',
+                    ['is_active', 'repeat', 'due'], unique=False)
+    op.create_index('ix_reminders_user_active', 'reminders',
+                    ['user_id', 'is_active'], unique=False)
+
+    op.create_index('ix_scheduled_messages_pending', 'scheduled_messages',
+                    ['schedule_time'], unique=False,
+                    **_where('sent = false AND is_active = true',
+                             'sent = 0 AND is_active = 1'))
+
+    op.create_index('ix_users_notify_time', 'users', ['notify_time'], unique=False,
+                    **_where('is_active = true', 'is_active = 1'))
+    op.create_index('ix_users_currency_notify_time', 'users', ['currency_notify_time'], unique=False,
+                    **_where('is_active = true', 'is_active = 1'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_currency_notify_time', table_name='users')
+    op.drop_index('ix_users_notify_time', table_name='users')
+    op.drop_index('ix_scheduled_messages_pending', table_name='scheduled_messages')
+    op.drop_index('ix_reminders_user_active', table_name='reminders')
+    op.drop_index('ix_reminders_active_repeat_due', table_name='reminders')
+    op.drop_index('ix_debts_open_due', table_name='debts')
+    op.drop_index('ix_debts_user_active_closed', table_name='debts')
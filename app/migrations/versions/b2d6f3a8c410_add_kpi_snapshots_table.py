@@ -0,0 +1,35 @@
+"""add kpi snapshots table
+
+Revision ID: b2d6f3a8c410
+Revises: 4a7e1f0c9d28
+Create Date: 2026-10-17 18:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d6f3a8c410'
+down_revision: Union[str, Sequence[str], None] = '4a7e1f0c9d28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('kpi_snapshots',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_kpi_snapshots_created_at'), 'kpi_snapshots', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_kpi_snapshots_created_at'), table_name='kpi_snapshots')
+    op.drop_table('kpi_snapshots')
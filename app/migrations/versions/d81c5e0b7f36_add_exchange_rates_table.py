@@ -0,0 +1,36 @@
+"""add exchange rates table
+
+Revision ID: d81c5e0b7f36
+Revises: b2d6f3a8c410
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81c5e0b7f36'
+down_revision: Union[str, Sequence[str], None] = 'b2d6f3a8c410'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('exchange_rates',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('fetched_at', sa.DateTime(), nullable=False),
+    sa.Column('currency', sa.String(), nullable=False),
+    sa.Column('rate', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_exchange_rates_fetched_at'), 'exchange_rates', ['fetched_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_exchange_rates_fetched_at'), table_name='exchange_rates')
+    op.drop_table('exchange_rates')
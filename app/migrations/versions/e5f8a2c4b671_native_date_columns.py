@@ -0,0 +1,121 @@
+"""native date columns for debts and scheduled messages
+
+Revision ID: e5f8a2c4b671
+Revises: 9b41c0d7e2a3
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f8a2c4b671'
+down_revision: Union[str, Sequence[str], None] = '9b41c0d7e2a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Форматы, которые могли попасть в строковые колонки (бот, ИИ, веб-админка)
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M',
+                    '%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S.%f')
+# Срок для нераспознанного due — как предлагает бот при вводе срока.
+# Отсчитывается не раньше дня миграции, чтобы долг не стал просроченным.
+DEFAULT_TERM_DAYS = 7
+
+
+def _parse(value, formats):
+    if value is None:
+        return None
+    text = str(value).strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _backfill():
+    """Привести строки к ISO, чтобы приведение типа прошло без ошибок"""
+    bind = op.get_bind()
+
+    rows = bind.execute(sa.text('SELECT id, date, due, created_at FROM debts')).fetchall()
+    today = datetime.utcnow()
+    unparsed_due = []
+    for row in rows:
+        created = _parse(row.created_at, DATETIME_FORMATS) if isinstance(row.created_at, str) else row.created_at
+        fallback = (created or today).strftime('%Y-%m-%d')
+
+        parsed_date = _parse(row.date, DATE_FORMATS)
+        date_value = parsed_date.strftime('%Y-%m-%d') if parsed_date else fallback
+        parsed_due = _parse(row.due, DATE_FORMATS)
+        if parsed_due:
+            due_value = parsed_due.strftime('%Y-%m-%d')
+        else:
+            start = max(datetime.strptime(date_value, '%Y-%m-%d'), today)
+            due_value = (start + timedelta(days=DEFAULT_TERM_DAYS)).strftime('%Y-%m-%d')
+            unparsed_due.append(row.id)
+
+        if (date_value, due_value) != (row.date, row.due):
+            if not parsed_date or not parsed_due:
+                print(f"⚠️ Долг {row.id}: нераспознанная дата ({row.date!r}, {row.due!r}), подставлено {date_value}/{due_value}")
+            bind.execute(
+                sa.text('UPDATE debts SET date = :date, due = :due WHERE id = :id'),
+                {'date': date_value, 'due': due_value, 'id': row.id}
+            )
+    if unparsed_due:
+        print(f"⚠️ Долги с нераспознанным сроком (срок = +{DEFAULT_TERM_DAYS} дн.): {unparsed_due}")
+
+    rows = bind.execute(sa.text('SELECT id, schedule_time FROM scheduled_messages')).fetchall()
+    for row in rows:
+        parsed = _parse(row.schedule_time, DATETIME_FORMATS) or _parse(row.schedule_time, DATE_FORMATS)
+        if parsed is None:
+            # Нераспознанное время — сообщение уже не отправить корректно, выключаем
+            print(f"⚠️ Сообщение {row.id}: нераспознанное время {row.schedule_time!r}, отключено")
+            bind.execute(
+                sa.text("UPDATE scheduled_messages SET schedule_time = :value, is_active = :off WHERE id = :id"),
+                {'value': '1970-01-01 00:00:00', 'off': False, 'id': row.id}
+            )
+            continue
+        value = parsed.strftime('%Y-%m-%d %H:%M:%S')
+        if value != row.schedule_time:
+            bind.execute(
+                sa.text('UPDATE scheduled_messages SET schedule_time = :value WHERE id = :id'),
+                {'value': value, 'id': row.id}
+            )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _backfill()
+
+    # SQLite хранит Date/DateTime как ISO-строки — после backfill данные
+    # уже в нужном формате, пересоздавать таблицы не нужно
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.alter_column('debts', 'date', existing_type=sa.String(), type_=sa.Date(),
+                    existing_nullable=False, postgresql_using='date::date')
+    op.alter_column('debts', 'due', existing_type=sa.String(), type_=sa.Date(),
+                    existing_nullable=False, postgresql_using='due::date')
+    op.alter_column('scheduled_messages', 'schedule_time', existing_type=sa.String(), type_=sa.DateTime(),
+                    existing_nullable=False, postgresql_using='schedule_time::timestamp')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.alter_column('scheduled_messages', 'schedule_time', existing_type=sa.DateTime(), type_=sa.String(),
+                    existing_nullable=False,
+                    postgresql_using="to_char(schedule_time, 'YYYY-MM-DD HH24:MI:SS')")
+    op.alter_column('debts', 'due', existing_type=sa.Date(), type_=sa.String(),
+                    existing_nullable=False, postgresql_using="to_char(due, 'YYYY-MM-DD')")
+    op.alter_column('debts', 'date', existing_type=sa.Date(), type_=sa.String(),
+                    existing_nullable=False, postgresql_using="to_char(date, 'YYYY-MM-DD')")
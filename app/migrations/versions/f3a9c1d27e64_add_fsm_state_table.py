@@ -0,0 +1,36 @@
+"""add fsm state table
+
+Revision ID: f3a9c1d27e64
+Revises: d81c5e0b7f36
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c1d27e64'
+down_revision: Union[str, Sequence[str], None] = 'd81c5e0b7f36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('fsm_state',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('state', sa.String(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_fsm_state_updated_at'), 'fsm_state', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_fsm_state_updated_at'), table_name='fsm_state')
+    op.drop_table('fsm_state')
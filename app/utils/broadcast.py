@@ -2,165 +2,258 @@
 Утилиты для рассылок
 """
 import asyncio
-from datetime import datetime
-from typing import List, Tuple
+import json
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Dict, List, Optional, Set
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from ..database import (
-    get_all_users, save_scheduled_message,
-    get_pending_scheduled_messages, delete_scheduled_message
+    iter_user_batches, save_scheduled_message, delete_scheduled_message
+)
+from ..database.crud import (
+    get_scheduled_messages_by_ids,
+    create_broadcast_job, get_broadcast_job, get_runnable_broadcast_jobs,
+    update_broadcast_job, checkpoint_broadcast_job, get_user_count
 )
+from .delivery import delivery, FAILED
+from .due_queue import due_queue, MESSAGE
+from .sharding import to_main
 
+# Сколько получателей обрабатывается между чекпоинтами.
+# После падения повторно может уйти не больше одного чанка.
+BROADCAST_CHUNK_SIZE = 200
+# Не чаще, чем раз в столько секунд редактируем сообщение с прогрессом
+PROGRESS_EDIT_INTERVAL = 3
 
-async def send_broadcast_to_all_users(text: str, photo_id: str = None, admin_id: int = None) -> Tuple[
-    int, int, List[int]]:
-    """Отправить рассылку всем пользователям"""
-    from app.bot import bot
-    from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+# Паузы между повторами отложенного сообщения, которое не удалось отправить (мин)
+MESSAGE_RETRY_MINUTES = (1, 5, 15, 60)
+# Сколько повторов уже было: message_id -> количество
+_message_retries: Dict[int, int] = {}
 
-    users = await get_all_users()
-    success_count = 0
-    error_count = 0
-    blocked_users = []
+# Задачи, которые выполняются в этом процессе: job_id -> asyncio.Task
+_running_jobs: Dict[int, asyncio.Task] = {}
 
-    # Отправляем уведомление о начале рассылки
-    if admin_id:
-        try:
-            start_message = f"📤 Начинаю рассылку...\n\n📊 Всего получателей: {len(users)}\n📝 Тип: {'С фото' if photo_id else 'Только текст'}"
-            await bot.send_message(admin_id, start_message)
-        except Exception:
-            pass
 
-    for i, user in enumerate(users, 1):
-        try:
-            if photo_id:
-                await bot.send_photo(user['user_id'], photo_id, caption=text)
-            else:
-                await bot.send_message(user['user_id'], text)
-            success_count += 1
-
-            # Отправляем прогресс каждые 10 пользователей
-            if admin_id and i % 10 == 0:
-                try:
-                    progress = f"📤 Прогресс: {i}/{len(users)} ({round(i / len(users) * 100, 1)}%)"
-                    await bot.send_message(admin_id, progress)
-                except Exception:
-                    pass
-
-            await asyncio.sleep(0.1)  # Небольшая задержка между отправками
-
-        except TelegramForbiddenError:
-            error_count += 1
-            blocked_users.append(user['user_id'])
-            print(f"🚫 Пользователь {user['user_id']} заблокировал бота")
-
-        except TelegramBadRequest as e:
-            error_count += 1
-            blocked_users.append(user['user_id'])
-            print(f"❌ Неверный запрос для пользователя {user['user_id']}: {e}")
+async def schedule_message_for_user(user_id: int, text: str, photo_id: str = None, schedule_datetime: str = None) -> bool:
+    """Запланировать сообщение для конкретного пользователя"""
+    if schedule_datetime:
+        message_id = await save_scheduled_message(user_id, text, photo_id, schedule_datetime)
+        # Отправит очередь сроков; повторной задачи в APScheduler не нужно
+        due_queue.push(MESSAGE, message_id, datetime.strptime(schedule_datetime, '%Y-%m-%d %H:%M'))
+        return True
+    return False
 
+
+async def _send_and_close(messages: List[dict], handled: Set[int]):
+    """
+    Разослать пачку отложенных сообщений одним потоком delivery.send_many.
+    Каждое сообщение закрывается (или уходит на повтор) сразу после своей
+    отправки, его id попадает в handled.
+    """
+    items = []
+    # send_many возвращает в on_result тот же словарь — по нему находим сообщение
+    message_ids: Dict[int, int] = {}
+    for message in messages:
+        item = {'chat_id': message['user_id'], 'text': message['text'], 'photo_id': message.get('photo_id')}
+        message_ids[id(item)] = message['id']
+        items.append(item)
+
+    async def on_result(item: dict, status: str):
+        message_id = message_ids[id(item)]
+        handled.add(message_id)
+        if status == FAILED:
+            _retry_later(message_id)
+            return
+        # Отправлено или пользователь заблокировал бота — больше не пытаемся
+        _message_retries.pop(message_id, None)
+        try:
+            await delete_scheduled_message(message_id)
         except Exception as e:
-            error_count += 1
-            blocked_users.append(user['user_id'])
-            print(f"❌ Неизвестная ошибка для пользователя {user['user_id']}: {e}")
+            print(f"⚠️ Сообщение #{message_id} отправлено, но не удалено из БД: {e}")
 
-    return success_count, error_count, blocked_users
+    stats = await delivery.send_many(items, on_result=on_result)
+    print(f"✅ Отложенные сообщения: отправлено={stats['success']}, ошибок={stats['errors']}")
 
 
-async def send_scheduled_message(message_data: dict) -> bool:
-    """Отправить запланированное сообщение"""
-    from app.bot import bot
+def _retry_later(message_id: int):
+    """Вернуть неотправленное сообщение в очередь сроков с нарастающей паузой"""
+    attempt = _message_retries.get(message_id, 0)
+    if attempt >= len(MESSAGE_RETRY_MINUTES):
+        _message_retries.pop(message_id, None)
+        print(f"❌ Сообщение #{message_id} не отправлено после {attempt} повторов, повтор после перезапуска")
+        return
+    _message_retries[message_id] = attempt + 1
+    delay = MESSAGE_RETRY_MINUTES[attempt]
+    due_queue.push(MESSAGE, message_id, datetime.now() + timedelta(minutes=delay))
+    print(f"⚠️ Сообщение #{message_id} не отправлено, повтор через {delay} мин.")
 
+
+async def deliver_scheduled_messages(message_ids: List[int]):
+    """Отправить сообщения, срок которых наступил (вызывается очередью сроков)"""
+    handled: Set[int] = set()
     try:
-        if message_data['photo_id']:
-            await bot.send_photo(message_data['user_id'], message_data['photo_id'], caption=message_data['text'])
-        else:
-            await bot.send_message(message_data['user_id'], message_data['text'])
-        return True
+        await _send_and_close(await get_scheduled_messages_by_ids(message_ids), handled)
     except Exception as e:
-        # Не выводим ошибки в консоль, чтобы не засорять логи
-        return False
+        print(f"❌ Ошибка при обработке запланированных сообщений: {e}")
+        # Уже отправленные повторно не шлём
+        for message_id in message_ids:
+            if message_id not in handled:
+                _retry_later(message_id)
 
 
-async def schedule_message_for_user(user_id: int, text: str, photo_id: str = None, schedule_datetime: str = None) -> bool:
-    """Запланировать сообщение для конкретного пользователя"""
-    from app.utils.scheduler import scheduler
+# ==================== РАССЫЛКИ-ЗАДАЧИ ====================
 
-    if schedule_datetime:
-        await save_scheduled_message(user_id, text, photo_id, schedule_datetime)
-        # Добавляем задачу в планировщик
-        job_id = f"scheduled_msg_{user_id}_{datetime.now().timestamp()}"
-        schedule_time = datetime.strptime(schedule_datetime, '%Y-%m-%d %H:%M')
-        scheduler.add_job(
-            send_scheduled_message,
-            'date',
-            run_date=schedule_time,
-            id=job_id,
-            args=[{'user_id': user_id, 'text': text, 'photo_id': photo_id}]
+def build_buttons_markup(buttons) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура из списка кнопок [{'text', 'url'}] (или JSON-строки)"""
+    if isinstance(buttons, str):
+        try:
+            buttons = json.loads(buttons)
+        except ValueError:
+            buttons = None
+    rows = []
+    for btn in buttons or []:
+        text = (btn.get("text") or "").strip()
+        url = (btn.get("url") or "").strip()
+        if text and url:
+            rows.append([InlineKeyboardButton(text=text, url=url)])
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+def _progress_text(job: dict, done: bool = False) -> str:
+    processed = job['sent_count'] + job['error_count']
+    total = max(job['total'], processed)
+    pct = round(processed / total * 100, 1) if total else 100.0
+    title = "✅ Рассылка завершена!" if done else f"📤 Рассылка #{job['id']} идёт..."
+    return (
+        f"{title}\n\n"
+        f"📊 Прогресс: {processed}/{total} ({pct}%)\n"
+        f"✅ Успешно: {job['sent_count']}\n"
+        f"❌ Ошибок: {job['error_count']}\n"
+        f"🚫 Заблокировали: {job['blocked_count']}"
+    )
+
+
+async def _show_progress(bot, job: dict, done: bool = False):
+    """Создать или отредактировать единственное сообщение с прогрессом у админа"""
+    if not job.get('admin_id'):
+        return
+
+    text = _progress_text(job, done)
+    markup = None
+    if done:
+        markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📢 Новая рассылка", callback_data="admin_broadcast")],
+            [InlineKeyboardButton(text="🔙 В админ-панель", callback_data="admin_back")]
+        ])
+
+    try:
+        if job.get('progress_message_id'):
+            await bot.edit_message_text(
+                text, chat_id=job['admin_id'], message_id=job['progress_message_id'], reply_markup=markup
+            )
+        else:
+            msg = await bot.send_message(job['admin_id'], text, reply_markup=markup)
+            job['progress_message_id'] = msg.message_id
+            await update_broadcast_job(job['id'], progress_message_id=msg.message_id)
+    except Exception as e:
+        if "message is not modified" not in str(e).lower():
+            print(f"⚠️ Не удалось обновить прогресс рассылки #{job['id']}: {e}")
+
+
+async def run_broadcast_job(job_id: int):
+    """
+    Выполнить (или продолжить) рассылку: получатели берутся чанками по user_id > cursor,
+    после каждого чанка cursor и счётчики сохраняются в БД.
+    """
+    bot = delivery.bot
+
+    job = await get_broadcast_job(job_id)
+    if not job or job['status'] in ('done', 'cancelled'):
+        return
+
+    if job['status'] != 'running':
+        job['status'] = 'running'
+        job['total'] = await get_user_count()
+        await update_broadcast_job(
+            job_id, status='running', total=job['total'], started_at=datetime.utcnow()
+        )
+        print(f"📤 Рассылка #{job_id} запущена, получателей: {job['total']}")
+    else:
+        print(f"🔁 Рассылка #{job_id} продолжается с user_id > {job['cursor']}")
+
+    markup = build_buttons_markup(job['buttons'])
+    await _show_progress(bot, job)
+    last_edit = monotonic()
+
+    async for batch in iter_user_batches(BROADCAST_CHUNK_SIZE, after=job['cursor']):
+        # Задачу могли отменить (например, из веб-админки)
+        current = await get_broadcast_job(job_id)
+        if not current or current['status'] == 'cancelled':
+            print(f"⏹ Рассылка #{job_id} отменена")
+            return
+
+        user_ids = [row[0] for row in batch]
+        stats = await delivery.broadcast(user_ids, job['text'], photo_id=job['photo_id'], reply_markup=markup)
+
+        job['cursor'] = user_ids[-1]
+        job['sent_count'] += stats['success']
+        job['error_count'] += stats['errors']
+        job['blocked_count'] += len(stats['blocked'])
+        await checkpoint_broadcast_job(
+            job_id, job['cursor'], stats['success'], stats['errors'], len(stats['blocked'])
         )
-        return True
-    return False
 
+        if monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+            await _show_progress(bot, job)
+            last_edit = monotonic()
 
-async def send_scheduled_broadcast_with_stats(text: str, photo_id: str = None, admin_id: int = None) -> Tuple[int, int, List[int]]:
-    """Отправить запланированную рассылку с отправкой статистики админу"""
-    from app.bot import bot
+    await update_broadcast_job(job_id, status='done', finished_at=datetime.utcnow())
+    await _show_progress(bot, job, done=True)
+    print(f"✅ Рассылка #{job_id} завершена: {job['sent_count']} успешно, {job['error_count']} ошибок")
 
-    success, errors, blocked_users = await send_broadcast_to_all_users(text, photo_id, admin_id)
 
-    if admin_id:
-        # Отправляем статистику запланированной рассылки
-        scheduled_stats = f"""
-📅 Запланированная рассылка выполнена!
+def start_broadcast_job(job_id: int) -> bool:
+    """Запустить задачу в фоне, если она ещё не выполняется в этом процессе"""
+    if to_main('broadcast', job_id):
+        # Рассылки выполняет главный процесс, иначе он сочтёт задачу прерванной
+        return True
+    task = _running_jobs.get(job_id)
+    if task and not task.done():
+        return False
 
-📊 Результаты:
-✅ Успешно отправлено: {success}
-❌ Ошибок: {errors}
-📈 Процент доставки: {round((success/(success+errors))*100, 1) if (success+errors) > 0 else 0}%
+    async def runner():
+        try:
+            await run_broadcast_job(job_id)
+        except Exception as e:
+            print(f"❌ Ошибка рассылки #{job_id}: {e}")
+        finally:
+            _running_jobs.pop(job_id, None)
 
-📝 Детали:
-• Всего пользователей: {success + errors}
-• Получили сообщение: {success}
-• Не получили: {errors}
+    _running_jobs[job_id] = asyncio.create_task(runner())
+    return True
 
-⏰ Время выполнения: {datetime.now().strftime('%d.%m.%Y %H:%M')}
-"""
 
-        try:
-            await bot.send_message(admin_id, scheduled_stats)
-        except Exception:
-            pass
-
-        # Показываем заблокированных пользователей
-        if blocked_users and len(blocked_users) <= 10:
-            blocked_text = f"🚫 Заблокированные пользователи (первые 10):\n"
-            for user_id in blocked_users[:10]:
-                blocked_text += f"• {user_id}\n"
-            try:
-                await bot.send_message(admin_id, blocked_text)
-            except Exception:
-                pass
-        elif blocked_users:
-            try:
-                await bot.send_message(admin_id, f"🚫 Заблокированных пользователей: {len(blocked_users)} (список скрыт)")
-            except Exception:
-                pass
-
-    return success, errors, blocked_users
-
-
-async def process_scheduled_messages():
-    """Обработать все запланированные сообщения"""
+async def process_broadcast_jobs():
+    """
+    Запустить все рассылки, которые пора выполнять: запланированные
+    с наступившим run_at и прерванные перезапуском (status='running').
+    Вызывается при старте бота и раз в минуту планировщиком.
+    """
     try:
-        messages = await get_pending_scheduled_messages()
-        for message in messages:
-            sent = await send_scheduled_message(message)
-            if sent:
-                await delete_scheduled_message(message['id'])
-            await asyncio.sleep(0.1)  # Небольшая задержка между отправками
+        jobs = await get_runnable_broadcast_jobs(datetime.now())
+        for job in jobs:
+            if start_broadcast_job(job['id']):
+                print(f"▶️ Рассылка #{job['id']} поставлена в работу ({job['status']})")
     except Exception as e:
-        print(f"❌ Ошибка при обработке запланированных сообщений: {e}")
+        print(f"❌ Ошибка при обработке задач рассылки: {e}")
 
 
-async def check_scheduled_messages():
-    """Проверить и обработать запланированные сообщения (для scheduler)"""
-    await process_scheduled_messages()
\ No newline at end of file
+async def enqueue_broadcast(text: str, photo_id: str = None, buttons: list = None,
+                            admin_id: int = None, run_at: datetime = None) -> int:
+    """Создать задачу рассылки; без run_at она стартует сразу"""
+    job_id = await create_broadcast_job(text, photo_id, buttons, admin_id, run_at)
+    if run_at is None:
+        start_broadcast_job(job_id)
+    return job_id
@@ -0,0 +1,107 @@
+"""
+Конвертация валют
+
+Снимок курсов (валюта -> сколько UZS за единицу) и пакетный пересчёт
+списков (сумма, валюта) в одну валюту. Суммы сначала точно складываются
+в Decimal по исходным валютам, затем каждая группа пересчитывается через
+UZS один раз. Итог округляется до копеек по ROUND_HALF_UP.
+
+Используется статистикой, экспортом, веб-админкой и конвертером в боте.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+BASE_CURRENCY = 'UZS'
+# Долги без валюты считаются в сумах
+DEFAULT_CURRENCY = 'UZS'
+# Точность итоговых сумм
+QUANT = Decimal('0.01')
+
+Number = Union[int, float, str, Decimal]
+
+
+def to_decimal(value: Number) -> Decimal:
+    """Число -> Decimal без артефактов float (0.1 -> Decimal('0.1'))"""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    return Decimal(str(value))
+
+
+def quantize(value: Decimal) -> Decimal:
+    """Округление денежной суммы до копеек"""
+    return value.quantize(QUANT, rounding=ROUND_HALF_UP)
+
+
+class RatesSnapshot:
+    """Неизменяемый снимок курсов для пакетной конвертации"""
+
+    def __init__(self, rates: Dict[str, Number]):
+        self.rates: Dict[str, Decimal] = {}
+        for currency, rate in (rates or {}).items():
+            try:
+                value = to_decimal(rate)
+            except (InvalidOperation, ValueError, TypeError):
+                continue
+            if value > 0:
+                self.rates[currency.upper()] = value
+        self.rates.setdefault(BASE_CURRENCY, Decimal(1))
+
+    def __contains__(self, currency: Optional[str]) -> bool:
+        return (currency or DEFAULT_CURRENCY).upper() in self.rates
+
+    def _to_base(self, amount: Decimal, currency: Optional[str]) -> Optional[Decimal]:
+        rate = self.rates.get((currency or DEFAULT_CURRENCY).upper())
+        return None if rate is None else amount * rate
+
+    def convert(self, amount: Number, from_currency: Optional[str], to_currency: str) -> Optional[Decimal]:
+        """Одна сумма (None, если валюты нет в снимке)"""
+        return self.convert_many([(amount, from_currency)], to_currency)[0]
+
+    def convert_many(self, items: Iterable[Tuple[Number, Optional[str]]],
+                     to_currency: str) -> List[Optional[Decimal]]:
+        """Список (сумма, валюта) -> список сумм в to_currency (None для неизвестных валют)"""
+        target = self.rates.get(to_currency.upper())
+        result = []
+        for amount, currency in items:
+            if target is None:
+                result.append(None)
+                continue
+            if (currency or DEFAULT_CURRENCY).upper() == to_currency.upper():
+                result.append(quantize(to_decimal(amount)))
+                continue
+            base = self._to_base(to_decimal(amount), currency)
+            result.append(None if base is None else quantize(base / target))
+        return result
+
+    def total(self, items: Iterable[Tuple[Number, Optional[str]]], to_currency: str,
+              skipped: Optional[List[str]] = None) -> Decimal:
+        """
+        Сумма списка (сумма, валюта) в to_currency.
+
+        Валюты, которых нет в снимке, пропускаются и дописываются в skipped.
+        """
+        by_currency: Dict[str, Decimal] = {}
+        for amount, currency in items:
+            key = (currency or DEFAULT_CURRENCY).upper()
+            by_currency[key] = by_currency.get(key, Decimal(0)) + to_decimal(amount or 0)
+
+        target = self.rates.get(to_currency.upper())
+        if target is None:
+            if skipped is not None:
+                skipped.extend(by_currency)
+            return Decimal(0)
+
+        total = Decimal(0)
+        for currency, amount in by_currency.items():
+            if currency == to_currency.upper():
+                total += amount
+                continue
+            base = self._to_base(amount, currency)
+            if base is None:
+                if skipped is not None:
+                    skipped.append(currency)
+                continue
+            total += base / target
+        return quantize(total)
@@ -3,14 +3,54 @@
 """
 import asyncio
 import aiohttp
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timedelta
 import json
-from app.keyboards import tr
+from app.keyboards import catalog, user_catalog
+from app.utils.conversion import RatesSnapshot
+from app.database.crud import save_exchange_rates, get_exchange_rates_at
 # Кэш для хранения курсов валют
 _currency_cache = {}
 _cache_expires = None
 CACHE_DURATION = 300  # 5 минут
+# Курсы старше этого после истечения кэша всё равно отдаются, но с предупреждением в лог
+STALE_DURATION = 3600
+# Фоновое обновление курсов (снимки пишутся в exchange_rates)
+RATES_JOB_ID = 'exchange_rates'
+RATES_REFRESH_MINUTES = CACHE_DURATION // 60
+# Последний сохранённый в БД снимок — одинаковые курсы повторно не пишем
+_saved_rates: Dict[str, float] = {}
+# Готовый текст валютного уведомления: (язык, минута) -> текст
+_alert_cache: Dict[Tuple[str, str], str] = {}
+# Повторная попытка, если обновление не удалось, а старые курсы есть
+RETRY_AFTER_ERROR = 60
+
+# Общий HTTP-клиент с пулом соединений (создаётся лениво, закрывается при остановке бота)
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = 10
+_http_session: Optional[aiohttp.ClientSession] = None
+
+# Текущий запрос курсов — все ожидающие получают его результат (single-flight)
+_refresh_task: Optional[asyncio.Task] = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия для внешних API"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """Закрыть общую aiohttp-сессию"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 
 class CurrencyService:
@@ -24,58 +64,131 @@ class CurrencyService:
         """
         Получить актуальные курсы валют относительно UZS
         Возвращает словарь вида: {"USD": 12000.0, "EUR": 11000.0, "RUB": 165.0}
+
+        Любые имеющиеся курсы (из API или из БД после рестарта) отдаются сразу,
+        без ожидания сети; устаревшие — с обновлением в фоне. Только если
+        курсов нет совсем, все вызовы ждут один общий запрос к API.
         """
-        global _currency_cache, _cache_expires
+        now = datetime.now()
 
         # Проверяем кэш
-        if _cache_expires and datetime.now() < _cache_expires and _currency_cache:
-            print("✅ Используем кэшированные курсы валют")
+        if _currency_cache:
+            if _cache_expires and now < _cache_expires:
+                return _currency_cache.copy()
+            if _cache_expires and now > _cache_expires + timedelta(seconds=STALE_DURATION):
+                print("⚠️ Курсы валют давно не обновлялись, отдаём последние известные")
+            CurrencyService._start_refresh()
             return _currency_cache.copy()
 
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return (await asyncio.shield(CurrencyService._start_refresh())).copy()
+
+    @staticmethod
+    def _start_refresh() -> asyncio.Task:
+        """Запустить обновление курсов, если оно ещё не идёт"""
+        global _refresh_task
+        if _refresh_task is None or _refresh_task.done():
+            _refresh_task = asyncio.create_task(CurrencyService._refresh_rates())
+        return _refresh_task
+
+    @staticmethod
+    async def _refresh_rates() -> Dict[str, float]:
+        """Запросить курсы и обновить кэш (всегда возвращает курсы)"""
+        global _currency_cache, _cache_expires
+
+        rates = await CurrencyService._fetch_rates()
+        if rates:
+            # Сохраняем в кэш
+            _currency_cache = rates
+            _cache_expires = datetime.now() + timedelta(seconds=CACHE_DURATION)
+            print(f"✅ Курсы обновлены: USD={rates['USD']}, EUR={rates['EUR']}, RUB={rates['RUB']} UZS")
+            await CurrencyService._save_snapshot(rates)
+            return rates
+
+        if _currency_cache:
+            # API недоступен — продолжаем отдавать последние курсы, повторим позже
+            print("⚠️ Не удалось обновить курсы, используем последние полученные")
+            _cache_expires = datetime.now() + timedelta(seconds=RETRY_AFTER_ERROR)
+            return _currency_cache
+
+        return CurrencyService._get_fallback_rates()
+
+    @staticmethod
+    async def _save_snapshot(rates: Dict[str, float]):
+        """Записать снимок в exchange_rates, если курсы изменились"""
+        global _saved_rates
+        if rates == _saved_rates:
+            return
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(10)) as session:
-                print("🌐 Запрашиваем актуальные курсы валют...")
-
-                async with session.get(CurrencyService.BASE_URL) as response:
-                    if response.status == 200:
-                        data = await response.json()
-
-                        # Получаем курсы относительно USD
-                        usd_rates = data.get("rates", {})
-                        uzs_per_usd = usd_rates.get("UZS", 12450.0)
-                        eur_per_usd = usd_rates.get("EUR", 0.85)
-                        rub_per_usd = usd_rates.get("RUB", 90.0)
-
-                        # Конвертируем все в UZS (сколько UZS за 1 единицу валюты)
-                        rates = {
-                            "UZS": 1.0,  # базовая валюта
-                            "USD": round(uzs_per_usd, 2),  # сколько UZS за 1 USD
-                            "EUR": round(uzs_per_usd / eur_per_usd, 2),  # сколько UZS за 1 EUR
-                            "RUB": round(uzs_per_usd / rub_per_usd, 2)  # сколько UZS за 1 RUB
-                        }
-
-                        # Сохраняем в кэш
-                        _currency_cache = rates
-                        _cache_expires = datetime.now() + timedelta(seconds=CACHE_DURATION)
-
-                        print(f"✅ Курсы обновлены: USD={rates['USD']}, EUR={rates['EUR']}, RUB={rates['RUB']} UZS")
-                        return rates
-
-                    else:
-                        print(f"❌ Ошибка API: статус {response.status}")
-                        return CurrencyService._get_fallback_rates()
+            await save_exchange_rates(rates)
+            _saved_rates = dict(rates)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить снимок курсов: {e}")
+
+    @staticmethod
+    async def load_saved_rates() -> bool:
+        """Поднять последний снимок из БД в кэш (вызывается при старте бота)"""
+        global _currency_cache, _cache_expires, _saved_rates
+        try:
+            snapshot = await get_exchange_rates_at()
+        except Exception as e:
+            print(f"⚠️ Не удалось загрузить курсы из БД: {e}")
+            return False
+        if not snapshot:
+            return False
+
+        fetched_at, rates = snapshot
+        age = datetime.utcnow() - fetched_at
+        _currency_cache = dict(rates)
+        _saved_rates = dict(rates)
+        _cache_expires = datetime.now() + timedelta(seconds=CACHE_DURATION) - age
+        print(f"💾 Курсы загружены из БД (снимок от {fetched_at:%Y-%m-%d %H:%M} UTC)")
+        return True
+
+    @staticmethod
+    async def refresh() -> Dict[str, float]:
+        """Обновить курсы (фоновая задача планировщика)"""
+        return await CurrencyService._start_refresh()
+
+    @staticmethod
+    async def _fetch_rates() -> Optional[Dict[str, float]]:
+        """Один запрос к API через общий пул соединений (None при ошибке)"""
+        try:
+            session = await get_http_session()
+            print("🌐 Запрашиваем актуальные курсы валют...")
+
+            async with session.get(CurrencyService.BASE_URL) as response:
+                if response.status != 200:
+                    print(f"❌ Ошибка API: статус {response.status}")
+                    return None
+
+                data = await response.json()
+
+            # Получаем курсы относительно USD
+            usd_rates = data.get("rates", {})
+            uzs_per_usd = usd_rates.get("UZS", 12450.0)
+            eur_per_usd = usd_rates.get("EUR", 0.85)
+            rub_per_usd = usd_rates.get("RUB", 90.0)
+
+            # Конвертируем все в UZS (сколько UZS за 1 единицу валюты)
+            return {
+                "UZS": 1.0,  # базовая валюта
+                "USD": round(uzs_per_usd, 2),  # сколько UZS за 1 USD
+                "EUR": round(uzs_per_usd / eur_per_usd, 2),  # сколько UZS за 1 EUR
+                "RUB": round(uzs_per_usd / rub_per_usd, 2)  # сколько UZS за 1 RUB
+            }
 
         except asyncio.TimeoutError:
             print("⏰ Таймаут при запросе курсов валют")
-            return CurrencyService._get_fallback_rates()
+            return None
 
         except aiohttp.ClientError as e:
             print(f"🌐 Сетевая ошибка при получении курсов: {e}")
-            return CurrencyService._get_fallback_rates()
+            return None
 
         except Exception as e:
             print(f"❌ Неожиданная ошибка при получении курсов: {e}")
-            return CurrencyService._get_fallback_rates()
+            return None
 
     @staticmethod
     def _get_fallback_rates() -> Dict[str, float]:
@@ -96,6 +209,22 @@ class CurrencyService:
 
         return fallback_rates
 
+    @staticmethod
+    def render_currency_message(rates: Dict[str, float], t, updated: str) -> str:
+        """Текст с курсами валют для каталога t (без обращений к БД)"""
+        message_parts = [f"{t.get('currency_rates')}:"]
+
+        if "USD" in rates:
+            message_parts.append(f"🇺🇸 USD: {rates['USD']:.0f} UZS")
+        if "EUR" in rates:
+            message_parts.append(f"🇪🇺 EUR: {rates['EUR']:.0f} UZS")
+        if "RUB" in rates:
+            message_parts.append(f"🇷🇺 RUB: {rates['RUB']:.0f} UZS")
+
+        # Добавляем время обновления
+        message_parts.append(f"\n{t.get('updated')} {updated}")
+        return "\n".join(message_parts)
+
     @staticmethod
     async def format_currency_message(user_id: int, tr_func) -> str:
         """
@@ -107,33 +236,43 @@ class CurrencyService:
             if not rates:
                 return await tr_func(user_id, 'currency_error')
 
-            # Форматируем красивое сообщение
-            message_parts = [f"{await tr(user_id, 'currency_rates')}:"]
+            t = await user_catalog(user_id)
+            return CurrencyService.render_currency_message(rates, t, datetime.now().strftime("%H:%M"))
 
-            # USD к UZS
-            if "USD" in rates:
-                usd_rate = rates["USD"]
-                message_parts.append(f"🇺🇸 USD: {usd_rate:.0f} UZS")
-
-            # EUR к UZS
-            if "EUR" in rates:
-                eur_rate = rates["EUR"]
-                message_parts.append(f"🇪🇺 EUR: {eur_rate:.0f} UZS")
-
-            # RUB к UZS
-            if "RUB" in rates:
-                rub_rate = rates["RUB"]
-                message_parts.append(f"🇷🇺 RUB: {rub_rate:.0f} UZS")
+        except Exception as e:
+            print(f"❌ Ошибка форматирования сообщения о курсах: {e}")
+            return await tr_func(user_id, 'currency_format_error')
 
-            # Добавляем время обновления
-            current_time = datetime.now().strftime("%H:%M")
-            message_parts.append(f"\n{await tr(user_id, 'updated')} {current_time}")
+    @staticmethod
+    async def get_currency_alert(lang: str) -> str:
+        """
+        Текст валютного уведомления для языка.
 
-            return "\n".join(message_parts)
+        Рендерится один раз на (язык, минуту) — весь минутный бакет
+        подписчиков получает одну и ту же строку.
+        """
+        now = datetime.now()
+        key = (lang, now.strftime("%Y-%m-%d %H:%M"))
+        text = _alert_cache.get(key)
+        if text is not None:
+            return text
 
+        t = catalog(lang)
+        try:
+            rates = await CurrencyService.get_exchange_rates()
+            if rates:
+                text = CurrencyService.render_currency_message(rates, t, now.strftime("%H:%M"))
+            else:
+                text = t.get('currency_error')
         except Exception as e:
             print(f"❌ Ошибка форматирования сообщения о курсах: {e}")
-            return await tr_func(user_id, 'currency_format_error')
+            text = t.get('currency_format_error')
+
+        # Тексты прошлых минут больше не понадобятся
+        for old_key in [k for k in _alert_cache if k[1] != key[1]]:
+            del _alert_cache[old_key]
+        _alert_cache[key] = text
+        return text
 
     @staticmethod
     async def convert_currency(amount: float, from_currency: str, to_currency: str) -> Optional[float]:
@@ -142,15 +281,11 @@ class CurrencyService:
         """
         try:
             rates = await CurrencyService.get_exchange_rates()
-
-            if not rates or from_currency not in rates or to_currency not in rates:
+            if not rates:
                 return None
 
-            # Конвертируем через UZS как базовую валюту
-            uzs_amount = amount * rates[from_currency]
-            result = uzs_amount / rates[to_currency]
-
-            return round(result, 2)
+            result = RatesSnapshot(rates).convert(amount, from_currency, to_currency)
+            return None if result is None else float(result)
 
         except Exception as e:
             print(f"❌ Ошибка конвертации валют: {e}")
@@ -162,6 +297,7 @@ class CurrencyService:
         global _currency_cache, _cache_expires
         _currency_cache = {}
         _cache_expires = None
+        _alert_cache.clear()
         print("🗑️ Кэш курсов валют очищен")
 
 
@@ -177,6 +313,11 @@ async def format_currency_notification(user_id: int, tr_func) -> str:
     return await CurrencyService.format_currency_message(user_id, tr_func)
 
 
+async def get_currency_alert(lang: str) -> str:
+    """Текст валютного уведомления для языка (кэш на минуту)"""
+    return await CurrencyService.get_currency_alert(lang)
+
+
 async def convert_amount(amount: float, from_curr: str, to_curr: str) -> Optional[float]:
     """Конвертировать сумму между валютами (короткий алиас)"""
     return await CurrencyService.convert_currency(amount, from_curr, to_curr)
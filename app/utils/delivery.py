@@ -0,0 +1,249 @@
+"""
+Единый канал исходящих сообщений бота
+
+Все рассылки, напоминания и валютные уведомления идут через DeliveryEngine:
+- глобальный token bucket под лимит Telegram (~30 сообщений в секунду);
+- не чаще одного сообщения в секунду в один чат;
+- ограниченный пул воркеров для массовых отправок;
+- TelegramRetryAfter ставит на паузу весь канал на указанное время, затем повтор.
+"""
+import asyncio
+from time import monotonic
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+# Глобальный лимит чуть ниже официальных 30 msg/s, чтобы был запас
+GLOBAL_RATE = 28
+# Минимальный интервал между сообщениями в один чат (сек)
+PER_CHAT_INTERVAL = 1.0
+# Размер пула воркеров для send_many
+DEFAULT_WORKERS = 20
+# Попыток на одно сообщение (RetryAfter и сетевые ошибки)
+MAX_ATTEMPTS = 5
+# Как часто вызывать on_progress в send_many
+PROGRESS_EVERY = 100
+
+# Статусы доставки
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+class DeliveryEngine:
+    """Ограничитель скорости и пул воркеров для исходящих сообщений"""
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 workers: int = DEFAULT_WORKERS):
+        self.bot = None
+        self.rate = rate
+        self.capacity = max(1.0, float(rate))
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._chat_next: Dict[int, float] = {}
+
+    def set_bot(self, bot):
+        """Установить экземпляр бота"""
+        self.bot = bot
+
+    # ==================== ЛИМИТЫ ====================
+
+    async def _acquire(self):
+        """Дождаться токена глобального bucket'а"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _wait_chat(self, chat_id: int):
+        """Соблюсти интервал между сообщениями в один чат"""
+        now = monotonic()
+        next_at = self._chat_next.get(chat_id, 0.0)
+        # Резервируем слот до await, чтобы параллельные отправки в чат шли по очереди
+        self._chat_next[chat_id] = max(now, next_at) + self.per_chat_interval
+
+        if len(self._chat_next) > 50000:
+            self._chat_next = {cid: t for cid, t in self._chat_next.items() if t > now}
+
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+    def pause(self, seconds: float):
+        """Приостановить весь канал (используется при RetryAfter)"""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    # ==================== ОТПРАВКА ====================
+
+    async def deliver(self, chat_id: int, text: str = None, photo_id: str = None,
+                      reply_markup=None, **kwargs) -> str:
+        """
+        Отправить одно сообщение с учётом лимитов.
+
+        Returns:
+            SENT, BLOCKED (бот заблокирован / чат не найден) или FAILED
+        """
+        if not self.bot:
+            print("❌ Bot не установлен в delivery")
+            return FAILED
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._wait_chat(chat_id)
+            await self._acquire()
+
+            try:
+                if photo_id:
+                    await self.bot.send_photo(chat_id, photo_id, caption=text,
+                                              reply_markup=reply_markup, **kwargs)
+                else:
+                    await self.bot.send_message(chat_id, text, reply_markup=reply_markup, **kwargs)
+                return SENT
+
+            except TelegramRetryAfter as e:
+                print(f"⏳ Flood control: пауза {e.retry_after} сек (chat={chat_id}, попытка {attempt})")
+                self.pause(e.retry_after)
+
+            except TelegramForbiddenError:
+                print(f"🚫 Пользователь {chat_id} заблокировал бота")
+                return BLOCKED
+
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    print(f"❌ Чат {chat_id} не найден")
+                    return BLOCKED
+                print(f"❌ BadRequest для {chat_id}: {e}")
+                return FAILED
+
+            except (TelegramNetworkError, TelegramServerError) as e:
+                print(f"⚠️ Сетевая ошибка для {chat_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+            except Exception as e:
+                print(f"❌ Неизвестная ошибка отправки {chat_id}: {e}")
+                return FAILED
+
+        return FAILED
+
+    async def send(self, chat_id: int, text: str = None, photo_id: str = None,
+                   reply_markup=None, **kwargs) -> bool:
+        """Отправить одно сообщение, True если доставлено"""
+        return await self.deliver(chat_id, text, photo_id, reply_markup, **kwargs) == SENT
+
+    async def send_many(
+            self,
+            messages: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+            on_progress: Callable[[Dict[str, Any]], Awaitable[None]] = None,
+            progress_every: int = PROGRESS_EVERY,
+            workers: int = None,
+            on_result: Callable[[Dict[str, Any], str], Awaitable[None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Отправить поток сообщений пулом воркеров.
+
+        Args:
+            messages: (async) итератор словарей с ключами chat_id, text, photo_id, reply_markup, ...
+            on_progress: корутина, вызывается каждые progress_every сообщений со статистикой
+            on_result: корутина, вызывается после каждого сообщения с (словарь сообщения, статус)
+
+        Returns:
+            {'success': N, 'errors': N, 'blocked': [user_id, ...]}
+        """
+        stats = {'success': 0, 'errors': 0, 'blocked': []}
+        reported = {'done': -1}
+        workers = workers or self.workers
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+
+        async def report():
+            done = stats['success'] + stats['errors']
+            if on_progress is None or done == reported['done']:
+                return
+            reported['done'] = done
+            try:
+                await on_progress(stats)
+            except Exception as e:
+                print(f"⚠️ Ошибка обновления прогресса: {e}")
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+
+                try:
+                    status = await self.deliver(**item)
+                except Exception as e:
+                    # Воркер не должен умирать: иначе queue.put() повиснет навсегда
+                    print(f"❌ Ошибка отправки сообщения {item!r:.100}: {e}")
+                    status = FAILED
+                if status == SENT:
+                    stats['success'] += 1
+                else:
+                    stats['errors'] += 1
+                    if status == BLOCKED:
+                        stats['blocked'].append(item['chat_id'])
+
+                if on_result is not None:
+                    try:
+                        await on_result(item, status)
+                    except Exception as e:
+                        print(f"⚠️ Ошибка обработки результата отправки: {e}")
+
+                if (stats['success'] + stats['errors']) % progress_every == 0:
+                    await report()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            if hasattr(messages, '__aiter__'):
+                async for item in messages:
+                    await queue.put(item)
+            else:
+                for item in messages:
+                    await queue.put(item)
+        finally:
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        await report()
+        return stats
+
+    async def broadcast(self, chat_ids: Union[Iterable[int], AsyncIterable[int]], text: str,
+                        photo_id: str = None, reply_markup=None, **kwargs) -> Dict[str, Any]:
+        """Отправить одно и то же сообщение списку чатов"""
+
+        async def messages():
+            if hasattr(chat_ids, '__aiter__'):
+                async for chat_id in chat_ids:
+                    yield {'chat_id': chat_id, 'text': text, 'photo_id': photo_id, 'reply_markup': reply_markup}
+            else:
+                for chat_id in chat_ids:
+                    yield {'chat_id': chat_id, 'text': text, 'photo_id': photo_id, 'reply_markup': reply_markup}
+
+        return await self.send_many(messages(), **kwargs)
+
+
+# Глобальный экземпляр, как и scheduler
+delivery = DeliveryEngine()
@@ -0,0 +1,201 @@
+"""
+Очередь событий по сроку
+
+Вместо ежеминутного опроса таблиц reminders и scheduled_messages в памяти
+держится min-heap ближайших сроков. Один фоновый таск спит ровно до
+ближайшего срока (или до изменения очереди) и передаёт наступившие id
+обработчику своего вида одной пачкой. Пока ничего не наступило, к БД никто
+не обращается.
+
+Очередь заполняется при старте (load) и поддерживается хендлерами при
+добавлении / изменении / удалении. Обработчики перечитывают строки из БД,
+поэтому устаревшая запись в куче безопасна — она просто будет пропущена.
+Веб-админка работает в другом потоке и использует *_threadsafe, а
+хендлеры в процессах-воркерах (BOT_WORKERS > 0) передают push / remove
+главному процессу, где и работает очередь.
+"""
+import asyncio
+import heapq
+import itertools
+import traceback
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .sharding import to_main
+
+# Виды событий
+REMINDER = 'reminder'
+MESSAGE = 'message'
+
+# Дольше не спим — страховка от перевода системных часов
+MAX_SLEEP = 3600
+
+Loader = Callable[[], Awaitable[Iterable[Tuple[int, datetime]]]]
+Handler = Callable[[List[int]], Awaitable[None]]
+
+
+class DueQueue:
+    """Min-heap (срок, вид, id) и таск, который спит до ближайшего срока"""
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, str, int]] = []
+        # Актуальный срок по ключу; записи кучи с другим сроком считаются удалёнными
+        self._due: Dict[Tuple[str, int], datetime] = {}
+        self._seq = itertools.count()
+        self._loaders: Dict[str, Loader] = {}
+        self._handlers: Dict[str, Handler] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def register(self, kind: str, loader: Loader, handler: Handler):
+        """Зарегистрировать вид событий: loader() -> [(id, срок)], handler([id, ...])"""
+        self._loaders[kind] = loader
+        self._handlers[kind] = handler
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ==================== КУЧА ====================
+
+    def push(self, kind: str, item_id: int, due: Optional[datetime]):
+        """Добавить событие или перенести его на новый срок (None — удалить)"""
+        if to_main('due_push', kind, item_id, due):
+            return
+        if due is None:
+            self.remove(kind, item_id)
+            return
+
+        key = (kind, item_id)
+        if self._due.get(key) == due:
+            return
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, item_id))
+        self._wake()
+
+    def remove(self, kind: str, item_id: int):
+        """Убрать событие (запись в куче отбросится при извлечении)"""
+        if to_main('due_remove', kind, item_id):
+            return
+        self._due.pop((kind, item_id), None)
+
+    def push_threadsafe(self, kind: str, item_id: int, due: Optional[datetime]):
+        """push из другого потока (веб-админка)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.push, kind, item_id, due)
+
+    def remove_threadsafe(self, kind: str, item_id: int):
+        """remove из другого потока (веб-админка)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.remove, kind, item_id)
+
+    def next_due(self) -> Optional[datetime]:
+        """Ближайший срок в очереди"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap:
+            due, _, kind, item_id = self._heap[0]
+            if self._due.get((kind, item_id)) == due:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[int]]:
+        """Извлечь все наступившие события, сгруппировав по виду"""
+        batch: Dict[str, List[int]] = {}
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return batch
+            _, _, kind, item_id = heapq.heappop(self._heap)
+            del self._due[(kind, item_id)]
+            batch.setdefault(kind, []).append(item_id)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ==================== ЖИЗНЕННЫЙ ЦИКЛ ====================
+
+    async def load(self):
+        """Заполнить очередь из БД (вызывается при старте)"""
+        for kind, loader in self._loaders.items():
+            items = await loader()
+            count = 0
+            for item_id, due in items:
+                self.push(kind, item_id, due)
+                count += 1
+            print(f"⏳ Очередь сроков: {kind} — загружено {count}")
+
+    async def start(self):
+        """Загрузить сроки и запустить таск"""
+        if self.running:
+            print("⚠️ Очередь сроков уже запущена")
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await self.load()
+        self._task = asyncio.create_task(self._run())
+        next_due = self.next_due()
+        print(f"✅ Очередь сроков запущена: событий={len(self)}, ближайшее={next_due}")
+
+    async def stop(self):
+        """Остановить таск (запущенные обработчики дорабатывают)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        print("🔴 Очередь сроков остановлена")
+
+    async def _dispatch(self, kind: str, item_ids: List[int]):
+        try:
+            await self._handlers[kind](item_ids)
+        except Exception as e:
+            print(f"❌ Ошибка обработки очереди сроков ({kind}, {len(item_ids)} шт.): {e}")
+            traceback.print_exc()
+
+    async def _run(self):
+        while True:
+            try:
+                batch = self._pop_due(datetime.now())
+                for kind, item_ids in batch.items():
+                    # Обработчик в отдельном таске — долгая рассылка не задерживает другие сроки
+                    task = asyncio.create_task(self._dispatch(kind, item_ids))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                if batch:
+                    continue
+
+                self._wakeup.clear()
+                next_due = self.next_due()
+                timeout = MAX_SLEEP
+                if next_due is not None:
+                    timeout = min(max((next_due - datetime.now()).total_seconds(), 0), MAX_SLEEP)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка очереди сроков: {e}")
+                traceback.print_exc()
+                await asyncio.sleep(1)
+
+
+# Глобальный экземпляр, как и scheduler / delivery
+due_queue = DueQueue()
@@ -1,12 +1,145 @@
-import pandas as pd
+import asyncio
+import csv
+import json
+import multiprocessing
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from io import BytesIO
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Sequence
+from aiogram.types import InputFile
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.database.models import Debt, User
+from sqlalchemy import func, select
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from app.database.connection import get_db
+from app.database.models import Debt, User, UserBalance
 from datetime import datetime
 from app.keyboards.texts import tr
+from app.utils.conversion import RatesSnapshot
+from app.utils.currency_api import get_currency_rates
+from app.utils.sharding import in_worker
+from app.config import EXPORT_EXECUTOR, EXPORT_MAX_CONCURRENCY, EXPORT_PER_USER
+
+# Ширина колонки: самое длинное значение + 2, но не больше
+MAX_COLUMN_WIDTH = 50
+# Сколько строк за раз читается курсором при потоковой выгрузке
+STREAM_BATCH_ROWS = 500
+# С какого числа долгов CSV / JSONL сжимается gzip
+STREAM_GZIP_ROWS = 5000
+
+_pool: Optional[Executor] = None
+# Сколько файлов собирается одновременно (на процесс)
+_export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENCY)
+# Выгрузки, которые сейчас идут: user_id -> количество
+_user_exports: Dict[int, int] = {}
+
+
+class ExportBusy(Exception):
+    """У пользователя уже идёт EXPORT_PER_USER выгрузок"""
+
+
+# ==================== ЗАПИСЬ XLSX ====================
+
+class SheetData:
+    """Лист: заголовки и строки; ширины колонок считаются по мере добавления строк"""
+
+    def __init__(self, title: str, headers: Sequence[str]):
+        self.title = title
+        self.headers = list(headers)
+        self.rows: List[tuple] = []
+        self.widths = [len(str(header)) for header in self.headers]
+
+    def append(self, row: Sequence) -> None:
+        for i, value in enumerate(row):
+            if value is not None:
+                length = len(str(value))
+                if length > self.widths[i]:
+                    self.widths[i] = length
+        self.rows.append(tuple(row))
+
+
+def write_workbook(sheets: Iterable[SheetData]) -> bytes:
+    """
+    Собрать xlsx в write-only режиме openpyxl: строки пишутся потоком,
+    без модели ячеек в памяти. Выполняется в пуле, а не в event loop.
+    """
+    workbook = Workbook(write_only=True)
+    bold = Font(bold=True)
+    for sheet in sheets:
+        worksheet = workbook.create_sheet(sheet.title)
+        # В write-only режиме ширины задаются до первой строки
+        for i, width in enumerate(sheet.widths, 1):
+            worksheet.column_dimensions[get_column_letter(i)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+        header = []
+        for title in sheet.headers:
+            cell = WriteOnlyCell(worksheet, value=title)
+            cell.font = bold
+            header.append(cell)
+        worksheet.append(header)
+        for row in sheet.rows:
+            worksheet.append(row)
+
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        # Воркер шардирования — daemon-процесс, дочерние процессы ему запрещены;
+        # он и так отдельный процесс, поэтому там хватает потоков
+        if EXPORT_EXECUTOR == 'thread' or in_worker():
+            _pool = ThreadPoolExecutor(max_workers=EXPORT_MAX_CONCURRENCY, thread_name_prefix='export')
+        else:
+            # spawn: не копируем в дочерний процесс потоки и event loop бота
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_MAX_CONCURRENCY,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def shutdown_export_pool() -> None:
+    """Остановить пул (при остановке бота)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def render_workbook(sheets: List[SheetData]) -> BytesIO:
+    """Собрать файл в пуле; одновременно не больше EXPORT_MAX_CONCURRENCY"""
+    async with _export_slots:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(_get_pool(), write_workbook, sheets)
+    return BytesIO(data)
+
+
+@asynccontextmanager
+async def user_export_slot(user_id: int):
+    """Не больше EXPORT_PER_USER выгрузок одного пользователя одновременно"""
+    if _user_exports.get(user_id, 0) >= EXPORT_PER_USER:
+        raise ExportBusy(user_id)
+    _user_exports[user_id] = _user_exports.get(user_id, 0) + 1
+    try:
+        yield
+    finally:
+        _user_exports[user_id] -= 1
+        if not _user_exports[user_id]:
+            del _user_exports[user_id]
+
+
+# ==================== ВЫГРУЗКИ ====================
 
 async def export_user_debts_to_excel(session, user_id: int) -> BytesIO:
+    async with user_export_slot(user_id):
+        return await _export_user_debts(session, user_id)
+
+
+async def _export_user_debts(session, user_id: int) -> BytesIO:
     # Получаем все активные долги
     stmt = select(Debt).where(
         Debt.user_id == user_id,
@@ -35,47 +168,30 @@ async def export_user_debts_to_excel(session, user_id: int) -> BytesIO:
 
     sheet_name   = await tr(user_id, 'export_sheet_name')
 
-    # Формируем данные
-    data = []
+    # Формируем данные; ширины колонок считаются здесь же
+    sheet = SheetData(sheet_name, [
+        col_id, col_person, col_amount, col_currency, col_type,
+        col_date, col_due, col_comment, col_status, col_created
+    ])
     for debt in debts:
         debt_type = type_owe if debt.direction == "owe" else type_owed
         status    = status_closed if debt.closed else status_active
 
-        data.append({
-            col_id: debt.id,
-            col_person: debt.person,
-            col_amount: debt.amount,
-            col_currency: debt.currency,
-            col_type: debt_type,
-            col_date: debt.date,
-            col_due: debt.due,
-            col_comment: debt.comment or '',
-            col_status: status,
-            col_created: debt.created_at.strftime('%d.%m.%Y %H:%M') if debt.created_at else ''
-        })
-
-    # Создаём DataFrame
-    df = pd.DataFrame(data)
-
-    # Пишем в Excel
-    excel_buffer = BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        worksheet = writer.sheets[sheet_name]
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            worksheet.column_dimensions[column_letter].width = min(max_length + 2, 50)
-
-    excel_buffer.seek(0)
-    return excel_buffer
+        sheet.append((
+            debt.id,
+            debt.person,
+            debt.amount,
+            debt.currency,
+            debt_type,
+            debt.date.isoformat() if debt.date else '',
+            debt.due.isoformat() if debt.due else '',
+            debt.comment or '',
+            status,
+            debt.created_at.strftime('%d.%m.%Y %H:%M') if debt.created_at else ''
+        ))
+
+    # Пишем в Excel вне event loop
+    return await render_workbook([sheet])
 
 
 def get_export_filename(user_id: int) -> str:
@@ -97,6 +213,11 @@ async def export_user_debts_with_stats_to_excel(session: AsyncSession, user_id:
     """
     Экспортирует долги с дополнительной статистикой (ASYNC версия)
     """
+    async with user_export_slot(user_id):
+        return await _export_user_debts_with_stats(session, user_id)
+
+
+async def _export_user_debts_with_stats(session: AsyncSession, user_id: int) -> BytesIO:
 
     # Получаем долги
     stmt = select(Debt).where(
@@ -107,75 +228,190 @@ async def export_user_debts_with_stats_to_excel(session: AsyncSession, user_id:
     result = await session.execute(stmt)
     debts = result.scalars().all()
 
+    # Итоги открытых долгов — из user_balances, по каждой валюте отдельно
+    balances_result = await session.execute(
+        select(UserBalance).where(
+            UserBalance.user_id == user_id,
+            UserBalance.debts_count > 0
+        ).order_by(UserBalance.currency)
+    )
+    totals = {}
+    for balance in balances_result.scalars().all():
+        amounts = totals.setdefault(balance.currency, {'owe': 0, 'owed': 0})
+        amounts['owed' if balance.direction == 'owed' else 'owe'] += balance.total or 0
+
     # Создаем основные данные
-    debt_data = []
-    total_owed_to_me = 0  # Сколько мне должны
-    total_i_owe = 0  # Сколько я должен
+    debts_sheet = SheetData('Долги', [
+        'ID', 'Человек', 'Сумма', 'Валюта', 'Тип долга', 'Дата создания',
+        'Срок погашения', 'Комментарий', 'Статус', 'Создан'
+    ])
 
     for debt in debts:
         debt_type = "Я должен" if debt.direction == "owe" else "Мне должны"
         status = "Закрыт" if debt.closed else "Активен"
 
-        # Считаем статистику только для активных долгов
-        if not debt.closed:
-            if debt.direction == "owed":
-                total_owed_to_me += debt.amount
-            else:
-                total_i_owe += debt.amount
-
-        debt_data.append({
-            'ID': debt.id,
-            'Человек': debt.person,
-            'Сумма': debt.amount,
-            'Валюта': debt.currency,
-            'Тип долга': debt_type,
-            'Дата создания': debt.date,
-            'Срок погашения': debt.due,
-            'Комментарий': debt.comment or '',
-            'Статус': status,
-            'Создан': debt.created_at.strftime('%d.%m.%Y %H:%M') if debt.created_at else ''
-        })
+        debts_sheet.append((
+            debt.id,
+            debt.person,
+            debt.amount,
+            debt.currency,
+            debt_type,
+            debt.date.isoformat() if debt.date else '',
+            debt.due.isoformat() if debt.due else '',
+            debt.comment or '',
+            status,
+            debt.created_at.strftime('%d.%m.%Y %H:%M') if debt.created_at else ''
+        ))
 
     # Создаем статистику
-    stats_data = [
-        {'Показатель': 'Общая сумма долгов мне', 'Значение': total_owed_to_me, 'Валюта': 'UZS'},
-        {'Показатель': 'Общая сумма моих долгов', 'Значение': total_i_owe, 'Валюта': 'UZS'},
-        {'Показатель': 'Баланс (+ в мою пользу)', 'Значение': total_owed_to_me - total_i_owe, 'Валюта': 'UZS'},
-        {'Показатель': 'Всего записей о долгах', 'Значение': len(debt_data), 'Валюта': ''},
-        {'Показатель': 'Дата экспорта', 'Значение': datetime.now().strftime('%d.%m.%Y %H:%M'), 'Валюта': ''}
-    ]
-
-    # Создаем DataFrames
-    df_debts = pd.DataFrame(debt_data)
-    df_stats = pd.DataFrame(stats_data)
-
-    # Создаем Excel с несколькими листами
-    excel_buffer = BytesIO()
-
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        # Лист с долгами
-        df_debts.to_excel(writer, sheet_name='Долги', index=False)
-
-        # Лист со статистикой
-        df_stats.to_excel(writer, sheet_name='Статистика', index=False)
-
-        # Форматируем листы
-        for sheet_name in ['Долги', 'Статистика']:
-            worksheet = writer.sheets[sheet_name]
-
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-
-    excel_buffer.seek(0)
-    return excel_buffer
\ No newline at end of file
+    stats_sheet = SheetData('Статистика', ['Показатель', 'Значение', 'Валюта'])
+    for currency, amounts in totals.items():
+        stats_sheet.append(('Общая сумма долгов мне', amounts['owed'], currency))
+        stats_sheet.append(('Общая сумма моих долгов', amounts['owe'], currency))
+        stats_sheet.append(('Баланс (+ в мою пользу)', amounts['owed'] - amounts['owe'], currency))
+    if totals:
+        # Общий баланс в сумах по текущему курсу
+        rates = await get_currency_rates()
+        if rates:
+            balance_uzs = RatesSnapshot(rates).total(
+                ((amounts['owed'] - amounts['owe'], currency) for currency, amounts in totals.items()), 'UZS'
+            )
+            stats_sheet.append(('Баланс в UZS по текущему курсу', float(balance_uzs), 'UZS'))
+    stats_sheet.append(('Всего записей о долгах', len(debts_sheet.rows), ''))
+    stats_sheet.append(('Дата экспорта', datetime.now().strftime('%d.%m.%Y %H:%M'), ''))
+
+    # Excel с двумя листами собирается вне event loop
+    return await render_workbook([debts_sheet, stats_sheet])
+
+
+# ==================== ПОТОКОВЫЕ ФОРМАТЫ (CSV / JSONL) ====================
+# Файл не собирается в памяти: строки читаются курсором пачками по
+# STREAM_BATCH_ROWS и сразу уходят в тело запроса к Telegram.
+
+STREAM_FORMATS = ('csv', 'jsonl')
+
+_STREAM_COLUMNS = (
+    Debt.id, Debt.person, Debt.amount, Debt.currency, Debt.direction,
+    Debt.date, Debt.due, Debt.comment, Debt.closed, Debt.created_at
+)
+
+
+class _Chunk:
+    """Приёмник для csv.writer: копит текст пачки"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    def pop(self) -> str:
+        text, self.parts = ''.join(self.parts), []
+        return text
+
+
+class DebtsStreamFile(InputFile):
+    """Выгрузка долгов в CSV / JSONL, которая генерируется во время загрузки"""
+
+    def __init__(self, user_id: int, fmt: str, labels: Dict[str, str], compress: bool, filename: str):
+        super().__init__(filename=filename)
+        self.user_id = user_id
+        self.fmt = fmt
+        self.labels = labels
+        self.compress = compress
+        self._sink = _Chunk()
+        self._writer = csv.writer(self._sink)
+
+    def _csv_rows(self, rows) -> str:
+        labels = self.labels
+        for row in rows:
+            self._writer.writerow((
+                row.id,
+                row.person,
+                row.amount,
+                row.currency,
+                labels['type_owe'] if row.direction == 'owe' else labels['type_owed'],
+                row.date.isoformat() if row.date else '',
+                row.due.isoformat() if row.due else '',
+                row.comment or '',
+                labels['status_closed'] if row.closed else labels['status_active'],
+                row.created_at.strftime('%d.%m.%Y %H:%M') if row.created_at else ''
+            ))
+        return self._sink.pop()
+
+    @staticmethod
+    def _jsonl_rows(rows) -> str:
+        return ''.join(
+            json.dumps({
+                'id': row.id,
+                'person': row.person,
+                'amount': row.amount,
+                'currency': row.currency,
+                'direction': row.direction,
+                'date': row.date.isoformat() if row.date else None,
+                'due': row.due.isoformat() if row.due else None,
+                'comment': row.comment,
+                'closed': bool(row.closed),
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+            }, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    async def _text_chunks(self) -> AsyncGenerator[str, None]:
+        if self.fmt == 'csv':
+            # BOM — чтобы Excel открыл кириллицу в UTF-8
+            self._writer.writerow(self.labels['headers'])
+            yield '\ufeff' + self._sink.pop()
+
+        stmt = (
+            select(*_STREAM_COLUMNS)
+            .where(Debt.user_id == self.user_id, Debt.is_active == True)
+            .order_by(Debt.created_at.desc())
+            .execution_options(yield_per=STREAM_BATCH_ROWS)
+        )
+        async with get_db() as session:
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                yield self._csv_rows(rows) if self.fmt == 'csv' else self._jsonl_rows(rows)
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        compressor = zlib.compressobj(wbits=31) if self.compress else None  # 31 — формат gzip
+        async for text in self._text_chunks():
+            data = text.encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+
+
+async def export_user_debts_stream(session: AsyncSession, user_id: int, fmt: str) -> DebtsStreamFile:
+    """
+    Подготовить потоковую выгрузку в fmt ('csv' / 'jsonl').
+
+    Здесь только COUNT и переводы; сами строки читаются, когда Telegram
+    забирает файл. Больше STREAM_GZIP_ROWS долгов — файл сжимается gzip.
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    count = (await session.execute(
+        select(func.count(Debt.id)).where(Debt.user_id == user_id, Debt.is_active == True)
+    )).scalar() or 0
+
+    labels = {}
+    if fmt == 'csv':
+        labels['headers'] = [
+            await tr(user_id, key) for key in (
+                'export_col_id', 'export_col_person', 'export_col_amount', 'export_col_currency',
+                'export_col_type', 'export_col_date', 'export_col_due', 'export_col_comment',
+                'export_col_status', 'export_col_created'
+            )
+        ]
+        for key in ('type_owe', 'type_owed', 'status_closed', 'status_active'):
+            labels[key] = await tr(user_id, f'export_{key}')
+
+    compress = count > STREAM_GZIP_ROWS
+    filename = get_export_filename(user_id).rsplit('.', 1)[0] + f'.{fmt}' + ('.gz' if compress else '')
+    return DebtsStreamFile(user_id, fmt, labels, compress, filename)
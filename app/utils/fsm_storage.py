@@ -0,0 +1,223 @@
+"""
+Хранилище состояний FSM в БД
+
+Сценарии (AddDebt, EditDebt, AddReminder, AdminBroadcast, ...) переживают
+перезапуск бота: состояние и данные лежат в таблице fsm_state.
+
+Чтение идёт из памяти процесса: строка поднимается из БД один раз при
+первом обращении к ключу. Запись — write-behind: изменения копятся и раз
+в FSM_FLUSH_INTERVAL секунд уходят в БД одной транзакцией. Давно не
+используемые ключи выгружаются из памяти, а брошенные сценарии (старше
+FSM_STATE_TTL) удаляются из таблицы.
+
+Кэш процесса согласован, пока апдейты одного пользователя обрабатывает
+один процесс (шардирование по user_id). Иначе нужен flush_interval=0 и
+cache_idle=0 — запись сразу и чтение всегда из БД.
+"""
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from time import monotonic
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from app.database.crud import get_fsm_state, purge_fsm_states, save_fsm_states
+
+# Как часто сбрасывать изменения в БД (сек)
+FSM_FLUSH_INTERVAL = 1.0
+# Через сколько секунд без обращений ключ выгружается из памяти
+FSM_CACHE_IDLE = 600
+# Брошенный сценарий старше этого считается истёкшим
+FSM_STATE_TTL = timedelta(days=1)
+# Как часто чистить истёкшие строки в БД (сек)
+FSM_PURGE_INTERVAL = 3600
+
+
+# ==================== JSON ====================
+# В данных сценариев бывают datetime/date (например, срок напоминания)
+
+def _default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в FSM")
+
+
+def _object_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def dump_data(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, default=_default)
+
+
+def load_data(text: Optional[str]) -> Dict[str, Any]:
+    if not text:
+        return {}
+    try:
+        return json.loads(text, object_hook=_object_hook)
+    except ValueError:
+        return {}
+
+
+# ==================== ХРАНИЛИЩЕ ====================
+
+class _Entry:
+    __slots__ = ('state', 'data', 'touched')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.touched = monotonic()
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх общего движка SQLAlchemy"""
+
+    def __init__(self, key_builder: Optional[KeyBuilder] = None,
+                 flush_interval: float = FSM_FLUSH_INTERVAL,
+                 cache_idle: float = FSM_CACHE_IDLE,
+                 ttl: timedelta = FSM_STATE_TTL):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.flush_interval = flush_interval
+        self.cache_idle = cache_idle
+        self.ttl = ttl
+
+        self._cache: Dict[str, _Entry] = {}
+        self._dirty: Set[str] = set()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+
+    # ==================== КЭШ ====================
+
+    async def _entry(self, key: StorageKey) -> Tuple[str, _Entry]:
+        self._ensure_task()
+        skey = self.key_builder.build(key)
+        entry = self._cache.get(skey)
+        if entry is not None and self.cache_idle <= 0 and skey not in self._dirty:
+            # Без кэша: другой процесс мог изменить состояние
+            del self._cache[skey]
+            entry = None
+        if entry is None:
+            row = await get_fsm_state(skey)
+            # Пока ждали БД, ключ мог загрузить параллельный апдейт
+            entry = self._cache.get(skey)
+            if entry is None:
+                if row is not None and row.updated_at >= datetime.utcnow() - self.ttl:
+                    entry = _Entry(row.state, load_data(row.data))
+                else:
+                    entry = _Entry(None, {})
+                self._cache[skey] = entry
+        entry.touched = monotonic()
+        return skey, entry
+
+    async def _changed(self, skey: str):
+        self._dirty.add(skey)
+        if self.flush_interval <= 0:
+            await self.flush()
+
+    # ==================== BaseStorage ====================
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey, entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._changed(skey)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        skey, entry = await self._entry(key)
+        entry.data = data.copy()
+        await self._changed(skey)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry = await self._entry(key)
+        return entry.data.copy()
+
+    async def close(self) -> None:
+        """Остановить фоновую задачу и сбросить несохранённое"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # ==================== ЗАПИСЬ ====================
+
+    async def flush(self) -> int:
+        """Сбросить изменённые ключи в БД одной транзакцией"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            keys, self._dirty = self._dirty, set()
+            try:
+                rows, deleted = [], []
+                for skey in keys:
+                    entry = self._cache.get(skey)
+                    if entry is None:
+                        continue
+                    if entry.state is None and not entry.data:
+                        deleted.append(skey)
+                        continue
+                    try:
+                        data = dump_data(entry.data)
+                    except (TypeError, ValueError) as e:
+                        # Один несериализуемый ключ не должен ронять сохранение остальных
+                        print(f"❌ FSM: состояние {skey} не сохранено: {e}")
+                        continue
+                    rows.append({'key': skey, 'state': entry.state, 'data': data})
+
+                await save_fsm_states(rows, deleted)
+            except Exception as e:
+                # Не потеряли — попробуем на следующем цикле
+                print(f"⚠️ FSM: не удалось сохранить {len(keys)} состояний: {e}")
+                self._dirty |= keys
+                return 0
+            return len(rows) + len(deleted)
+
+    def _evict_idle(self):
+        """Выгрузить из памяти сохранённые ключи, к которым давно не обращались"""
+        border = monotonic() - self.cache_idle
+        for skey in [k for k, e in self._cache.items() if e.touched < border and k not in self._dirty]:
+            del self._cache[skey]
+
+    def _ensure_task(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval if self.flush_interval > 0 else 1.0)
+            try:
+                await self.flush()
+                self._evict_idle()
+
+                if monotonic() - self._purged_at >= FSM_PURGE_INTERVAL:
+                    self._purged_at = monotonic()
+                    removed = await purge_fsm_states(datetime.utcnow() - self.ttl)
+                    if removed:
+                        print(f"🧹 FSM: удалено брошенных состояний: {removed}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка фоновой задачи FSM: {e}")
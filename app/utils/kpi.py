@@ -0,0 +1,227 @@
+"""
+Снимок KPI для админки
+
+Счётчики (пользователи, регистрации и долги за сегодня, очередь сообщений,
+рефералки) считает фоновая задача раз в KPI_REFRESH_MINUTES. Снимок хранится
+в памяти и в таблице kpi_snapshots, поэтому бот и веб-админка не выполняют
+COUNT(*) на каждое открытие. Принудительное обновление — force=True.
+
+Запросы описаны один раз (_count_queries / _referral_query) и выполняются
+как асинхронной сессией бота, так и синхронной сессией Flask.
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import pytz
+from sqlalchemy import and_, case, delete, func, select
+
+from app.database.connection import get_db
+from app.database.models import Debt, KpiSnapshot, Referral, Reminder, ScheduledMessage, User
+from app.utils.scheduler import TIMEZONE
+
+KPI_JOB_ID = 'kpi_snapshot'
+KPI_REFRESH_MINUTES = 5
+# Сколько дней хранить историю снимков в БД
+KPI_HISTORY_DAYS = 30
+# Снимок старше этого считается устаревшим (фоновая задача не работает)
+KPI_MAX_AGE = timedelta(minutes=KPI_REFRESH_MINUTES * 2)
+
+_snapshot: Optional[Dict[str, Any]] = None
+_refresh_lock: Optional[asyncio.Lock] = None
+
+
+# ==================== ЗАПРОСЫ ====================
+
+def _today_start_utc(now: datetime) -> datetime:
+    """Начало сегодняшнего дня по Ташкенту в UTC (created_at хранится в UTC)"""
+    tz = pytz.timezone(TIMEZONE)
+    local_midnight = pytz.utc.localize(now).astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    return local_midnight.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _count_queries(today_start: datetime) -> Dict[str, Any]:
+    """Счётчики снимка: имя -> SELECT COUNT(...)"""
+    return {
+        'total_users': select(func.count(User.user_id)),
+        'active_users': select(func.count(User.user_id)).where(User.is_active == True),
+        'new_users_today': select(func.count(User.user_id)).where(User.created_at >= today_start),
+        'open_debts': select(func.count(Debt.id)).where(and_(Debt.is_active == True, Debt.closed == False)),
+        'debts_today': select(func.count(Debt.id)).where(and_(
+            Debt.is_active == True, Debt.created_at >= today_start
+        )),
+        'pending_messages': select(func.count(ScheduledMessage.id)).where(and_(
+            ScheduledMessage.is_active == True, ScheduledMessage.sent == False
+        )),
+        'active_reminders': select(func.count(Reminder.id)).where(Reminder.is_active == True),
+    }
+
+
+def _referral_query():
+    """Пользователи по рефералкам (всего / ru / uz)"""
+    return (
+        select(
+            Referral.id,
+            Referral.code,
+            Referral.description,
+            Referral.is_active,
+            func.count(User.user_id).label('total'),
+            func.sum(case((User.lang == 'ru', 1), else_=0)).label('ru'),
+            func.sum(case((User.lang == 'uz', 1), else_=0)).label('uz'),
+        )
+        .outerjoin(User, User.referral_id == Referral.id)
+        .group_by(Referral.id, Referral.code, Referral.description, Referral.is_active)
+        .order_by(Referral.id)
+    )
+
+
+def _build_snapshot(counts: Dict[str, int], referral_rows, now: datetime) -> Dict[str, Any]:
+    snapshot = {name: value or 0 for name, value in counts.items()}
+    snapshot['referrals'] = [
+        {
+            'id': row.id,
+            'code': row.code,
+            'description': row.description,
+            'is_active': bool(row.is_active),
+            'total': row.total or 0,
+            'ru': row.ru or 0,
+            'uz': row.uz or 0,
+        }
+        for row in referral_rows
+    ]
+    snapshot['updated_at'] = now.isoformat(timespec='seconds')
+    return snapshot
+
+
+def _snapshot_from_row(row: Optional[KpiSnapshot]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    try:
+        return json.loads(row.data)
+    except ValueError:
+        return None
+
+
+# ==================== ПАМЯТЬ ====================
+
+def set_snapshot(snapshot: Optional[Dict[str, Any]]) -> None:
+    """Положить снимок в память"""
+    global _snapshot
+    _snapshot = snapshot
+
+
+def get_cached_snapshot() -> Optional[Dict[str, Any]]:
+    """Снимок из памяти без обращения к БД (None, если ещё не считался)"""
+    return _snapshot
+
+
+def snapshot_age(snapshot: Optional[Dict[str, Any]]) -> Optional[timedelta]:
+    """Возраст снимка"""
+    if not snapshot or not snapshot.get('updated_at'):
+        return None
+    return datetime.utcnow() - datetime.fromisoformat(snapshot['updated_at'])
+
+
+def snapshot_local_time(snapshot: Optional[Dict[str, Any]]) -> Optional[datetime]:
+    """Время снимка по Ташкенту (для показа админам)"""
+    if not snapshot or not snapshot.get('updated_at'):
+        return None
+    updated = pytz.utc.localize(datetime.fromisoformat(snapshot['updated_at']))
+    return updated.astimezone(pytz.timezone(TIMEZONE))
+
+
+def _is_fresh(snapshot: Optional[Dict[str, Any]]) -> bool:
+    age = snapshot_age(snapshot)
+    return age is not None and age <= KPI_MAX_AGE
+
+
+# ==================== БОТ (ASYNC) ====================
+
+async def refresh_kpi_snapshot(persist: bool = True) -> Dict[str, Any]:
+    """Пересчитать снимок, сохранить в память и (опционально) в kpi_snapshots"""
+    global _refresh_lock
+    if _refresh_lock is None:
+        _refresh_lock = asyncio.Lock()
+
+    async with _refresh_lock:
+        now = datetime.utcnow()
+        async with get_db() as session:
+            counts = {}
+            for name, query in _count_queries(_today_start_utc(now)).items():
+                counts[name] = (await session.execute(query)).scalar()
+            referral_rows = (await session.execute(_referral_query())).all()
+
+            snapshot = _build_snapshot(counts, referral_rows, now)
+
+            if persist:
+                session.add(KpiSnapshot(created_at=now, data=json.dumps(snapshot, ensure_ascii=False)))
+                await session.execute(
+                    delete(KpiSnapshot).where(KpiSnapshot.created_at < now - timedelta(days=KPI_HISTORY_DAYS))
+                )
+                await session.commit()
+
+        set_snapshot(snapshot)
+        print(f"📊 KPI обновлены: users={snapshot['total_users']}, open_debts={snapshot['open_debts']}")
+        return snapshot
+
+
+async def get_kpi_snapshot(force: bool = False) -> Dict[str, Any]:
+    """
+    Снимок KPI для экранов админки.
+
+    Берётся из памяти; после рестарта — последний сохранённый в БД;
+    если он устарел (старше KPI_MAX_AGE) или force=True — пересчитывается.
+    """
+    if not force:
+        snapshot = get_cached_snapshot()
+        if _is_fresh(snapshot):
+            return snapshot
+
+        async with get_db() as session:
+            result = await session.execute(
+                select(KpiSnapshot).order_by(KpiSnapshot.created_at.desc()).limit(1)
+            )
+            snapshot = _snapshot_from_row(result.scalar_one_or_none())
+        if _is_fresh(snapshot):
+            set_snapshot(snapshot)
+            return snapshot
+
+    return await refresh_kpi_snapshot()
+
+
+# ==================== FLASK (SYNC) ====================
+
+def collect_kpi_snapshot_sync(session, persist: bool = True) -> Dict[str, Any]:
+    """Пересчитать снимок синхронной сессией (веб-админка)"""
+    now = datetime.utcnow()
+    counts = {
+        name: session.execute(query).scalar()
+        for name, query in _count_queries(_today_start_utc(now)).items()
+    }
+    snapshot = _build_snapshot(counts, session.execute(_referral_query()).all(), now)
+
+    if persist:
+        session.add(KpiSnapshot(created_at=now, data=json.dumps(snapshot, ensure_ascii=False)))
+        session.commit()
+
+    set_snapshot(snapshot)
+    return snapshot
+
+
+def get_kpi_snapshot_sync(session, force: bool = False) -> Dict[str, Any]:
+    """То же, что get_kpi_snapshot, для синхронной сессии Flask"""
+    if not force:
+        snapshot = get_cached_snapshot()
+        if _is_fresh(snapshot):
+            return snapshot
+
+        row = session.execute(
+            select(KpiSnapshot).order_by(KpiSnapshot.created_at.desc()).limit(1)
+        ).scalar_one_or_none()
+        snapshot = _snapshot_from_row(row)
+        if _is_fresh(snapshot):
+            set_snapshot(snapshot)
+            return snapshot
+
+    return collect_kpi_snapshot_sync(session)
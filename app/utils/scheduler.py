@@ -6,17 +6,27 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timedelta
 import asyncio
 import traceback
-import calendar
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+import pytz
+from typing import List, Optional, Set
 from app.database.models import Reminder
-from app.database.crud import (
-    get_due_reminders,
-    get_due_repeating_reminders,
-    update_reminder_due,
-    delete_reminder
-)
+from app.database.crud import delete_reminder
 from app.keyboards import main_menu, menu_button
 from app.keyboards.keyboards import back_menu_reminder_button
+from app.utils.delivery import delivery
+from app.utils.due_queue import due_queue, REMINDER, MESSAGE
+
+# Все пользовательские времена (notify_time, currency_notify_time) — по Ташкенту
+TIMEZONE = 'Asia/Tashkent'
+MINUTE_WHEEL_JOB_ID = 'minute_wheel'
+# За сколько дней до срока долг попадает в ежедневную сводку
+DIGEST_DAYS_AHEAD = 3
+# Ночная сверка user_balances с долгами
+BALANCES_JOB_ID = 'balances_reconcile'
+BALANCES_RECONCILE_HOUR = 4
+# Разовые напоминания, пропущенные за время простоя не больше этого, отправляются после старта
+ONE_SHOT_GRACE = timedelta(minutes=1)
+# Сколько напоминаний забирается одной транзакцией
+REMINDER_CLAIM_BATCH = 1000
 
 
 class ReminderScheduler:
@@ -25,6 +35,8 @@ class ReminderScheduler:
         self.bot = None
         self.started = False
         self.running = False
+        # Рассылки минутных бакетов, идущие в фоне после тика
+        self._sends: Set[asyncio.Task] = set()
         print("🔧 ReminderScheduler инициализирован")
 
     def set_bot(self, bot):
@@ -48,526 +60,334 @@ class ReminderScheduler:
             self.scheduler.shutdown()
             self.started = False
             self.running = False
+            if self._sends:
+                print(f"⚠️ Прерываем недоставленные рассылки бакетов: {len(self._sends)}")
+                for task in list(self._sends):
+                    task.cancel()
+                await asyncio.gather(*self._sends, return_exceptions=True)
             print("🔴 Планировщик напоминаний остановлен")
 
-    async def send_due_reminders(self):
-        """Отправить напоминания о просроченных долгах"""
-        print("\n" + "="*50)
-        print("📅 ЗАПУСК: send_due_reminders")
-        print("="*50)
-
+    def _spawn(self, coro) -> asyncio.Task:
+        """Запустить рассылку в фоне, не задерживая тик минутного колеса"""
+        task = asyncio.create_task(coro)
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+        return task
+
+    async def send_debt_digest(self, slot: str, digest: dict, today):
+        """
+        Ежедневная сводка долгов для всего минутного бакета.
+
+        digest — открытые долги со сроком в ближайшие 3 дня (и просроченные)
+        всех пользователей с notify_time == slot, выбранные тиком одним
+        запросом; здесь сообщения рендерятся и рассылаются.
+        """
         if not self.bot:
             print("❌ Bot не установлен в scheduler")
             return
 
         try:
-            from app.database import get_due_debts_for_reminders, get_user_data
-            from app.keyboards import tr, safe_str
-
-            today = datetime.now().strftime('%Y-%m-%d')
-            print(f"📆 Текущая дата: {today}")
-
-            due_debts = await get_due_debts_for_reminders(today)
-            print(f"📋 Получено долгов из БД: {len(due_debts)}")
-
-            if not due_debts:
-                print("✅ Просроченных долгов нет")
-                return
-
-            # Группируем долги по пользователям
-            user_debts = {}
-            for debt in due_debts:
-                user_id = debt['user_id']
-                if user_id not in user_debts:
-                    user_debts[user_id] = []
-                user_debts[user_id].append(debt)
-
-            print(f"👥 Пользователей с долгами: {len(user_debts)}")
-
-            # Отправляем напоминания каждому пользователю
-            for user_id, debts in user_debts.items():
-                try:
-                    print(f"📤 Отправка напоминания пользователю {user_id} ({len(debts)} долгов)")
-                    await self._send_user_reminder(user_id, debts)
-                    print(f"✅ Напоминание отправлено пользователю {user_id}")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки напоминания пользователю {user_id}: {e}")
-                    traceback.print_exc()
-
-        except Exception as e:
-            print(f"❌ Критическая ошибка в send_due_reminders: {e}")
-            traceback.print_exc()
-        finally:
-            print("="*50 + "\n")
-
-    async def send_daily_reminders(self, user_id: int):
-        """Отправить ежедневные напоминания конкретному пользователю"""
-        print("\n" + "="*50)
-        print(f"📅 ЗАПУСК: send_daily_reminders для user_id={user_id}")
-        print("="*50)
+            from app.database.crud import remember_user_lang
 
-        if not self.bot:
-            print("❌ Bot не установлен в scheduler")
-            return
+            print(f"📅 Сводка долгов {slot}: пользователей={len(digest)}")
 
-        try:
-            from app.database import get_open_debts
-            from app.keyboards import tr, safe_str
-
-            debts = await get_open_debts(user_id)
-            print(f"📋 Получено открытых долгов: {len(debts)}")
+            async def messages():
+                for user_id, entry in digest.items():
+                    # Язык уже пришёл из запроса — клавиатура не пойдёт в БД
+                    remember_user_lang(user_id, entry['lang'])
+                    text = self._render_debt_digest(entry['lang'], entry['debts'], today)
+                    if text:
+                        yield {
+                            'chat_id': user_id,
+                            'text': text,
+                            'reply_markup': await back_menu_reminder_button(user_id)
+                        }
 
-            if not debts:
-                print("ℹ️ У пользователя нет открытых долгов")
-                return
+            stats = await delivery.send_many(messages())
+            print(f"✅ Сводка {slot}: отправлено={stats['success']}, ошибок={stats['errors']}")
 
-            today = datetime.now().date()
-            upcoming_debts = []
+        except Exception as e:
+            print(f"❌ Ошибка в send_debt_digest ({slot}): {e}")
+            traceback.print_exc()
 
-            for debt in debts:
-                try:
-                    due_date = datetime.strptime(debt['due'], '%Y-%m-%d').date()
-                    days_left = (due_date - today).days
+    @staticmethod
+    def _render_debt_digest(lang: str, debts: list, today) -> Optional[str]:
+        """Текст ежедневной сводки (None, если напоминать не о чем)"""
+        from app.keyboards.texts import catalog
 
-                    if days_left <= 3:
-                        upcoming_debts.append((debt, days_left))
-                        print(f"  ⏰ Долг '{debt['person']}': осталось {days_left} дней")
-                except Exception as e:
-                    print(f"  ⚠️ Ошибка обработки долга: {e}")
-                    continue
+        t = catalog(lang)
+        message_lines = [t.get('daily_reminder_header')]
 
-            print(f"📊 Долгов требующих напоминания: {len(upcoming_debts)}")
+        for debt in debts:
+            # due приходит из БД уже как date
+            days_left = (debt['due'] - today).days
 
-            if not upcoming_debts:
-                print("ℹ️ Нет долгов требующих напоминания")
-                return
+            if days_left < 0:
+                status_text = t.get('overdue', days=abs(days_left))
+            elif days_left == 0:
+                status_text = t.get('due_today')
+            else:
+                status_text = t.get('due_in_days', days=days_left)
 
-            # Формируем сообщение
-            message_lines = [await tr(user_id, 'daily_reminder_header')]
+            if debt.get('direction', 'owed') == 'owed':
+                person_text = t.get('debtor_name', person=debt['person'])
+            else:
+                person_text = t.get('creditor_name', person=debt['person'])
 
-            for debt, days_left in upcoming_debts:
-                direction = debt.get('direction', 'owed')
+            message_lines.append(
+                f"• {person_text}: {debt['amount']} {debt.get('currency') or 'UZS'}\n"
+                f"  {status_text}"
+            )
 
-                if days_left < 0:
-                    status_text = await tr(user_id, 'overdue', days=abs(days_left))
-                elif days_left == 0:
-                    status_text = await tr(user_id, 'due_today')
-                else:
-                    status_text = await tr(user_id, 'due_in_days', days=days_left)
+        if len(message_lines) == 1:
+            return None
+        return '\n\n'.join(message_lines)
 
-                if direction == 'owed':
-                    person_text = await tr(user_id, 'debtor_name', person=debt['person'])
-                else:
-                    person_text = await tr(user_id, 'creditor_name', person=debt['person'])
+    async def dispatch_minute(self, slot: str = None) -> List[asyncio.Task]:
+        """
+        Тик минутного колеса: находит пользователей, у которых на эту минуту
+        (по Ташкенту) назначены напоминания о долгах или курс валют.
 
-                message_lines.append(
-                    f"• {person_text}: {debt['amount']} {debt.get('currency', 'UZS')}\n"
-                    f"  {status_text}"
-                )
+        Тик только выбирает бакеты, а рассылка идёт в фоне: большой бакет
+        шлётся дольше минуты, и ждать его здесь значило бы пропустить
+        следующий тик (max_instances=1). Возвращает запущенные задачи рассылки.
+        """
+        if not self.bot:
+            print("❌ Bot не установлен в scheduler")
+            return []
 
-            message_text = '\n\n'.join(message_lines)
+        if slot is None:
+            slot = datetime.now(pytz.timezone(TIMEZONE)).strftime('%H:%M')
 
-            print(f"📤 Отправка сообщения пользователю {user_id}")
-            await self.bot.send_message(user_id, message_text, reply_markup=await back_menu_reminder_button(user_id))
-            print(f"✅ Ежедневное напоминание отправлено пользователю {user_id}")
+        try:
+            from app.database.crud import get_debt_digest, get_users_by_currency_time
+
+            today = datetime.now(pytz.timezone(TIMEZONE)).date()
+            digest = await get_debt_digest(slot, today + timedelta(days=DIGEST_DAYS_AHEAD))
+            currency_users = await get_users_by_currency_time(slot)
+            if not digest and not currency_users:
+                return []
+
+            print(f"🕐 Бакет {slot}: сводка={len(digest)}, валюта={len(currency_users)}")
+            # Сводка и курсы идут независимо: большая сводка не задерживает курсы
+            tasks = []
+            if digest:
+                tasks.append(self._spawn(self.send_debt_digest(slot, digest, today)))
+            if currency_users:
+                tasks.append(self._spawn(self.send_currency_bucket(slot, currency_users)))
+            return tasks
 
         except Exception as e:
-            print(f"❌ Ошибка отправки ежедневного напоминания пользователю {user_id}: {e}")
+            print(f"❌ Ошибка в dispatch_minute ({slot}): {e}")
             traceback.print_exc()
-        finally:
-            print("="*50 + "\n")
-
-    async def _send_user_reminder(self, user_id: int, debts: list):
-        """Отправить напоминание конкретному пользователю"""
-        try:
-            from app.keyboards import tr, main_menu, safe_str
-
-            if len(debts) == 1:
-                debt = debts[0]
-                text = await tr(
-                    user_id,
-                    'single_reminder',
-                    person=safe_str(debt['person']),
-                    amount=safe_str(debt['amount']),
-                    currency=safe_str(debt.get('currency', 'UZS')),
-                    due=safe_str(debt['due'])
-                )
-            else:
-                text = await tr(user_id, 'multiple_reminders', count=len(debts))
-                for debt in debts:
-                    text += f"\n• {safe_str(debt['person'])}: {safe_str(debt['amount'])} {safe_str(debt.get('currency', 'UZS'))}"
-
-            kb = await main_menu(user_id)
+            return []
 
-            # основная попытка отправки
-            await self.bot.send_message(user_id, text, reply_markup=kb)
+    async def send_currency_bucket(self, slot: str, users: list):
+        """
+        Валютное уведомление для всего минутного бакета.
 
-        except TelegramBadRequest as e:
-            if "chat not found" in str(e):
-                print(f"❌ Пользователь {user_id} не найден (chat not found)")
-            else:
-                print(f"❌ BadRequest при отправке пользователю {user_id}: {e}")
+        Текст и клавиатура строятся один раз на язык, дальше бакет уходит
+        одним потоком через delivery.send_many — стоимость рассылки
+        определяется только лимитом отправки.
+        """
+        if not self.bot:
+            print("❌ Bot не установлен в scheduler")
+            return
 
-        except TelegramForbiddenError:
-            print(f"🚫 Пользователь {user_id} заблокировал бота")
+        try:
+            from app.database.crud import remember_user_lang
+            from app.utils.currency_api import get_currency_alert
+
+            rendered = {}
+
+            async def messages():
+                for user in users:
+                    lang = user['lang']
+                    # Язык уже пришёл из запроса — кладём в кэш для последующих нажатий
+                    remember_user_lang(user['user_id'], lang)
+                    if lang not in rendered:
+                        rendered[lang] = (
+                            await get_currency_alert(lang),
+                            await back_menu_reminder_button({'lang': lang})
+                        )
+                    text, markup = rendered[lang]
+                    yield {'chat_id': user['user_id'], 'text': text, 'reply_markup': markup}
 
-        except TelegramRetryAfter as e:
-            print(f"⏳ Flood control для {user_id}, ждем {e.retry_after} секунд")
-            await asyncio.sleep(e.retry_after)
-            # повторяем попытку
-            return await self._send_user_reminder(user_id, debts)
+            stats = await delivery.send_many(messages())
+            print(f"✅ Курсы {slot}: отправлено={stats['success']}, ошибок={stats['errors']}")
 
         except Exception as e:
-            print(f"⚠️ Неизвестная ошибка при отправке пользователю {user_id}: {e}")
+            print(f"❌ Ошибка в send_currency_bucket ({slot}): {e}")
             traceback.print_exc()
 
     async def schedule_all_reminders(self):
-        """Перепланировать все напоминания для всех пользователей"""
+        """
+        Зарегистрировать глобальные задачи.
+
+        Вместо отдельной cron-задачи на каждого пользователя работает одно
+        минутное колесо (minute_wheel): раз в минуту оно выбирает из БД
+        бакет пользователей с notify_time / currency_notify_time == 'HH:MM'.
+        Поэтому изменения времени в настройках применяются без перепланирования.
+        """
         print("\n" + "=" * 70)
         print("🔄 ЗАПУСК: schedule_all_reminders")
         print("=" * 70)
 
         try:
-            from app.database import get_all_users
-
-            # Очищаем все существующие задачи
-            existing_jobs = self.scheduler.get_jobs()
-            print(f"🗑️ Существующих задач перед очисткой: {len(existing_jobs)}")
-
+            # Убираем задачи старого формата (по одной на пользователя)
             removed_count = 0
-            for job in existing_jobs:
-                if job.id.startswith((
-                        'user_reminder_',
-                        'user_currency_',
-                        'general_reminders_',
-                        'repeating_reminders'
-                )):
-                    print(f"  🗑️ Удаляем задачу: {job.id}")
+            for job in self.scheduler.get_jobs():
+                if job.id.startswith(('user_reminder_', 'user_currency_')):
                     job.remove()
                     removed_count += 1
 
-            print(f"✅ Удалено задач: {removed_count}")
-
-            # Получаем всех пользователей
-            users = await get_all_users()
-            print(f"👥 Получено пользователей из БД: {len(users)}")
-
-            debt_reminders_count = 0
-            currency_reminders_count = 0
-
-            # Планируем индивидуальные задачи
-            for user in users:
-                user_id = user['user_id']
-
-                # Напоминания о долгах
-                notify_time = user.get('notify_time')
-                if notify_time:
-                    try:
-                        hour, minute = map(int, notify_time.split(':'))
-                        self.scheduler.add_job(
-                            self.send_daily_reminders,
-                            'cron',
-                            hour=hour,
-                            minute=minute,
-                            timezone='Asia/Tashkent',
-                            id=f'user_reminder_{user_id}',
-                            args=[user_id],
-                            replace_existing=True
-                        )
-                        debt_reminders_count += 1
-                    except Exception as e:
-                        print(f"  ❌ Ошибка планирования напоминаний о долгах: {e}")
-                        traceback.print_exc()
-
-                # Валютные уведомления
-                currency_time = user.get('currency_notify_time')
-                if currency_time:
-                    try:
-                        hour, minute = map(int, currency_time.split(':'))
-                        self.scheduler.add_job(
-                            self.send_currency_alerts,
-                            'cron',
-                            hour=hour,
-                            minute=minute,
-                            timezone='Asia/Tashkent',
-                            id=f'user_currency_{user_id}',
-                            args=[user_id],
-                            replace_existing=True
-                        )
-                        currency_reminders_count += 1
-                    except Exception as e:
-                        print(f"  ❌ Ошибка планирования валютных уведомлений: {e}")
-                        traceback.print_exc()
+            if removed_count:
+                print(f"🗑️ Удалено персональных задач: {removed_count}")
 
-            # Глобальные задачи (только одна копия каждой!)
             print("\n🌐 Добавление глобальных задач:")
 
             self.scheduler.add_job(
-                self.send_general_reminders,
-                'interval',
-                minutes=1,
-                timezone='Asia/Tashkent',
-                id='general_reminders_global',
-                replace_existing=True
+                self.dispatch_minute,
+                'cron',
+                minute='*',
+                timezone=TIMEZONE,
+                id=MINUTE_WHEEL_JOB_ID,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                misfire_grace_time=30
+            )
+            print(f"  ➕ Добавлена {MINUTE_WHEEL_JOB_ID}")
+
+            self.scheduler.add_job(
+                self.reconcile_balances,
+                'cron',
+                hour=BALANCES_RECONCILE_HOUR,
+                minute=0,
+                timezone=TIMEZONE,
+                id=BALANCES_JOB_ID,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
             )
-            print("  ➕ Добавлена general_reminders_global")
+            print(f"  ➕ Добавлена {BALANCES_JOB_ID}")
 
+            from app.utils.kpi import KPI_JOB_ID, KPI_REFRESH_MINUTES
             self.scheduler.add_job(
-                self.send_repeating_reminders,
+                self.refresh_kpi,
                 'interval',
-                minutes=1,
-                timezone='Asia/Tashkent',
-                id='repeating_reminders_global',
-                replace_existing=True
+                minutes=KPI_REFRESH_MINUTES,
+                id=KPI_JOB_ID,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                next_run_time=datetime.now()
             )
-            print("  ➕ Добавлена repeating_reminders_global")
+            print(f"  ➕ Добавлена {KPI_JOB_ID}")
+
+            # Напоминания и отложенные сообщения — через очередь сроков, без опроса БД
+            self.register_due_queue()
+            print("  ➕ Напоминания и сообщения переданы очереди сроков")
 
-            # Итоговая статистика
             all_jobs = self.scheduler.get_jobs()
             print(f"\n📊 ИТОГОВАЯ СТАТИСТИКА:")
-            print(f"   ✅ Напоминаний о долгах: {debt_reminders_count}")
-            print(f"   ✅ Валютных уведомлений: {currency_reminders_count}")
-            print(f"   ✅ Глобальных задач: 2")
+            print(f"   ✅ Глобальных задач: 3")
             print(f"   📋 Всего активных задач: {len(all_jobs)}")
 
-
-
         except Exception as e:
             print(f"❌ КРИТИЧЕСКАЯ ОШИБКА в schedule_all_reminders: {e}")
             traceback.print_exc()
         finally:
             print("=" * 70 + "\n")
 
-    async def send_broadcast_to_all_users(self, text: str, photo_id: str = None, admin_id: int = None):
-        """Отправить рассылку всем пользователям"""
-        if not self.bot:
-            return 0, 0, []
-
+    async def reconcile_balances(self):
+        """Пересчитать user_balances с нуля (страховка от рассинхронизации)"""
         try:
-            from app.database import get_all_users
-
-            users = await get_all_users()
-            success_count = 0
-            error_count = 0
-            blocked_users = []
-
-            for user in users:
-                user_id = user['user_id']
-                try:
-                    if photo_id:
-                        await self.bot.send_photo(user_id, photo_id, caption=text)
-                    else:
-                        await self.bot.send_message(user_id, text)
-                    success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    blocked_users.append(user_id)
-                    print(f"❌ Ошибка отправки пользователю {user_id}: {e}")
-
-                await asyncio.sleep(0.05)
-
-            return success_count, error_count, blocked_users
+            from app.database.crud import rebuild_user_balances
 
+            rows = await rebuild_user_balances()
+            print(f"⚖️ Балансы пересчитаны: строк={rows}")
         except Exception as e:
-            print(f"❌ Ошибка в send_broadcast_to_all_users: {e}")
-            return 0, 0, []
+            print(f"❌ Ошибка сверки балансов: {e}")
+            traceback.print_exc()
 
-    async def send_scheduled_broadcast_with_stats(self, text: str, photo_id: str = None, admin_id: int = None):
-        """Отправить запланированную рассылку со статистикой"""
-        success, errors, blocked = await self.send_broadcast_to_all_users(text, photo_id, admin_id)
+    async def refresh_kpi(self):
+        """Обновить снимок KPI админки"""
+        try:
+            from app.utils.kpi import refresh_kpi_snapshot
 
-        if admin_id:
-            try:
-                stats_text = f"📢 Рассылка завершена!\n\n✅ Отправлено: {success}\n❌ Ошибок: {errors}"
-                await self.bot.send_message(admin_id, stats_text)
-            except Exception as e:
-                print(f"❌ Ошибка отправки статистики админу {admin_id}: {e}")
+            await refresh_kpi_snapshot()
+        except Exception as e:
+            print(f"❌ Ошибка обновления KPI: {e}")
+            traceback.print_exc()
 
     def add_job(self, *args, **kwargs):
         """Обёртка для add_job"""
         return self.scheduler.add_job(*args, **kwargs)
 
-    async def send_general_reminders(self):
-        """Проверка и отправка одноразовых напоминаний"""
-        print("\n" + "=" * 50)
-        print("⏰ ЗАПУСК: send_general_reminders")
-        print("=" * 50)
-
-        if not self.bot:
-            print("❌ Bot не установлен в scheduler")
-            return
-
-        try:
-            from app.database.crud import update_reminder
-            from app.database.connection import AsyncSessionLocal  # 👈 Правильный импорт
-
-            now = datetime.now().replace(second=0, microsecond=0)
-            print(f"🕐 Текущее время: {now}")
-
-            reminders = await get_due_reminders(now)
-            print(f"📋 Получено напоминаний из БД: {len(reminders)}")
-
-            if not reminders:
-                print("ℹ️ Нет одноразовых напоминаний для отправки")
-                return
-
-            for idx, r in enumerate(reminders, 1):
-                print(f"\n📝 Напоминание {idx}/{len(reminders)}:")
-                print(f"   ID: {r['id']}")
-                print(f"   user_id: {r['user_id']}")
-                print(f"   text: {r['text']}")
-                print(f"   due: {r['due']}")
-                print(f"   is_active: {r.get('is_active', 'N/A')}")
-
-                try:
-                    # 👇 Создаём сессию для обновления
-                    async with AsyncSessionLocal() as session:
-                        print(f"   ⏳ Деактивация напоминания...")
-                        updated = await update_reminder(session, r['id'], is_active=False)
-                        print(f"   {'✅' if updated else '❌'} Деактивация: {updated}")
-
-                    text = f"⏰ {r['text']}\n🕒 {r['due']}"
-                    print(f"   📤 Отправка сообщения пользователю {r['user_id']}")
-                    await self.bot.send_message(r['user_id'], text, reply_markup= await back_menu_reminder_button(r['user_id']))
-                    print(f"   ✅ Напоминание отправлено")
+    def register_due_queue(self):
+        """Зарегистрировать напоминания и отложенные сообщения в очереди сроков"""
+        from app.database.crud import get_reminder_due_times, get_pending_message_times
+        from app.utils.broadcast import deliver_scheduled_messages
 
-                except Exception as e:
-                    print(f"   ❌ Ошибка отправки напоминания: {e}")
-                    traceback.print_exc()
+        async def load_reminders():
+            return await get_reminder_due_times(datetime.now() - ONE_SHOT_GRACE)
 
-        except Exception as e:
-            print(f"❌ Критическая ошибка в send_general_reminders: {e}")
-            traceback.print_exc()
-        finally:
-            print("=" * 50 + "\n")
+        due_queue.register(REMINDER, load_reminders, self.deliver_reminders)
+        due_queue.register(MESSAGE, get_pending_message_times, deliver_scheduled_messages)
 
-    async def send_currency_alerts(self, user_id: int):
-        """Отправить валютное уведомление конкретному пользователю"""
-        print("\n" + "=" * 50)
-        print(f"💱 ЗАПУСК: send_currency_alerts для user_id={user_id}")
-        print(f"🕐 Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"🤖 Bot установлен: {self.bot is not None}")
-        print("=" * 50)
+    async def deliver_reminders(self, reminder_ids: list):
+        """
+        Отправить напоминания, срок которых наступил (вызывается очередью сроков).
 
+        Вся пачка забирается одной транзакцией (claim_due_reminders): разовые
+        выключаются, повторяющимся сразу записывается следующий срок. Затем
+        сообщения уходят параллельно через delivery.send_many, а новые сроки
+        возвращаются в очередь.
+        """
         if not self.bot:
             print("❌ Bot не установлен в scheduler")
             return
 
-        try:
-            from app.utils.currency_api import format_currency_notification
-            from app.keyboards import tr
-
-            print(f"📥 Импорты успешны")
-            print(f"🌐 Запрос валютных данных для user {user_id}...")
-
-            message = await format_currency_notification(user_id, tr)
-
-            print(f"📝 Сообщение сформировано:")
-            print(f"   Длина: {len(message)} символов")
-            print(f"   Первые 200 символов: {message[:200]}")
-
-            print(f"📤 Попытка отправки боту...")
-            result = await self.bot.send_message(user_id, message, reply_markup=await back_menu_reminder_button(user_id))
-            print(f"✅ Сообщение отправлено! Message ID: {result.message_id}")
-
-        except Exception as e:
-            print(f"❌ ОШИБКА валютного уведомления: {e}")
-            import traceback
-            traceback.print_exc()
-        finally:
-            print("=" * 50 + "\n")
+        from app.database.crud import claim_due_reminders, remember_user_lang
 
-    async def send_repeating_reminders(self):
-        """Проверка и отправка повторяющихся напоминаний"""
-        print("\n" + "="*50)
-        print("🔁 ЗАПУСК: send_repeating_reminders")
-        print("="*50)
-
-        if not self.bot:
-            print("❌ Bot не установлен в scheduler")
+        now = datetime.now()
+        claimed = []
+        # Пачками — чтобы IN (...) не упёрся в лимит параметров драйвера
+        for start in range(0, len(reminder_ids), REMINDER_CLAIM_BATCH):
+            claimed += await claim_due_reminders(reminder_ids[start:start + REMINDER_CLAIM_BATCH], now)
+        print(f"⏰ Напоминаний к отправке: {len(claimed)} (из очереди: {len(reminder_ids)})")
+        if not claimed:
             return
 
-        try:
-            now = datetime.now().replace(second=0, microsecond=0)
-            print(f"🕐 Текущее время: {now}")
-
-            reminders = await get_due_repeating_reminders(now)
-            print(f"📋 Получено повторяющихся напоминаний из БД: {len(reminders)}")
-
-            if not reminders:
-                print("ℹ️ Нет повторяющихся напоминаний для отправки")
-                return
-
-            for idx, r in enumerate(reminders, 1):
-                print(f"\n📝 Повторяющееся напоминание {idx}/{len(reminders)}:")
-                print(f"   ID: {r['id']}")
-                print(f"   user_id: {r['user_id']}")
-                print(f"   text: {r['text']}")
-                print(f"   due: {r['due']}")
-                print(f"   repeat: {r['repeat']}")
-                print(f"   is_active: {r.get('is_active', 'N/A')}")
-
-                user_id = r['user_id']
-
-                try:
-                    due_time = r['due']
-                    if isinstance(due_time, datetime):
-                        due_time = due_time.replace(second=0, microsecond=0)
-                    print(f"   ⏰ due_time (normalized): {due_time}")
-
-                    # Проверяем время
-                    if due_time > now:
-                        print(f"   ⏭️ ПРОПУСК: due в будущем ({due_time} > {now})")
-                        continue
-
-                    print(f"   ✅ Напоминание готово к отправке")
-
+        for r in claimed:
+            if r['next_due'] is not None:
+                due_queue.push(REMINDER, r['id'], r['next_due'])
+            elif r['repeat'] != "none":
+                print(f"⚠️ Напоминание {r['id']}: неизвестный repeat={r['repeat']!r}")
+
+        markups = {}
+
+        async def markup(builder, lang):
+            # Клавиатуры зависят только от языка — строим по одной на язык
+            key = (builder, lang)
+            if key not in markups:
+                markups[key] = await builder({'lang': lang})
+            return markups[key]
+
+        async def messages():
+            for r in claimed:
+                remember_user_lang(r['user_id'], r['lang'])
+                if r['repeat'] == "none":
+                    text = f"⏰ {r['text']}\n🕒 {r['due']}"
+                    reply_markup = await markup(back_menu_reminder_button, r['lang'])
+                else:
                     text = f"⏰ {r['text']}"
-                    print(f"   📤 Отправка сообщения пользователю {user_id}")
-                    await self.bot.send_message(user_id, text, reply_markup=await main_menu(user_id))
-                    print(f"   ✅ Сообщение отправлено")
-
-                    # Рассчитываем следующую дату
-                    new_due = None
-                    print(f"   🔄 Расчёт следующей даты (repeat={r['repeat']})")
+                    reply_markup = await markup(main_menu, r['lang'])
+                yield {'chat_id': r['user_id'], 'text': text, 'reply_markup': reply_markup}
 
-                    if r['repeat'] == "daily":
-                        new_due = due_time + timedelta(days=1)
-                        print(f"   📅 Следующая дата (daily): {new_due}")
-
-                    elif r['repeat'] == "monthly":
-                        current_month = due_time.month
-                        current_year = due_time.year
-
-                        next_month = current_month + 1
-                        next_year = current_year
-
-                        if next_month > 12:
-                            next_month = 1
-                            next_year += 1
-
-                        max_day = calendar.monthrange(next_year, next_month)[1]
-                        next_day = min(due_time.day, max_day)
-
-                        new_due = due_time.replace(year=next_year, month=next_month, day=next_day)
-                        print(f"   📅 Следующая дата (monthly): {new_due}")
-
-                    if new_due:
-                        print(f"   💾 Обновление даты в БД...")
-                        await update_reminder_due(r['id'], new_due)
-                        print(f"   ✅ Дата обновлена на {new_due}")
-                    else:
-                        print(f"   ⚠️ Не удалось рассчитать новую дату")
-
-                except Exception as e:
-                    print(f"   ❌ Ошибка обработки напоминания: {e}")
-                    traceback.print_exc()
-
-        except Exception as e:
-            print(f"❌ Критическая ошибка в send_repeating_reminders: {e}")
-            traceback.print_exc()
-        finally:
-            print("="*50 + "\n")
+        stats = await delivery.send_many(messages())
+        print(f"✅ Напоминания: отправлено={stats['success']}, ошибок={stats['errors']}")
 
 
 # Создаем глобальный экземпляр планировщика
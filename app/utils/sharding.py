@@ -0,0 +1,230 @@
+"""
+Шардирование апдейтов по процессам-воркерам
+
+При BOT_WORKERS > 0 главный процесс только принимает апдейты (polling или
+webhook) и раскладывает их по воркерам: воркер = user_id % BOT_WORKERS.
+Каждый воркер — отдельный процесс со своим event loop, хендлерами и пулом
+соединений к общей БД, поэтому тяжёлый запрос одного пользователя (Excel,
+разбор ответа AI) не тормозит остальных.
+
+Апдейты одного пользователя всегда попадают в один воркер и выполняются
+там строго по очереди, разные пользователи — параллельно. Пользователь
+занимает не больше одного слота: его следующие апдейты ждут в очереди
+и не мешают остальным. Поэтому кэш FSM-хранилища в воркере согласован:
+состояния его пользователей меняет только он.
+
+Фоновые задачи (планировщик, очередь сроков, рассылки, веб-админка)
+работают только в главном процессе. Воркер передаёт ему операции через
+to_main(), главный процесс выполняет их обработчиками из ops.
+"""
+import asyncio
+import inspect
+import multiprocessing
+import queue
+import signal
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+# Сколько апдейтов может ждать в очереди одного воркера
+SHARD_QUEUE_SIZE = 10000
+# Сколько апдейтов воркер обрабатывает одновременно (разных пользователей)
+WORKER_CONCURRENCY = 100
+# Сколько ждать, пока воркер доработает начатое при остановке (сек)
+WORKER_STOP_TIMEOUT = 30
+
+# В процессе-воркере — очередь операций для главного процесса
+_control = None
+
+
+def in_worker() -> bool:
+    """Код выполняется в процессе-воркере"""
+    return _control is not None
+
+
+def to_main(op: str, *args) -> bool:
+    """
+    Передать операцию главному процессу.
+
+    False — мы и есть главный процесс (или шардирование выключено),
+    вызывающий выполняет операцию сам.
+    """
+    if _control is None:
+        return False
+    _control.put((op, args))
+    return True
+
+
+def shard_key(update: Update, data: Dict[str, Any]) -> int:
+    """Ключ шарда: пользователь, иначе чат, иначе сам апдейт"""
+    user = data.get('event_from_user')
+    if user is not None:
+        return user.id
+    chat = data.get('event_chat')
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+# ==================== ГЛАВНЫЙ ПРОЦЕСС ====================
+
+class ShardRouter(BaseMiddleware):
+    """
+    Outer-middleware диспетчера главного процесса: вместо обработки
+    кладёт апдейт в очередь воркера своего пользователя.
+    """
+
+    def __init__(self, workers: int, target: Callable, ops: Dict[str, Callable]):
+        """
+        workers — число процессов,
+        target(index, inbox, control) — точка входа воркера (функция модуля),
+        ops — обработчики операций to_main() из воркеров.
+        """
+        self.workers = workers
+        self.target = target
+        self.ops = ops
+        # spawn: воркер стартует с чистого интерпретатора, без потоков и loop родителя
+        self._ctx = multiprocessing.get_context('spawn')
+        self._inboxes = [self._ctx.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self._control = self._ctx.Queue()
+        self._processes: List[multiprocessing.Process] = []
+        self._reader: Optional[asyncio.Task] = None
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        key = shard_key(event, data)
+        item = (key, event.model_dump(mode='json', exclude_unset=True, by_alias=True))
+        inbox = self._inboxes[key % self.workers]
+        while True:
+            try:
+                inbox.put_nowait(item)
+                return None
+            except queue.Full:
+                # Воркер не успевает — придерживаем приём, Telegram подождёт
+                await asyncio.sleep(0.05)
+
+    async def start(self):
+        """Запустить воркеры и чтение операций от них"""
+        for index, inbox in enumerate(self._inboxes):
+            process = self._ctx.Process(
+                target=self.target, args=(index, inbox, self._control),
+                name=f'bot-worker-{index}', daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        self._reader = asyncio.create_task(self._read_control())
+        print(f"✅ Запущено воркеров: {self.workers}")
+
+    async def stop(self):
+        """Дать воркерам доработать очередь и остановить их"""
+        loop = asyncio.get_running_loop()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, WORKER_STOP_TIMEOUT + 5)
+            if process.is_alive():
+                print(f"⚠️ {process.name} не остановился, завершаем принудительно")
+                process.terminate()
+        self._processes.clear()
+
+        if self._reader is not None:
+            self._control.put(None)
+            await self._reader
+            self._reader = None
+        print("🔴 Воркеры остановлены")
+
+    async def _read_control(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._control.get)
+            if item is None:
+                return
+            op, args = item
+            handler = self.ops.get(op)
+            if handler is None:
+                print(f"⚠️ Неизвестная операция от воркера: {op}")
+                continue
+            try:
+                result = handler(*args)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"❌ Ошибка операции {op} от воркера: {e}")
+
+
+# ==================== ВОРКЕР ====================
+
+async def _run_user(dp: Dispatcher, bot: Bot, key: int, update: Update,
+                    backlog: Dict[int, Deque[Update]], slots: asyncio.Semaphore):
+    """
+    Обработать апдейты одного пользователя по очереди, занимая один слот.
+    Следующие апдейты этого пользователя ждут в backlog и слотов не держат.
+    """
+    try:
+        while True:
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                print(f"❌ Воркер: ошибка обработки апдейта {update.update_id}: {e}")
+            if not backlog[key]:
+                return
+            update = backlog[key].popleft()
+    finally:
+        del backlog[key]
+        slots.release()
+
+
+async def _serve(index: int, dp: Dispatcher, bot: Bot, inbox):
+    loop = asyncio.get_running_loop()
+    workflow_data = {'dispatcher': dp, 'bot': bot, **dp.workflow_data}
+    await dp.emit_startup(**workflow_data)
+    print(f"👷 Воркер {index} готов")
+
+    # Пользователи, чьи апдейты сейчас обрабатываются: ключ -> ждущие апдейты
+    backlog: Dict[int, Deque[Update]] = {}
+    running: Set[asyncio.Task] = set()
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, inbox.get)
+            if item is None:
+                break
+            key, raw = item
+            try:
+                update = Update.model_validate(raw, context={"bot": bot})
+            except Exception as e:
+                print(f"⚠️ Воркер {index}: некорректный апдейт: {e}")
+                continue
+
+            if key in backlog:
+                # Пользователь уже обрабатывается — апдейт встанет за предыдущими
+                backlog[key].append(update)
+                continue
+
+            # Слот занимает только первый апдейт пользователя
+            await slots.acquire()
+            backlog[key] = deque()
+            task = asyncio.create_task(_run_user(dp, bot, key, update, backlog, slots))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        if running:
+            await asyncio.wait(list(running), timeout=WORKER_STOP_TIMEOUT)
+        await dp.emit_shutdown(**workflow_data)
+        print(f"👋 Воркер {index} остановлен")
+
+
+def run_shard_worker(index: int, dp: Dispatcher, bot: Bot, inbox, control):
+    """Тело процесса-воркера: обрабатывать апдейты из inbox до сигнала остановки"""
+    global _control
+    _control = control
+    # Остановкой управляет главный процесс (через очередь), а не Ctrl+C / SIGTERM группе
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_serve(index, dp, bot, inbox))
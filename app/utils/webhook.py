@@ -0,0 +1,140 @@
+"""
+Режим webhook
+
+Telegram сам присылает апдейты POST-запросами на WEBHOOK_PATH, aiohttp
+отвечает 200 сразу, а апдейт обрабатывается в фоне. Одновременно
+обрабатывается не больше WEBHOOK_MAX_CONCURRENCY апдейтов: когда все слоты
+заняты, ответ Telegram задерживается, и он сам снижает темп отправки.
+
+При остановке (SIGTERM / SIGINT) новые апдейты получают 503 — Telegram
+пришлёт их повторно после перезапуска, — а начатые дорабатывают не дольше
+WEBHOOK_DRAIN_TIMEOUT секунд.
+"""
+import asyncio
+import signal
+from typing import List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from app.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_MAX_CONCURRENCY
+)
+
+# Сколько ждать завершения начатых апдейтов при остановке (сек)
+WEBHOOK_DRAIN_TIMEOUT = 30
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateProcessor:
+    """Ограниченная параллельная обработка апдейтов с плавной остановкой"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.max_concurrency = max_concurrency
+        self.accepting = True
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """POST от Telegram"""
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if not self.accepting:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"⚠️ Webhook: некорректный апдейт: {e}")
+            return web.Response(status=400)
+
+        # Ждём свободный слот, не отвечая, — так Telegram притормаживает сам
+        await self._slots.acquire()
+        if not self.accepting:
+            self._slots.release()
+            return web.Response(status=503)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            print(f"❌ Webhook: ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Перестать принимать апдейты и дождаться начатых"""
+        self.accepting = False
+        if not self._tasks:
+            return
+
+        print(f"⏳ Webhook: дожидаемся {len(self._tasks)} апдейтов...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            print(f"⚠️ Webhook: не успели {len(pending)} апдейтов, отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _stop_event() -> asyncio.Event:
+    """Событие, которое выставляют SIGTERM / SIGINT"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка только через KeyboardInterrupt
+            pass
+    return stop
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, stop: Optional[asyncio.Event] = None,
+                      allowed_updates: Optional[List[str]] = None):
+    """Запустить бота в режиме webhook и работать до сигнала остановки"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_URL")
+
+    processor = UpdateProcessor(dp, bot)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, processor.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+
+    stop = stop or _stop_event()
+    workflow_data = {'dispatcher': dp, 'bot': bot, **dp.workflow_data}
+    await dp.emit_startup(**workflow_data)
+    try:
+        await site.start()
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates if allowed_updates is not None else dp.resolve_used_update_types(),
+            max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100)
+        )
+        print(f"🌐 Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} "
+              f"(параллельно до {WEBHOOK_MAX_CONCURRENCY} апдейтов)")
+
+        await stop.wait()
+        print("🛑 Webhook: остановка...")
+    finally:
+        # Webhook у Telegram не снимаем: апдейты подождут следующего запуска
+        await processor.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(**workflow_data)
@@ -0,0 +1,80 @@
+import asyncio
+
+from app.database import crud
+from app.utils.scheduler import ReminderScheduler
+
+
+def test_slow_slot_does_not_block_next_tick(monkeypatch):
+    async def scenario():
+        wheel = ReminderScheduler()
+        wheel.bot = object()
+        release = asyncio.Event()
+        sent = []
+
+        async def get_debt_digest(slot, due_until):
+            return {1: {'lang': 'ru', 'debts': []}}
+
+        async def get_users_by_currency_time(slot):
+            return []
+
+        async def send_debt_digest(slot, digest, today):
+            # Бакет 09:00 «шлётся» дольше минуты — пока его не отпустят
+            if slot == '09:00':
+                await release.wait()
+            sent.append(slot)
+
+        monkeypatch.setattr(crud, 'get_debt_digest', get_debt_digest)
+        monkeypatch.setattr(crud, 'get_users_by_currency_time', get_users_by_currency_time)
+        monkeypatch.setattr(wheel, 'send_debt_digest', send_debt_digest)
+
+        # Тик возвращается сразу, не дожидаясь рассылки
+        slow = await asyncio.wait_for(wheel.dispatch_minute('09:00'), 1)
+        fast = await asyncio.wait_for(wheel.dispatch_minute('09:01'), 1)
+
+        await asyncio.wait_for(asyncio.gather(*fast), 1)
+        assert sent == ['09:01']
+        assert not any(task.done() for task in slow)
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*slow), 1)
+        await asyncio.sleep(0)
+        assert sent == ['09:01', '09:00']
+        assert not wheel._sends
+
+    asyncio.run(scenario())
+
+
+def test_currency_bucket_does_not_wait_for_digest(monkeypatch):
+    async def scenario():
+        wheel = ReminderScheduler()
+        wheel.bot = object()
+        release = asyncio.Event()
+        sent = []
+
+        async def get_debt_digest(slot, due_until):
+            return {1: {'lang': 'ru', 'debts': []}}
+
+        async def get_users_by_currency_time(slot):
+            return [{'user_id': 2, 'lang': 'ru'}]
+
+        async def send_debt_digest(slot, digest, today):
+            await release.wait()
+            sent.append('digest')
+
+        async def send_currency_bucket(slot, users):
+            sent.append('currency')
+
+        monkeypatch.setattr(crud, 'get_debt_digest', get_debt_digest)
+        monkeypatch.setattr(crud, 'get_users_by_currency_time', get_users_by_currency_time)
+        monkeypatch.setattr(wheel, 'send_debt_digest', send_debt_digest)
+        monkeypatch.setattr(wheel, 'send_currency_bucket', send_currency_bucket)
+
+        digest, currency = await asyncio.wait_for(wheel.dispatch_minute('09:00'), 1)
+        await asyncio.wait_for(currency, 1)
+        assert sent == ['currency']
+
+        release.set()
+        await asyncio.wait_for(digest, 1)
+        assert sent == ['currency', 'digest']
+
+    asyncio.run(scenario())